@@ -0,0 +1,53 @@
+"""
+Goodreads scraper for the book cover dataset.
+
+The public API is re-exported here and each name is imported from its module
+on first access, so `from scraper import extract_book_details` loads only the
+parser and none of the crawl machinery:
+
+    from scraper import extract_book_details, fetch_page
+    details = extract_book_details(fetch_page(url, headers), url)
+
+The crawl itself runs through the `goodreads-scraper` command
+(scraper.goodreads_scraper:main).
+"""
+import importlib
+
+_EXPORTS = {
+    # parsing
+    "extract_book_details": "book_parser",
+    "extract_structured_data": "book_parser",
+    "extract_book_links_from_list_page": "goodreads_scraper",
+    "get_next_goodreads_page_url": "goodreads_scraper",
+    # fetching / downloading
+    "fetch_page": "goodreads_scraper",
+    "download_image": "goodreads_scraper",
+    "request_page": "crawl_engine",
+    "request_image": "crawl_engine",
+    "request_image_bytes": "crawl_engine",
+    "AsyncFetcher": "crawl_engine",
+    "build_session": "http_session",
+    "HttpCache": "http_cache",
+    # crawl driver and storage
+    "GoodreadsCrawler": "goodreads_scraper",
+    "main": "goodreads_scraper",
+    "CrawlState": "crawl_state",
+    "CoverStore": "cover_store",
+    "JsonlWriter": "record_store",
+    "iter_records": "record_store",
+    "Metrics": "metrics",
+}
+
+__all__ = sorted(_EXPORTS)
+
+
+def __getattr__(name: str):
+    if name not in _EXPORTS:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    value = getattr(importlib.import_module(f".{_EXPORTS[name]}", __name__), name)
+    globals()[name] = value  # later lookups skip __getattr__
+    return value
+
+
+def __dir__() -> list[str]:
+    return sorted(set(globals()) | set(_EXPORTS))
@@ -0,0 +1,357 @@
+"""
+Parsing of Goodreads book detail pages.
+
+Kept separate from the crawl driver so it can be imported on its own (for
+benchmarks, re-parsing cached pages, or running in a process pool) and so the
+parser state below is built once per process instead of once per book.
+
+Modern book pages embed their metadata as JSON (a schema.org JSON-LD block
+and the Next.js `__NEXT_DATA__` blob). Those are pulled straight out of the raw
+HTML first, and a soup is only built for whatever fields they did not cover.
+
+There are two ways to build that soup:
+    - the reference path parses the whole page with the pure-Python html.parser
+    - the fast path uses lxml when bs4 can build trees with it and only builds the subtrees
+      of the handful of elements `extract_book_details` actually looks at
+"""
+import html
+import json
+import re
+import time
+
+from bs4 import BeautifulSoup, SoupStrainer
+from bs4.builder import builder_registry
+
+# bs4 only registers its lxml tree builder when lxml actually works, so ask bs4 rather than
+# just importing lxml (an lxml that imports but cannot build trees would fail every parse)
+FAST_PARSER = 'lxml' if builder_registry.lookup('lxml') is not None else 'html.parser'
+
+# Compiled once at import instead of on every book
+PAGES_RE = re.compile(r'(\d+)\s+pages')
+PUBLISHED_YEAR_RE = re.compile(r'published\s+(\d{4})')
+YEAR_RE = re.compile(r'\b(\d{4})\b')
+RATINGS_RE = re.compile(r'(\d+)\s+ratings')
+REVIEWS_RE = re.compile(r'(\d+)\s+reviews')
+JSON_LD_RE = re.compile(r'<script[^>]*type="application/ld\+json"[^>]*>(.*?)</script>', re.DOTALL)
+NEXT_DATA_RE = re.compile(r'<script[^>]*id="__NEXT_DATA__"[^>]*>(.*?)</script>', re.DOTALL)
+BOOK_ID_RE = re.compile(r'/book/show/(\d+)')
+TAG_RE = re.compile(r'<[^>]+>')
+
+# (tag, attribute, value) of every element extract_book_details searches for.
+# For 'class' the value only has to be one of the element's classes, like bs4's class_= matching.
+DETAIL_PAGE_ELEMENTS = [
+    ('h1', 'class', 'Text__title1'),
+    ('h1', 'id', 'bookTitle'),
+    ('span', 'class', 'ContributorLink__name'),
+    ('a', 'class', 'authorName'),
+    ('img', 'class', 'ResponsiveImage'),
+    ('img', 'id', 'bookCover'),
+    ('div', 'id', 'description'),
+    ('a', 'class', 'Button--tag-small'),
+    ('div', 'data-testid', 'genresList'),
+    ('p', 'data-testid', 'pagesFormat'),
+    ('p', 'data-testid', 'publicationInfo'),
+    ('div', 'class', 'RatingStatistics__rating'),
+    ('span', 'class', 'RatingStatistics__info'),
+    ('div', 'data-testid', 'contentContainer'),
+]
+
+
+def _wanted_element(name: str, attrs) -> bool:
+    for tag, attr, value in DETAIL_PAGE_ELEMENTS:
+        if name != tag or not attrs or attr not in attrs:
+            continue
+        actual = attrs[attr]
+        if attr == 'class':
+            classes = actual.split() if isinstance(actual, str) else actual
+            if value in classes:
+                return True
+        elif actual == value:
+            return True
+    return False
+
+
+class _DetailPageStrainer(SoupStrainer):
+    """
+    Only lets the tree builder create elements listed in DETAIL_PAGE_ELEMENTS (plus everything inside them).
+    Overrides the hook of both the old (<4.13) and the new SoupStrainer API.
+    """
+
+    def __init__(self):
+        # Any name rule, so the strainer never keeps stray top-level strings
+        super().__init__(name=[tag for tag, _, _ in DETAIL_PAGE_ELEMENTS])
+
+    def allow_tag_creation(self, nsprefix, name, attrs) -> bool:  # bs4 >= 4.13
+        return _wanted_element(name, attrs)
+
+    def search_tag(self, markup_name=None, markup_attrs={}):  # bs4 < 4.13
+        if _wanted_element(markup_name, markup_attrs):
+            return markup_name
+        return None
+
+
+DETAIL_PAGE_STRAINER = _DetailPageStrainer()
+
+
+def make_detail_soup(book_html: str, fast: bool = True) -> BeautifulSoup:
+    """Build the soup for a detail page, either the reduced fast tree or the full html.parser reference tree."""
+    if fast:
+        return BeautifulSoup(book_html, FAST_PARSER, parse_only=DETAIL_PAGE_STRAINER)
+    return BeautifulSoup(book_html, 'html.parser')
+
+
+def _empty_book_data(book_url: str) -> dict:
+    return {
+        'url': book_url,
+        'title': None,
+        'author': None,
+        'image_url': None,
+        'description': None,
+        'genres': [],
+        'pages': None,
+        'publication_year': None,
+        'average_rating': None,
+        'ratings_count': None,
+        'reviews_count': None,
+    }
+
+
+def _year_from_millis(millis) -> int | None:
+    """
+    Proleptic Gregorian year of a Unix timestamp in milliseconds. Computed arithmetically (Hinnant's
+    civil-from-days) because classics have BCE publication times, which datetime cannot represent;
+    those come back as astronomical years (0 = 1 BCE, -1 = 2 BCE, ...).
+    """
+    if millis is None:
+        return None
+    days = int(millis // 86_400_000) + 719_468  # days since 0000-03-01
+    era = days // 146_097
+    day_of_era = days - era * 146_097
+    year_of_era = (day_of_era - day_of_era // 1460 + day_of_era // 36_524 - day_of_era // 146_096) // 365
+    day_of_year = day_of_era - (365 * year_of_era + year_of_era // 4 - year_of_era // 100)
+    month_index = (5 * day_of_year + 2) // 153  # 0 = March ... 11 = February
+    return year_of_era + era * 400 + (month_index >= 10)
+
+
+def _resolve(apollo_state: dict, ref) -> dict:
+    """Follow an Apollo cache reference ({"__ref": "Book:..."}) to its object."""
+    if isinstance(ref, dict) and '__ref' in ref:
+        return apollo_state.get(ref['__ref'], {})
+    return ref or {}
+
+
+def _from_next_data(next_data: dict, book_url: str) -> dict:
+    apollo_state = next_data['props']['pageProps']['apolloState']
+    books = [value for key, value in apollo_state.items() if key.startswith('Book:')]
+
+    # The blob also holds similar/series books; pick the one this page is about
+    book_id = BOOK_ID_RE.search(book_url)
+    book = next((b for b in books if book_id and str(b.get('legacyId')) == book_id.group(1)), None)
+    if book is None:
+        with_genres = [b for b in books if b.get('bookGenres')]
+        book = with_genres[0] if len(with_genres) == 1 else None
+    if book is None:
+        return {}
+
+    work = _resolve(apollo_state, book.get('work'))
+    stats = work.get('stats') or {}
+    details = book.get('details') or {}
+    work_details = work.get('details') or {}
+    contributor = _resolve(apollo_state, (book.get('primaryContributorEdge') or {}).get('node'))
+
+    description = book.get('description({"stripped":true})')
+    if description is None and book.get('description'):
+        description = TAG_RE.sub(' ', book['description'])
+
+    return {
+        'title': book.get('title'),
+        'author': contributor.get('name'),
+        'image_url': book.get('imageUrl'),
+        'description': html.unescape(description).strip() if description else None,
+        'genres': [g['genre']['name'] for g in book.get('bookGenres') or [] if g.get('genre')],
+        'pages': details.get('numPages'),
+        # Work-level time is the first publication, which is what the publicationInfo line shows
+        'publication_year': _year_from_millis(work_details.get('publicationTime') or details.get('publicationTime')),
+        'average_rating': stats.get('averageRating'),
+        'ratings_count': stats.get('ratingsCount'),
+        'reviews_count': stats.get('textReviewsCount'),
+    }
+
+
+def _from_json_ld(json_ld: dict) -> dict:
+    if isinstance(json_ld, list):
+        json_ld = next((item for item in json_ld if item.get('@type') == 'Book'), {})
+    authors = json_ld.get('author') or []
+    if isinstance(authors, dict):
+        authors = [authors]
+    rating = json_ld.get('aggregateRating') or {}
+    name = json_ld.get('name')
+    image = json_ld.get('image')
+    if isinstance(image, list):
+        image = image[0] if image else None
+    return {
+        'title': html.unescape(name) if name else None,
+        'author': html.unescape(authors[0]['name']) if authors and authors[0].get('name') else None,
+        'image_url': image,
+        'pages': json_ld.get('numberOfPages'),
+        'average_rating': rating.get('ratingValue'),
+        'ratings_count': rating.get('ratingCount'),
+        'reviews_count': rating.get('reviewCount'),
+    }
+
+
+def extract_structured_data(book_html: str, book_url: str) -> dict:
+    """
+    Read the metadata embedded as JSON in the page (Next.js data first, then JSON-LD) without building a soup.
+    Returns:
+        dict: The book_data fields that were found; missing or empty fields are left out.
+    """
+    found = {}
+    sources = [(NEXT_DATA_RE, lambda data: _from_next_data(data, book_url)), (JSON_LD_RE, _from_json_ld)]
+    for pattern, mapper in sources:
+        match = pattern.search(book_html)
+        if not match:
+            continue
+        try:
+            fields = mapper(json.loads(match.group(1)))
+        except (ValueError, KeyError, TypeError, AttributeError) as e:
+            print(f"Ignoring malformed embedded data for {book_url}: {e}")
+            continue
+        for field, value in fields.items():
+            if field not in found and value not in (None, '', []):
+                found[field] = value
+    image_url = found.get('image_url')
+    if isinstance(image_url, str) and image_url.startswith('//'):
+        found['image_url'] = 'https:' + image_url
+    return found
+
+
+def extract_book_details(book_html: str, book_url: str, fast: bool = True, structured: bool = True) -> dict:
+    """
+    Parse a Goodreads book detail page into a flat dict of metadata.
+    Args:
+        book_html (str): The page HTML.
+        book_url (str): The page URL, stored in the 'url' field.
+        fast (bool): Use the fast soup path (see `make_detail_soup`). Both paths return identical dicts.
+        structured (bool): Read the embedded JSON first and only use the soup selectors for missing fields.
+    Returns:
+        dict: The book record; fields that could not be found are None (or [] for genres).
+    """
+    book_data = _empty_book_data(book_url)
+    if structured:
+        book_data.update(extract_structured_data(book_html, book_url))
+
+    missing = {field for field, value in book_data.items() if value is None or value == []}
+    if missing:
+        _extract_with_soup(make_detail_soup(book_html, fast), book_url, book_data, missing)
+    return book_data
+
+
+def _extract_with_soup(soup: BeautifulSoup, book_url: str, book_data: dict, missing: set) -> None:
+    """Fill the `missing` fields of `book_data` using the page's CSS classes and test ids."""
+    try:
+        if 'title' in missing:
+            # Title
+            title_tag = soup.find('h1', class_='Text__title1') # New Goodreads UI
+            if not title_tag: # Fallback for older UI or variations
+                 title_tag = soup.find('h1', id='bookTitle')
+            if title_tag:
+                book_data['title'] = title_tag.get_text(strip=True)
+
+        if 'author' in missing:
+            # Author
+            author_tag = soup.find('span', class_='ContributorLink__name') # New Goodreads UI
+            if not author_tag: # Fallback
+                author_tag = soup.find('a', class_='authorName')
+            if author_tag:
+                book_data['author'] = author_tag.get_text(strip=True)
+
+        if 'image_url' in missing:
+            # Main Image URL
+            image_tag = soup.find('img', class_='ResponsiveImage') # New Goodreads UI
+            if not image_tag: # Fallback
+                image_tag = soup.find('img', id='bookCover')
+            if image_tag and image_tag.get('src'):
+                src = image_tag.get('src')
+                if src.startswith('//'):
+                    src = 'https:' + src
+                book_data['image_url'] = src
+
+        if 'description' in missing:
+            # Description (often in a div with a "show more" button)
+            # This is where Selenium often becomes necessary for full text if truncated
+            description_div = soup.find('div', id='description')
+            if description_div:
+                # Look for the full description text. It might be in a 'span' that expands.
+                full_description_span = description_div.find('span', style='display:none') # If expanded
+                if full_description_span:
+                    book_data['description'] = full_description_span.get_text(strip=True)
+                else: # If description is fully visible
+                    book_data['description'] = description_div.get_text(strip=True, separator=' ')
+                    # Clean up "more..." or "less..." if present
+                    book_data['description'] = book_data['description'].replace('...more', '').replace('...less', '').strip()
+
+        if 'genres' in missing:
+            # Genres (often found in a div or section)
+            genre_tags = soup.find_all('a', class_='Button--tag-small') # Example for new UI tags
+            if not genre_tags: # Fallback
+                 genre_tags = soup.select('div[data-testid="genresList"] a span.Button__labelItem')
+            book_data['genres'] = [genre.get_text(strip=True) for genre in genre_tags]
+
+        if 'pages' in missing:
+            # Pages
+            pages_tag = soup.find('p', {'data-testid': 'pagesFormat'}) # New Goodreads UI
+            if pages_tag:
+                pages_text = pages_tag.get_text(strip=True)
+                # Extract numbers from "X pages" or "X pages, Y parts"
+                match = PAGES_RE.search(pages_text)
+                if match:
+                    book_data['pages'] = int(match.group(1))
+
+        if 'publication_year' in missing:
+            # Publication Year (often within a publication info paragraph)
+            pub_info_tag = soup.find('p', {'data-testid': 'publicationInfo'}) # New Goodreads UI
+            if pub_info_tag:
+                pub_info_text = pub_info_tag.get_text(strip=True)
+                match = PUBLISHED_YEAR_RE.search(pub_info_text)
+                if match:
+                    book_data['publication_year'] = int(match.group(1))
+                else: # Sometimes just the year is present
+                     match = YEAR_RE.search(pub_info_text)
+                     if match:
+                         book_data['publication_year'] = int(match.group(1))
+
+        # Ratings and Reviews
+        # These selectors are very prone to change.
+        if 'average_rating' in missing:
+            average_rating_tag = soup.find('div', class_='RatingStatistics__rating')
+            if average_rating_tag:
+                book_data['average_rating'] = float(average_rating_tag.get_text(strip=True))
+
+        if 'ratings_count' in missing or 'reviews_count' in missing:
+            ratings_reviews_span = soup.find('span', class_='RatingStatistics__info')
+            if ratings_reviews_span:
+                text = ratings_reviews_span.get_text(strip=True).replace(',', '') # Remove commas for numbers
+                ratings_match = RATINGS_RE.search(text)
+                if ratings_match and 'ratings_count' in missing:
+                    book_data['ratings_count'] = int(ratings_match.group(1))
+
+                reviews_match = REVIEWS_RE.search(text)
+                if reviews_match and 'reviews_count' in missing:
+                    book_data['reviews_count'] = int(reviews_match.group(1))
+
+        if 'description' in missing:
+            # Formatted tag which is the book description
+            desc_tag = soup.find('div', {'data-testid': 'contentContainer'})
+            if desc_tag:
+                book_data['description'] = desc_tag.get_text(strip=True)
+
+    except Exception as e:
+        print(f"Error parsing details for {book_url}: {e}")
+
+
+def timed_extract_book_details(book_html: str, book_url: str) -> tuple[dict, float]:
+    """extract_book_details plus its CPU time, measured inside the parse worker (excludes pool queueing)."""
+    start = time.perf_counter()
+    book_details = extract_book_details(book_html, book_url)
+    return book_details, time.perf_counter() - start
@@ -0,0 +1,191 @@
+"""
+Captioned training dataset: the scraped records joined to their resized covers.
+
+conditional_train.py needs an image and a caption per book. This streams the
+records, finds each book's cover through the cover store's index (book URL ->
+content hash -> `ab/<hash>.jpg` thumbnail), composes captions from templates
+filled with the record's fields, and writes a Hugging Face dataset with
+`save_to_disk`. Training opens it with `load_from_disk`, which memory-maps
+the Arrow files: no directory scan, no metadata.jsonl parsing, no per-run
+image indexing.
+
+Every book gets one caption per template whose fields it has (stored as a list,
+conditional_train picks one at random each step), plus the cover's width and
+height for aspect-ratio bucketing. Covers are embedded in the Arrow files
+unless `--link-files` is given.
+
+Usage:
+    python -m scraper.caption_dataset [--template "{title} by {author}" ...] [--keep-list "goodreads data/dedup/keep.txt"]
+"""
+import argparse
+import os
+import shutil
+import string
+import time
+
+from .cover_store import CoverStore
+from .record_store import iter_records
+from .thumbnails import RESIZED_DIR, thumbnail_path
+
+RECORDS_FILE = "goodreads data/goodreads_book_data/goodreads_books_data.jsonl"
+COVER_STORE_DIR = "goodreads data/cover_store"
+DATASET_DIR = "goodreads data/caption_dataset"
+MAX_GENRES = 3
+MAX_DESCRIPTION_CHARS = 200
+
+DEFAULT_TEMPLATES = (
+    'A book cover for "{title}" by {author}',
+    "The cover of {title}, a {genres} book by {author}",
+    "{genre} book cover, {title}, published {year}",
+    "Book cover of {title}: {description}",
+)
+
+
+def caption_fields(record: dict) -> dict[str, str]:
+    """The values the templates can use, as strings; empty for anything the record lacks."""
+    genres = record.get("genres") or []
+    description = (record.get("description") or "").strip()
+    if len(description) > MAX_DESCRIPTION_CHARS:
+        description = description[:MAX_DESCRIPTION_CHARS].rsplit(" ", 1)[0] + "..."
+    return {
+        "title": (record.get("title") or "").strip(),
+        "author": (record.get("author") or "").strip(),
+        "genre": genres[0] if genres else "",
+        "genres": ", ".join(genres[:MAX_GENRES]),
+        "year": str(record.get("publication_year") or ""),
+        "description": description,
+    }
+
+
+def compose_captions(record: dict, templates: list[str]) -> list[str]:
+    """Each template filled with the record's fields, skipping templates that use a field the record lacks."""
+    fields = caption_fields(record)
+    captions = []
+    for template in templates:
+        names = {name for _, name, _, _ in string.Formatter().parse(template) if name}
+        if all(fields.get(name) for name in names):
+            captions.append(template.format(**fields))
+    return captions or [fields["title"]]
+
+
+def image_size(path: str) -> tuple[int, int]:
+    from PIL import Image
+
+    with Image.open(path) as img:
+        return img.size
+
+
+def build_caption_dataset(templates: list[str], records_file: str = RECORDS_FILE,
+                          cover_store_dir: str = COVER_STORE_DIR, resized_dir: str = RESIZED_DIR,
+                          output_dir: str = DATASET_DIR, keep: set[str] | None = None,
+                          embed_images: bool = True) -> int:
+    """
+    Write the captioned dataset (a DatasetDict with a "train" split) to `output_dir`.
+    Args:
+        templates (list[str]): Caption templates using {title}, {author}, {genre}, {genres}, {year}, {description}.
+        keep (set[str] | None): Only covers in this set (`ab/<hash>.jpg`, e.g. the near-duplicate keep list).
+        embed_images (bool): Store the cover bytes in the dataset; otherwise only their paths.
+    Returns:
+        int: Number of rows written.
+    """
+    import datasets
+
+    store = CoverStore(cover_store_dir)
+    covers = {book_url: content_hash for book_url, content_hash, _ in store.iter_books()}
+    store.close()
+
+    skipped = {"no cover": 0, "not resized": 0, "pruned": 0, "shared cover": 0}
+
+    def rows():
+        seen = set()
+        for record in iter_records(records_file):
+            content_hash = covers.get(record.get("url"))
+            if content_hash is None:
+                skipped["no cover"] += 1
+                continue
+            path = thumbnail_path(resized_dir, content_hash)
+            file_name = os.path.relpath(path, resized_dir)
+            if keep is not None and file_name not in keep:
+                skipped["pruned"] += 1
+                continue
+            if file_name in seen:  # several editions sharing one cover: the first record captions it
+                skipped["shared cover"] += 1
+                continue
+            if not os.path.exists(path):
+                skipped["not resized"] += 1
+                continue
+            seen.add(file_name)
+            if embed_images:
+                with open(path, "rb") as f:
+                    image = {"bytes": f.read(), "path": file_name}
+            else:
+                image = {"bytes": None, "path": os.path.abspath(path)}
+            width, height = image_size(path)
+            yield {
+                "image": image,
+                "text": compose_captions(record, templates),
+                "url": record.get("url"),
+                "file_name": file_name,
+                "width": width,
+                "height": height,
+            }
+
+    features = datasets.Features({
+        "image": datasets.Image(),
+        "text": datasets.Sequence(datasets.Value("string")),
+        "url": datasets.Value("string"),
+        "file_name": datasets.Value("string"),
+        "width": datasets.Value("int32"),
+        "height": datasets.Value("int32"),
+    })
+    # from_generator streams the rows into Arrow files in a scratch cache, so memory stays flat
+    cache_dir = f"{output_dir}.cache"
+    try:
+        # A unique fingerprint: every build is fresh, and it spares hashing the generator's closure
+        dataset = datasets.Dataset.from_generator(rows, features=features, cache_dir=cache_dir,
+                                                  fingerprint=f"caption_dataset_{time.time_ns()}")
+        if os.path.exists(output_dir):
+            shutil.rmtree(output_dir)
+        datasets.DatasetDict({"train": dataset}).save_to_disk(output_dir)
+    finally:
+        shutil.rmtree(cache_dir, ignore_errors=True)
+    print(f"Skipped records: {skipped}")
+    return dataset.num_rows
+
+
+def main(argv: list[str] | None = None) -> None:
+    parser = argparse.ArgumentParser(description="Build the captioned cover dataset for conditional training.")
+    parser.add_argument("--records-file", default=RECORDS_FILE)
+    parser.add_argument("--cover-store", default=COVER_STORE_DIR)
+    parser.add_argument("--resized-dir", default=RESIZED_DIR)
+    parser.add_argument("--output-dir", default=DATASET_DIR)
+    parser.add_argument("--template", action="append",
+                        help="Caption template, e.g. '{title} by {author}'; repeat for several (default: built-in set).")
+    parser.add_argument("--templates-file", help="File with one caption template per line.")
+    parser.add_argument("--keep-list", help="Only include the covers listed here (the keep.txt from near_duplicates).")
+    parser.add_argument("--link-files", action="store_true",
+                        help="Store the cover paths instead of embedding the images.")
+    args = parser.parse_args(argv)
+
+    templates = list(args.template or [])
+    if args.templates_file:
+        with open(args.templates_file, "r", encoding="utf-8") as f:
+            templates += [line.rstrip("\n") for line in f if line.strip() and not line.startswith("#")]
+    templates = templates or list(DEFAULT_TEMPLATES)
+    for template in templates:
+        unknown = {name for _, name, _, _ in string.Formatter().parse(template) if name} - set(caption_fields({}))
+        if unknown:
+            parser.error(f"Unknown field(s) {', '.join(sorted(unknown))} in template {template!r}")
+    keep = None
+    if args.keep_list:
+        with open(args.keep_list, "r", encoding="utf-8") as f:
+            keep = {line.strip() for line in f if line.strip()}
+
+    start = time.perf_counter()
+    count = build_caption_dataset(templates, args.records_file, args.cover_store, args.resized_dir,
+                                  args.output_dir, keep, embed_images=not args.link_files)
+    print(f"Wrote {count} captioned covers to {args.output_dir} in {time.perf_counter() - start:.1f} s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,240 @@
+"""
+Columnar catalog of the scraped books, for picking training subsets.
+
+`build` joins the scraped records with the cover store into one Parquet table
+(one row per book, `genres` as a list column, plus the paths of the original
+and the resized cover), and writes inverted indexes next to it: for every
+genre, publication year and half-star rating bucket, the sorted row numbers of
+the books in it. Selecting e.g. "Romantasy published after 2018" is then a
+handful of posting-list intersections instead of a pass over every record,
+and the selected covers can be linked straight into a training directory.
+
+Usage:
+    python -m scraper.catalog build
+    python -m scraper.catalog select --genre Romantasy --min-year 2019 --export "data/subsets/romantasy_2019"
+"""
+import argparse
+import math
+import os
+import shutil
+import time
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from .cover_store import CoverStore
+from .record_store import iter_records
+from .thumbnails import RESIZED_DIR, thumbnail_path
+
+RECORDS_FILE = "goodreads data/goodreads_book_data/goodreads_books_data.jsonl"
+COVER_STORE_DIR = "goodreads data/cover_store"
+CATALOG_DIR = "goodreads data/catalog"
+CATALOG_FILE = "books.parquet"
+INDEX_FILE = "index.parquet"
+RATING_BUCKET = 0.5
+
+SCHEMA = pa.schema([
+    ("url", pa.string()),
+    ("title", pa.string()),
+    ("author", pa.string()),
+    ("description", pa.string()),
+    ("genres", pa.list_(pa.string())),
+    ("pages", pa.int32()),
+    ("publication_year", pa.int32()),
+    ("average_rating", pa.float32()),
+    ("ratings_count", pa.int64()),
+    ("reviews_count", pa.int64()),
+    ("image_url", pa.string()),
+    ("cover_hash", pa.string()),
+    ("cover_path", pa.string()),
+    ("resized_path", pa.string()),
+])
+
+
+def rating_bucket(rating: float) -> str:
+    return f"{math.floor(rating / RATING_BUCKET) * RATING_BUCKET:.1f}"
+
+
+def build_catalog(records_file: str = RECORDS_FILE, cover_store_dir: str = COVER_STORE_DIR,
+                  catalog_dir: str = CATALOG_DIR, resized_dir: str = RESIZED_DIR) -> int:
+    """
+    Write books.parquet and index.parquet to `catalog_dir` from the records and the cover store index.
+    Returns:
+        int: The number of books in the catalog.
+    """
+    store = CoverStore(cover_store_dir)
+    covers = {book_url: (content_hash, path) for book_url, content_hash, path in store.iter_books()}
+    store.close()
+
+    columns = {field.name: [] for field in SCHEMA}
+    postings: dict[tuple[str, str], list[int]] = {}
+    for row, record in enumerate(iter_records(records_file)):
+        content_hash, cover_path = covers.get(record.get("url"), (None, None))
+        record = {**record, "cover_hash": content_hash, "cover_path": cover_path,
+                  "resized_path": thumbnail_path(resized_dir, content_hash) if content_hash else None,
+                  "genres": record.get("genres") or []}
+        for name in columns:
+            columns[name].append(record.get(name))
+
+        for genre in dict.fromkeys(genre.lower() for genre in record["genres"]):
+            postings.setdefault(("genre", genre), []).append(row)
+        if record.get("publication_year"):
+            postings.setdefault(("year", str(record["publication_year"])), []).append(row)
+        if record.get("average_rating") is not None:
+            postings.setdefault(("rating", rating_bucket(record["average_rating"])), []).append(row)
+
+    os.makedirs(catalog_dir, exist_ok=True)
+    table = pa.Table.from_pydict(columns, schema=SCHEMA)
+    pq.write_table(table, os.path.join(catalog_dir, CATALOG_FILE))
+    index = pa.table({
+        "kind": [kind for kind, _ in postings],
+        "key": [key for _, key in postings],
+        "rows": pa.array(list(postings.values()), type=pa.list_(pa.int32())),
+    })
+    pq.write_table(index, os.path.join(catalog_dir, INDEX_FILE))
+    return table.num_rows
+
+
+class Catalog:
+    """
+    Read side of the catalog: the book table (memory-mapped) and its inverted indexes.
+    Attributes:
+        table (pa.Table): One row per book, see SCHEMA.
+        index (dict): (kind, key) -> sorted int32 array of row numbers, kind being 'genre', 'year' or 'rating'.
+    """
+
+    def __init__(self, catalog_dir: str = CATALOG_DIR):
+        self.table = pq.read_table(os.path.join(catalog_dir, CATALOG_FILE), memory_map=True)
+        index = pq.read_table(os.path.join(catalog_dir, INDEX_FILE)).to_pydict()
+        self.index = {(kind, key): np.asarray(rows, dtype=np.int32)
+                      for kind, key, rows in zip(index["kind"], index["key"], index["rows"])}
+
+    def keys(self, kind: str) -> list[str]:
+        return sorted(key for index_kind, key in self.index if index_kind == kind)
+
+    def _union(self, kind: str, keys) -> np.ndarray:
+        arrays = [self.index[(kind, key)] for key in keys if (kind, key) in self.index]
+        return np.unique(np.concatenate(arrays)) if arrays else np.empty(0, dtype=np.int32)
+
+    def select(self, genres: list[str] | None = None, all_genres: bool = False,
+               min_year: int | None = None, max_year: int | None = None,
+               min_rating: float | None = None, max_rating: float | None = None) -> np.ndarray:
+        """
+        Row numbers of the books matching every given filter (genres match case-insensitively).
+        Args:
+            genres (list[str] | None): Books tagged with any of these (all of them with `all_genres`).
+            min_year, max_year (int | None): Inclusive publication year range.
+            min_rating, max_rating (float | None): Inclusive average rating range.
+        """
+        selected = np.arange(self.table.num_rows, dtype=np.int32)
+        if genres:
+            keys = [genre.lower() for genre in genres]
+            if all_genres:
+                for key in keys:
+                    selected = np.intersect1d(selected, self._union("genre", [key]), assume_unique=True)
+            else:
+                selected = np.intersect1d(selected, self._union("genre", keys), assume_unique=True)
+        if min_year is not None or max_year is not None:
+            years = [key for key in self.keys("year")
+                     if (min_year is None or int(key) >= min_year) and (max_year is None or int(key) <= max_year)]
+            selected = np.intersect1d(selected, self._union("year", years), assume_unique=True)
+        if min_rating is not None or max_rating is not None:
+            # Whole buckets narrow it down; the rating column settles the edge buckets
+            low = float(rating_bucket(min_rating)) if min_rating is not None else -math.inf
+            high = max_rating if max_rating is not None else math.inf
+            buckets = [key for key in self.keys("rating") if low <= float(key) <= high]
+            selected = np.intersect1d(selected, self._union("rating", buckets), assume_unique=True)
+            ratings = self.table.column("average_rating").take(pa.array(selected)).to_numpy(zero_copy_only=False)
+            keep = np.ones(len(selected), dtype=bool)
+            if min_rating is not None:
+                keep &= ratings >= np.float32(min_rating)
+            if max_rating is not None:
+                keep &= ratings <= np.float32(max_rating)
+            selected = selected[keep]
+        return selected
+
+    def column(self, name: str, rows: np.ndarray) -> list:
+        return self.table.column(name).take(pa.array(rows, type=pa.int32())).to_pylist()
+
+    def image_paths(self, rows: np.ndarray, column: str = "resized_path") -> list[str]:
+        """Cover paths of the selected rows, skipping books without a cover and covers shared by several books."""
+        return [path for path in dict.fromkeys(self.column(column, rows)) if path]
+
+
+def export_subset(paths: list[str], output_dir: str, copy: bool = False) -> int:
+    """
+    Put the given covers into `output_dir` (sharded like the source) for the training scripts' image folders.
+    Hard links are used where possible, so a subset costs no extra disk space.
+    Returns:
+        int: The number of covers placed.
+    """
+    placed = 0
+    for path in paths:
+        if not os.path.exists(path):
+            continue
+        target = os.path.join(output_dir, os.path.basename(os.path.dirname(path)), os.path.basename(path))
+        if os.path.exists(target):
+            placed += 1
+            continue
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        if copy:
+            shutil.copy2(path, target)
+        else:
+            try:
+                os.link(path, target)
+            except OSError:  # different filesystem, or links not supported
+                shutil.copy2(path, target)
+        placed += 1
+    return placed
+
+
+def main(argv: list[str] | None = None) -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--catalog-dir", default=CATALOG_DIR)
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    build = commands.add_parser("build", help="Rebuild the catalog from the records and the cover store.")
+    build.add_argument("--records-file", default=RECORDS_FILE)
+    build.add_argument("--cover-store", default=COVER_STORE_DIR)
+    build.add_argument("--resized-dir", default=RESIZED_DIR)
+
+    select = commands.add_parser("select", help="Select books and print or export their covers.")
+    select.add_argument("--genre", action="append", help="Genre to include; repeat for several.")
+    select.add_argument("--all-genres", action="store_true", help="Require every --genre instead of any.")
+    select.add_argument("--min-year", type=int)
+    select.add_argument("--max-year", type=int)
+    select.add_argument("--min-rating", type=float)
+    select.add_argument("--max-rating", type=float)
+    select.add_argument("--originals", action="store_true", help="Use the full-size covers instead of the resized ones.")
+    select.add_argument("--export", help="Training directory to link the selected covers into.")
+    select.add_argument("--copy", action="store_true", help="Copy instead of hard-linking into --export.")
+
+    commands.add_parser("genres", help="List the indexed genres with their book counts.")
+    args = parser.parse_args(argv)
+
+    if args.command == "build":
+        count = build_catalog(args.records_file, args.cover_store, args.catalog_dir, args.resized_dir)
+        print(f"Catalog of {count} books written to {args.catalog_dir}")
+        return
+
+    catalog = Catalog(args.catalog_dir)
+    if args.command == "genres":
+        for genre in sorted(catalog.keys("genre"), key=lambda key: -len(catalog.index[("genre", key)])):
+            print(f"{len(catalog.index[('genre', genre)]):>8}  {genre}")
+        return
+
+    start = time.perf_counter()
+    rows = catalog.select(args.genre, args.all_genres, args.min_year, args.max_year, args.min_rating, args.max_rating)
+    paths = catalog.image_paths(rows, "cover_path" if args.originals else "resized_path")
+    print(f"Selected {len(rows)} books ({len(paths)} with covers) in {(time.perf_counter() - start) * 1000:.1f} ms")
+    if args.export:
+        placed = export_subset(paths, args.export, copy=args.copy)
+        print(f"Placed {placed} covers in {args.export}")
+    else:
+        for path in paths:
+            print(path)
+
+
+if __name__ == "__main__":
+    main()
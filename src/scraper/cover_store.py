@@ -0,0 +1,157 @@
+"""
+Content-addressed storage for downloaded book covers.
+
+Each cover is saved once under the SHA-256 of its bytes, in 256 sharded
+subdirectories (`ab/abcdef....jpg`), so the same cover reached from two lists
+or editions is neither downloaded nor stored twice, and no directory grows to
+100k+ entries. A SQLite index maps image URLs and book URLs to content hashes;
+consumers iterate the index instead of listing directories.
+
+With the fused download-and-resize path the original bytes may not be kept at
+all: the image is still indexed (so it is deduplicated and never downloaded
+again), but `images.original` is 0 and only its thumbnail exists on disk.
+"""
+import hashlib
+import os
+import sqlite3
+import threading
+from typing import Iterator
+from urllib.parse import urlsplit
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS images (
+    hash TEXT PRIMARY KEY,
+    ext TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    original INTEGER NOT NULL DEFAULT 1
+);
+CREATE TABLE IF NOT EXISTS image_urls (
+    image_url TEXT PRIMARY KEY,
+    hash TEXT NOT NULL REFERENCES images(hash)
+);
+CREATE TABLE IF NOT EXISTS books (
+    book_url TEXT PRIMARY KEY,
+    hash TEXT NOT NULL REFERENCES images(hash)
+);
+"""
+
+
+def hash_bytes(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+def image_extension(image_url: str) -> str:
+    ext = os.path.splitext(urlsplit(image_url).path)[1].lower()
+    return ext if ext in (".jpg", ".jpeg", ".png", ".gif", ".webp") else ".jpg"
+
+
+class CoverStore:
+    """
+    Sharded, deduplicating cover store.
+    Attributes:
+        root (str): Directory holding the shards and the index database.
+    """
+
+    def __init__(self, root: str):
+        self.root = root
+        os.makedirs(root, exist_ok=True)
+        self._lock = threading.Lock()
+        self.conn = sqlite3.connect(os.path.join(root, "index.sqlite3"), check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.executescript(_SCHEMA)
+        columns = {row[1] for row in self.conn.execute("PRAGMA table_info(images)")}
+        if "original" not in columns:
+            # Stores created before originals became optional kept every file
+            self.conn.execute("ALTER TABLE images ADD COLUMN original INTEGER NOT NULL DEFAULT 1")
+        self.conn.commit()
+
+    def close(self) -> None:
+        self.conn.close()
+
+    def path_for(self, content_hash: str, ext: str = ".jpg") -> str:
+        return os.path.join(self.root, content_hash[:2], content_hash + ext)
+
+    def hash_for_image_url(self, image_url: str) -> str | None:
+        """Hash of an already downloaded image URL, so it can be skipped without another request."""
+        with self._lock:
+            row = self.conn.execute("SELECT hash FROM image_urls WHERE image_url = ?", (image_url,)).fetchone()
+        return row[0] if row else None
+
+    def path_for_book(self, book_url: str) -> str | None:
+        with self._lock:
+            row = self.conn.execute(
+                "SELECT images.hash, images.ext FROM books JOIN images USING (hash) WHERE book_url = ?", (book_url,)
+            ).fetchone()
+        return self.path_for(*row) if row else None
+
+    def link_book(self, book_url: str, content_hash: str) -> None:
+        with self._lock, self.conn:
+            self.conn.execute("INSERT OR REPLACE INTO books (book_url, hash) VALUES (?, ?)", (book_url, content_hash))
+
+    def put(self, data: bytes, image_url: str, book_url: str | None = None,
+            keep_original: bool = True, content_hash: str | None = None) -> str:
+        """
+        Store image bytes (skipping the write if identical bytes are already stored) and index the URLs.
+        Args:
+            keep_original (bool): Write the bytes to disk; False only indexes them (their thumbnail is kept elsewhere).
+            content_hash (str | None): hash_bytes(data), if the caller already computed it.
+        Returns:
+            str: The path of the stored image (which does not exist when the original is not kept).
+        """
+        content_hash = content_hash or hash_bytes(data)
+        ext = image_extension(image_url)
+        with self._lock:
+            row = self.conn.execute("SELECT ext, original FROM images WHERE hash = ?", (content_hash,)).fetchone()
+        if row and (row[1] or not keep_original):
+            ext = row[0]
+            print(f"Duplicate cover bytes, reusing {content_hash[:12]}")
+        elif keep_original:
+            ext = row[0] if row else ext
+            path = self.path_for(content_hash, ext)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_path = f"{path}.{threading.get_ident()}.tmp"
+            with open(tmp_path, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+
+        with self._lock, self.conn:
+            self.conn.execute("INSERT OR IGNORE INTO images (hash, ext, size, original) VALUES (?, ?, ?, ?)",
+                              (content_hash, ext, len(data), int(keep_original)))
+            if keep_original:
+                self.conn.execute("UPDATE images SET original = 1 WHERE hash = ?", (content_hash,))
+            self.conn.execute("INSERT OR REPLACE INTO image_urls (image_url, hash) VALUES (?, ?)",
+                              (image_url, content_hash))
+            if book_url:
+                self.conn.execute("INSERT OR REPLACE INTO books (book_url, hash) VALUES (?, ?)",
+                                  (book_url, content_hash))
+        return self.path_for(content_hash, ext)
+
+    def remove(self, content_hash: str) -> None:
+        """Forget an image (e.g. a quarantined, undecodable one): its row and every URL and book pointing at it."""
+        with self._lock, self.conn:
+            self.conn.execute("DELETE FROM books WHERE hash = ?", (content_hash,))
+            self.conn.execute("DELETE FROM image_urls WHERE hash = ?", (content_hash,))
+            self.conn.execute("DELETE FROM images WHERE hash = ?", (content_hash,))
+
+    def iter_images(self) -> Iterator[tuple[str, str]]:
+        """Yield (hash, path) for every cover whose original is stored, straight from the index."""
+        with self._lock:
+            rows = self.conn.execute("SELECT hash, ext FROM images WHERE original = 1 ORDER BY hash").fetchall()
+        for content_hash, ext in rows:
+            yield content_hash, self.path_for(content_hash, ext)
+
+    def iter_thumbnail_only(self) -> Iterator[str]:
+        """Yield the hash of every cover indexed without its original (resized during the crawl)."""
+        with self._lock:
+            rows = self.conn.execute("SELECT hash FROM images WHERE original = 0 ORDER BY hash").fetchall()
+        for (content_hash,) in rows:
+            yield content_hash
+
+    def iter_books(self) -> Iterator[tuple[str, str, str]]:
+        """Yield (book_url, hash, path) for every book with a stored cover."""
+        with self._lock:
+            rows = self.conn.execute(
+                "SELECT books.book_url, images.hash, images.ext FROM books JOIN images USING (hash)"
+            ).fetchall()
+        for book_url, content_hash, ext in rows:
+            yield book_url, content_hash, self.path_for(content_hash, ext)
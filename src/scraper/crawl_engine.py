@@ -0,0 +1,364 @@
+"""
+Asyncio fetch engine for the Goodreads scraper.
+
+The blocking `requests` calls run in worker threads so several requests can be
+in flight at once, while a per-host token bucket keeps the request rate to each
+host at the same politeness budget the old fixed sleeps gave us.
+"""
+import asyncio
+import base64
+import binascii
+import hashlib
+import os
+import re
+import time
+
+import requests
+
+from .http_cache import HttpCache
+from .metrics import Metrics
+from .rate_limiter import AdaptiveRateLimiter, HostRateLimiter
+
+# A strong ETag that is 32 hex digits is the body's MD5 on S3/CloudFront (where the covers are hosted)
+MD5_ETAG_RE = re.compile(r'[0-9a-fA-F]{32}')
+# A 416 reply states the full size of the resource as "bytes */<size>"
+CONTENT_RANGE_TOTAL_RE = re.compile(r'bytes \*/(\d+)')
+# A 206 reply states where its bytes go and the full size: "bytes <first>-<last>/<size or *>"
+CONTENT_RANGE_RE = re.compile(r'bytes (\d+)-\d+/(\d+|\*)')
+
+
+def _record_response(metrics: Metrics | None, page_type: str, response: requests.Response,
+                     elapsed: float, size: int) -> None:
+    if metrics is None:
+        return
+    metrics.observe("scraper_request_seconds", elapsed, type=page_type)
+    metrics.inc("scraper_requests_total", type=page_type, status=str(response.status_code))
+    metrics.inc("scraper_bytes_downloaded_total", size, type=page_type)
+    # urllib3 keeps the retries it made for this response (timeouts, 429, 5xx)
+    retries = getattr(response.raw, "retries", None)
+    if retries is not None and retries.history:
+        metrics.inc("scraper_retries_total", len(retries.history), type=page_type)
+
+
+def _record_error(metrics: Metrics | None, page_type: str) -> None:
+    if metrics is not None:
+        metrics.inc("scraper_errors_total", type=page_type)
+
+
+def _feedback(limiter: AdaptiveRateLimiter | None, url: str, response: requests.Response | None,
+              elapsed: float) -> None:
+    """Report a response (None for a failed request) to an adaptive limiter, including retried 429/503s."""
+    if limiter is None:
+        return
+    if response is None:
+        limiter.record(url, None, elapsed)
+        return
+    retries = getattr(response.raw, "retries", None)
+    history = retries.history if retries is not None else ()
+    throttled = sum(1 for attempt in history if attempt.status in (429, 503))
+    limiter.record(url, response.status_code, elapsed, throttled)
+
+
+def request_page(url: str, headers: dict, timeout: float = 15, cache: HttpCache | None = None,
+                 session: requests.Session | None = None, metrics: Metrics | None = None,
+                 page_type: str = "page", limiter: AdaptiveRateLimiter | None = None) -> str | None:
+    """
+    Blocking GET of an HTML page. Returns the body, or None on any request error.
+    With a cache, a stale cached copy is revalidated with a conditional GET and
+    new responses are stored for the next run. Passing a pooled `session`
+    reuses connections and gets its retry/backoff policy. An adaptive `limiter`
+    is told how the request went, so it can speed up or back off.
+    """
+    http = session or requests
+    entry = cache.lookup(url) if cache else None
+    if entry:
+        headers = {**headers, **entry.validators()}
+    start = time.perf_counter()
+    try:
+        response = http.get(url, headers=headers, timeout=timeout)
+        elapsed = time.perf_counter() - start
+        _record_response(metrics, page_type, response, elapsed, len(response.content))
+        _feedback(limiter, url, response, elapsed)
+        if entry and response.status_code == 304:
+            cache.mark_revalidated(url)
+            return entry.body
+        response.raise_for_status()
+        if cache:
+            cache.store(url, response.text, response.headers.get("ETag"), response.headers.get("Last-Modified"))
+        return response.text
+    except requests.exceptions.RequestException as e:
+        print(f"Error fetching {url}: {e}")
+        _record_error(metrics, page_type)
+        if getattr(e, "response", None) is None:  # HTTP error statuses were already reported above
+            _feedback(limiter, url, None, time.perf_counter() - start)
+        return None
+
+
+def expected_md5(response_headers) -> str | None:
+    """
+    MD5 (hex) of the full body if the response states one: a Content-MD5 header, or an S3/CloudFront
+    style ETag, which is the hex MD5 of single-part objects. Returns None when there is nothing to check.
+    """
+    content_md5 = response_headers.get("Content-MD5")
+    if content_md5:
+        try:
+            return base64.b64decode(content_md5).hex()
+        except (binascii.Error, ValueError):
+            return None
+    etag = response_headers.get("ETag", "").removeprefix("W/").strip('"')
+    if not response_headers.get("ETag", "").startswith("W/") and MD5_ETAG_RE.fullmatch(etag):
+        return etag.lower()
+    return None
+
+
+def _remove_files(*paths: str) -> None:
+    for path in paths:
+        if os.path.exists(path):
+            os.remove(path)
+
+
+def _file_md5(path: str) -> str:
+    digest = hashlib.md5()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 16), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def request_image(image_url: str, save_path: str, headers: dict, timeout: float = 10,
+                  session: requests.Session | None = None, metrics: Metrics | None = None,
+                  limiter: AdaptiveRateLimiter | None = None) -> bool:
+    """
+    Blocking streamed download of an image to `save_path`. Returns True on success.
+    The body goes to `save_path`.part and is only renamed into place once its size (and MD5,
+    when the server states one) match the response headers, so `save_path` is never truncated.
+    A .part left by an interrupted transfer is resumed with a Range request (guarded by
+    If-Range, so a changed image restarts from zero), and an existing `save_path` is skipped.
+    A 206 must start at the .part's size, and a 416 reply to the Range request only completes
+    the .part if its `bytes */<size>` matches; otherwise the .part is discarded.
+    """
+    if os.path.exists(save_path):
+        print(f"Already downloaded: {os.path.basename(save_path)}")
+        return True
+    part_path = f"{save_path}.part"
+    validator_path = f"{part_path}.etag"
+    http = session or requests
+    start = time.perf_counter()
+    reported = False
+
+    def report(response: requests.Response, size: int) -> None:
+        nonlocal reported
+        elapsed = time.perf_counter() - start
+        _record_response(metrics, "image", response, elapsed, size)
+        _feedback(limiter, image_url, response, elapsed)
+        reported = True
+
+    try:
+        offset = os.path.getsize(part_path) if os.path.exists(part_path) else 0
+        request_headers = dict(headers)
+        saved_validator = None
+        if offset and os.path.exists(validator_path):
+            with open(validator_path, "r", encoding="utf-8") as f:
+                saved_validator = f.read().strip()
+            request_headers["If-Range"] = saved_validator
+            request_headers["Range"] = f"bytes={offset}-"
+        response = http.get(image_url, stream=True, headers=request_headers, timeout=timeout)
+        md5_headers = response.headers
+        if response.status_code == 416:
+            # Nothing left past `offset`. The .part is whole only if the server states the full
+            # size (Content-Range: bytes */N) and it matches; its MD5 comes from the saved ETag
+            response.close()
+            report(response, 0)
+            total_match = CONTENT_RANGE_TOTAL_RE.fullmatch(response.headers.get("Content-Range", "").strip())
+            if not total_match or int(total_match.group(1)) != offset:
+                print(f"Cannot resume {image_url} (416 for {offset} bytes), restarting next time")
+                _remove_files(part_path, validator_path)
+                return False
+            total = offset
+            md5_headers = {"ETag": saved_validator} if saved_validator else {}
+        else:
+            if response.status_code >= 400:
+                report(response, 0)
+                response.raise_for_status()  # Raise an HTTPError for bad responses (4xx or 5xx)
+            if response.status_code == 206:
+                range_match = CONTENT_RANGE_RE.fullmatch(response.headers.get("Content-Range", "").strip())
+                if not range_match or int(range_match.group(1)) != offset:
+                    # Appending a range that does not start where the .part ends would corrupt it
+                    print(f"Unexpected range {response.headers.get('Content-Range')!r} resuming {image_url} "
+                          f"from byte {offset}, restarting next time")
+                    response.close()
+                    report(response, 0)
+                    _remove_files(part_path, validator_path)
+                    return False
+                print(f"Resuming {os.path.basename(save_path)} from byte {offset}")
+                total = int(range_match.group(2)) if range_match.group(2) != "*" else None
+                mode = "ab"
+            else:
+                offset, mode = 0, "wb"
+                length = response.headers.get("Content-Length")
+                total = int(length) if length and length.isdigit() else None
+            if response.headers.get("Content-Encoding", "identity") != "identity":
+                total = None  # the lengths count encoded bytes, not what lands in the file
+            validator = response.headers.get("ETag") or response.headers.get("Last-Modified")
+            if validator:
+                with open(validator_path, "w", encoding="utf-8") as f:
+                    f.write(validator)
+            elif os.path.exists(validator_path):
+                os.remove(validator_path)  # left by an earlier response; it does not describe this body
+            received = 0
+            with open(part_path, mode) as out_file:
+                # Use iter_content for efficient downloading of large files
+                for chunk in response.iter_content(chunk_size=8192):
+                    out_file.write(chunk)
+                    received += len(chunk)
+            report(response, received)
+
+        size = os.path.getsize(part_path)
+        if total is not None and size != total:
+            # Keep the .part: the next attempt resumes from here
+            print(f"Incomplete download of {image_url}: {size} of {total} bytes")
+            _record_error(metrics, "image")
+            return False
+        md5 = expected_md5(md5_headers)
+        if md5 and _file_md5(part_path) != md5:
+            print(f"Checksum mismatch for {image_url}, discarding the download")
+            _record_error(metrics, "image")
+            _remove_files(part_path, validator_path)
+            return False
+        os.replace(part_path, save_path)
+        if os.path.exists(validator_path):
+            os.remove(validator_path)
+        print(f"Successfully downloaded: {os.path.basename(save_path)}")
+        return True
+
+    except requests.exceptions.RequestException as e:
+        print(f"Error downloading {image_url}: {e}")
+        _record_error(metrics, "image")
+        if not reported:  # no response, or the transfer broke off midway
+            _feedback(limiter, image_url, None, time.perf_counter() - start)
+    except Exception as e:
+        print(f"An unexpected error occurred while downloading {image_url}: {e}")
+        _record_error(metrics, "image")
+    return False
+
+
+def request_image_bytes(image_url: str, headers: dict, timeout: float = 10,
+                        session: requests.Session | None = None, metrics: Metrics | None = None,
+                        limiter: AdaptiveRateLimiter | None = None, part_dir: str | None = None) -> bytes | None:
+    """
+    Blocking download of an image. Returns the bytes, or None on any request error or when they
+    don't match the length or MD5 the server states (see `expected_md5`).
+    With a `part_dir` the body is streamed through `request_image` into a file named after the URL
+    there, so an interrupted transfer resumes on the next attempt; the file is removed once read.
+    """
+    if part_dir is not None:
+        save_path = os.path.join(part_dir, hashlib.sha1(image_url.encode("utf-8")).hexdigest())
+        os.makedirs(part_dir, exist_ok=True)
+        if not request_image(image_url, save_path, headers, timeout, session, metrics, limiter):
+            return None
+        with open(save_path, "rb") as f:
+            data = f.read()
+        os.remove(save_path)
+        return data
+
+    http = session or requests
+    start = time.perf_counter()
+    try:
+        response = http.get(image_url, headers=headers, timeout=timeout)
+        elapsed = time.perf_counter() - start
+        _record_response(metrics, "image", response, elapsed, len(response.content))
+        _feedback(limiter, image_url, response, elapsed)
+        response.raise_for_status()
+        if response.headers.get("Content-Encoding", "identity") == "identity":
+            length = response.headers.get("Content-Length")
+            if length and length.isdigit() and len(response.content) != int(length):
+                print(f"Incomplete download of {image_url}: {len(response.content)} of {length} bytes")
+                _record_error(metrics, "image")
+                return None
+            md5 = expected_md5(response.headers)
+            if md5 and hashlib.md5(response.content).hexdigest() != md5:
+                print(f"Checksum mismatch for {image_url}, discarding the download")
+                _record_error(metrics, "image")
+                return None
+        return response.content
+    except requests.exceptions.RequestException as e:
+        print(f"Error downloading {image_url}: {e}")
+        _record_error(metrics, "image")
+        if getattr(e, "response", None) is None:  # HTTP error statuses were already reported above
+            _feedback(limiter, image_url, None, time.perf_counter() - start)
+        return None
+
+
+class AsyncFetcher:
+    """
+    Concurrent counterpart of `fetch_page` / `download_image`.
+    Attributes:
+        headers (dict): Headers sent with every request.
+        max_in_flight (int): Upper bound on requests running at the same time.
+        page_limiter (HostRateLimiter): Rate limiter for HTML pages.
+        image_limiter (HostRateLimiter): Rate limiter for cover downloads.
+        cache (HttpCache | None): Optional on-disk cache for HTML pages.
+        session (requests.Session | None): Pooled session shared by all requests.
+        metrics (Metrics | None): Where request latencies, bytes, retries and waits are recorded.
+        revalidate (bool): Revalidate even fresh cached pages with a conditional GET (for refresh runs).
+        part_dir (str | None): Where `fetch_image` keeps partial downloads so they resume after an
+            interruption; None downloads into memory.
+    """
+
+    def __init__(self, headers: dict, max_in_flight: int,
+                 page_limiter: HostRateLimiter, image_limiter: HostRateLimiter,
+                 cache: HttpCache | None = None, session: requests.Session | None = None,
+                 metrics: Metrics | None = None, revalidate: bool = False, part_dir: str | None = None):
+        self.revalidate = revalidate
+        self.part_dir = part_dir
+        self.headers = headers
+        self.session = session
+        self.metrics = metrics
+        self.max_in_flight = max_in_flight
+        self.page_limiter = page_limiter
+        self.image_limiter = image_limiter
+        self.cache = cache
+        self._semaphore = asyncio.Semaphore(max_in_flight)
+
+    @staticmethod
+    def _adaptive(limiter: HostRateLimiter) -> AdaptiveRateLimiter | None:
+        return limiter if isinstance(limiter, AdaptiveRateLimiter) else None
+
+    async def _wait_for_token(self, limiter: HostRateLimiter, url: str, page_type: str) -> None:
+        waited = await limiter.acquire(url)
+        if self.metrics:
+            self.metrics.observe("scraper_rate_limit_wait_seconds", waited, type=page_type)
+
+    async def fetch_page(self, url: str, page_type: str = "page") -> str | None:
+        # Fresh cache hits skip the network and the politeness wait entirely
+        if self.cache and not self.revalidate:
+            cached = await asyncio.to_thread(self.cache.get_fresh, url)
+            if cached is not None:
+                print(f"Cache hit: {url}")
+                if self.metrics:
+                    self.metrics.inc("scraper_cache_hits_total", type=page_type)
+                return cached
+        print(f"Fetching: {url}")
+        # Wait for the host's token *before* taking an in-flight slot, so a request
+        # that is only waiting on politeness doesn't block requests to other hosts
+        await self._wait_for_token(self.page_limiter, url, page_type)
+        async with self._semaphore:
+            return await asyncio.to_thread(request_page, url, self.headers, cache=self.cache,
+                                           session=self.session, metrics=self.metrics, page_type=page_type,
+                                           limiter=self._adaptive(self.page_limiter))
+
+    async def download_image(self, image_url: str, save_path: str) -> bool:
+        print(f"Attempting to download: {image_url}")
+        await self._wait_for_token(self.image_limiter, image_url, "image")
+        async with self._semaphore:
+            return await asyncio.to_thread(request_image, image_url, save_path, self.headers,
+                                           session=self.session, metrics=self.metrics,
+                                           limiter=self._adaptive(self.image_limiter))
+
+    async def fetch_image(self, image_url: str) -> bytes | None:
+        print(f"Attempting to download: {image_url}")
+        await self._wait_for_token(self.image_limiter, image_url, "image")
+        async with self._semaphore:
+            return await asyncio.to_thread(request_image_bytes, image_url, self.headers,
+                                           session=self.session, metrics=self.metrics,
+                                           limiter=self._adaptive(self.image_limiter), part_dir=self.part_dir)
@@ -0,0 +1,204 @@
+"""
+Durable crawl frontier for the Goodreads scraper, backed by SQLite.
+
+Every book detail URL gets a row with its status, so an interrupted scrape can
+be restarted and only the remaining work is queried (via the status index)
+instead of re-walking and re-fetching everything.
+
+Status lifecycle:
+    pending -> fetched -> parsed -> image_downloaded
+    any step can go to failed (retries is incremented, and the row is retried
+    until MAX_RETRIES is reached)
+
+For refresh runs each book also remembers the list it was found on, its rank
+in that list and when its details were last scraped, so only books that went
+stale or moved in the list are fetched again. A refresh that fails keeps the
+book's status and record (only the error is noted), so a complete book never
+becomes failed work; it is still stale and the next refresh tries it again.
+"""
+import json
+import sqlite3
+import time
+
+PENDING = "pending"
+FETCHED = "fetched"
+PARSED = "parsed"
+IMAGE_DOWNLOADED = "image_downloaded"
+FAILED = "failed"
+
+MAX_RETRIES = 3
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS books (
+    url TEXT PRIMARY KEY,
+    position INTEGER,
+    status TEXT NOT NULL DEFAULT 'pending',
+    retries INTEGER NOT NULL DEFAULT 0,
+    error TEXT,
+    image_url TEXT,
+    image_path TEXT,
+    record TEXT,
+    updated_at REAL,
+    list_url TEXT,
+    list_rank INTEGER,
+    scraped_at REAL
+);
+CREATE INDEX IF NOT EXISTS idx_books_status ON books(status);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+"""
+
+
+class CrawlState:
+    """
+    Thin wrapper around the SQLite crawl-state database.
+    Attributes:
+        path (str): Location of the database file.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.conn = sqlite3.connect(path)
+        self.conn.row_factory = sqlite3.Row
+        # WAL keeps each small status update cheap and crash-safe
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript(_SCHEMA)
+        # Databases from before refresh support lack the list/scrape-time columns
+        columns = {row["name"] for row in self.conn.execute("PRAGMA table_info(books)")}
+        for column, column_type in (("list_url", "TEXT"), ("list_rank", "INTEGER"), ("scraped_at", "REAL")):
+            if column not in columns:
+                self.conn.execute(f"ALTER TABLE books ADD COLUMN {column} {column_type}")
+        self.conn.commit()
+
+    def close(self) -> None:
+        self.conn.close()
+
+    # --- meta ---------------------------------------------------------------
+
+    def get_meta(self, key: str) -> str | None:
+        row = self.conn.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row["value"] if row else None
+
+    def set_meta(self, key: str, value: str) -> None:
+        with self.conn:
+            self.conn.execute(
+                "INSERT INTO meta (key, value) VALUES (?, ?) "
+                "ON CONFLICT(key) DO UPDATE SET value = excluded.value",
+                (key, value),
+            )
+
+    # --- frontier -----------------------------------------------------------
+
+    def add_urls(self, urls: list[str], list_url: str | None = None,
+                 ranks: dict[str, int] | None = None) -> list[dict]:
+        """
+        Insert new book URLs as pending; URLs already known are left untouched. Returns the newly added rows.
+        Args:
+            list_url (str | None): The list the URLs were found on.
+            ranks (dict[str, int] | None): Rank of each URL within that list.
+        """
+        added = []
+        ranks = ranks or {}
+        with self.conn:
+            position = self.conn.execute("SELECT COALESCE(MAX(position), 0) FROM books").fetchone()[0]
+            for url in urls:
+                cursor = self.conn.execute(
+                    "INSERT OR IGNORE INTO books (url, position, updated_at, list_url, list_rank) "
+                    "VALUES (?, ?, ?, ?, ?)",
+                    (url, position + 1, time.time(), list_url, ranks.get(url)),
+                )
+                if cursor.rowcount:
+                    position += 1
+                    added.append({"url": url, "position": position, "record": None})
+        return added
+
+    def iter_urls(self):
+        """Every known book URL, for rebuilding the in-memory seen index on restart."""
+        for row in self.conn.execute("SELECT url FROM books"):
+            yield row["url"]
+
+    def pending_books(self, max_retries: int = MAX_RETRIES) -> list[dict]:
+        """Rows that still need work, in discovery order. Parsed rows are only returned if their cover is missing."""
+        rows = self.conn.execute(
+            """
+            SELECT * FROM books
+            WHERE status IN (?, ?)
+               OR (status = ? AND image_url IS NOT NULL)
+               OR (status = ? AND retries < ?)
+            ORDER BY position
+            """,
+            (PENDING, FETCHED, PARSED, FAILED, max_retries),
+        ).fetchall()
+        return [dict(row) for row in rows]
+
+    def update_list_ranks(self, list_url: str, ranks: dict[str, int]) -> list[str]:
+        """
+        Record the current rank of known books on `list_url`. Books first found on another list are left alone;
+        books from before ranks were tracked just take the rank.
+        Returns:
+            list[str]: URLs whose rank in this list changed.
+        """
+        changed = []
+        with self.conn:
+            for url, rank in ranks.items():
+                row = self.conn.execute("SELECT list_url, list_rank FROM books WHERE url = ?", (url,)).fetchone()
+                if row is None or (row["list_url"] is not None and row["list_url"] != list_url):
+                    continue
+                if row["list_rank"] == rank:
+                    continue
+                if row["list_rank"] is not None:
+                    changed.append(url)
+                self.conn.execute("UPDATE books SET list_url = ?, list_rank = ? WHERE url = ?", (list_url, rank, url))
+        return changed
+
+    def stale_books(self, ttl: float) -> list[dict]:
+        """Completed rows whose details were scraped more than `ttl` seconds ago, in discovery order."""
+        rows = self.conn.execute(
+            """
+            SELECT * FROM books
+            WHERE status IN (?, ?) AND COALESCE(scraped_at, updated_at) < ?
+            ORDER BY position
+            """,
+            (PARSED, IMAGE_DOWNLOADED, time.time() - ttl),
+        ).fetchall()
+        return [dict(row) for row in rows]
+
+    def get_book(self, url: str) -> dict | None:
+        row = self.conn.execute("SELECT * FROM books WHERE url = ?", (url,)).fetchone()
+        return dict(row) if row else None
+
+    def _update(self, url: str, **fields) -> None:
+        fields["updated_at"] = time.time()
+        columns = ", ".join(f"{name} = ?" for name in fields)
+        with self.conn:
+            self.conn.execute(f"UPDATE books SET {columns} WHERE url = ?", (*fields.values(), url))
+
+    def mark_fetched(self, url: str) -> None:
+        self._update(url, status=FETCHED, error=None)
+
+    def mark_parsed(self, url: str, record: dict) -> None:
+        self._update(url, status=PARSED, error=None, image_url=record.get("image_url"),
+                     record=json.dumps(record, ensure_ascii=False), scraped_at=time.time())
+
+    def mark_image_downloaded(self, url: str, image_path: str) -> None:
+        self._update(url, status=IMAGE_DOWNLOADED, error=None, image_path=image_path)
+
+    def mark_failed(self, url: str, error: str) -> None:
+        with self.conn:
+            self.conn.execute(
+                "UPDATE books SET status = ?, error = ?, retries = retries + 1, updated_at = ? WHERE url = ?",
+                (FAILED, error, time.time(), url),
+            )
+
+    def mark_refresh_failed(self, url: str, error: str) -> None:
+        """Note that re-scraping an already scraped book failed, keeping its status, record and scrape time."""
+        self._update(url, error=f"refresh: {error}")
+
+    # --- stats --------------------------------------------------------------
+
+    def status_counts(self) -> dict[str, int]:
+        return {row["status"]: row["n"] for row in
+                self.conn.execute("SELECT status, COUNT(*) AS n FROM books GROUP BY status")}
@@ -1,12 +1,41 @@
-import requests
+"""
+Goodreads list crawler: the fetch / parse / download functions and the crawl driver.
+
+Importing this module has no side effects (no directories, sessions or
+requests are created), and the heavy dependencies (requests, BeautifulSoup,
+Pillow) are only imported by the functions that use them, so `--help` and
+parser-only users start instantly. Run the crawl with the `goodreads-scraper`
+command or `python -m scraper.goodreads_scraper`.
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import functools
 import os
 import time
 import random
 import json
-from bs4 import BeautifulSoup
-from urllib.parse import urljoin # Useful for constructing full image URLs
+import re
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from typing import TYPE_CHECKING
+from urllib.parse import parse_qsl, urlencode, urljoin, urlsplit, urlunsplit
 
-#TODO FUNCTION TYPING
+from . import crawl_state
+from .cover_store import CoverStore, hash_bytes
+from .crawl_state import CrawlState
+from .http_cache import HttpCache
+from .metrics import Metrics, export_periodically
+from .pipeline import Emit, Pipeline, Stage
+from .record_store import JsonlWriter, export_json, iter_records, merge_records
+from .rate_limiter import AdaptiveRateLimiter, HostRateLimiter
+from .seen_index import SeenIndex, strip_tracking
+from .thumbnails import RESIZED_DIR, ThumbnailWriteError, pyramid_paths, save_pyramid, thumbnail_path
+
+if TYPE_CHECKING:
+    import requests
+
+    from .crawl_engine import AsyncFetcher
 
 
 list_page_url = "https://www.goodreads.com/list/show/43342.NEW_ADULT_fantasy_paranormal_romance"
@@ -17,24 +46,89 @@ headers = {
 
 
 # Create directories
-IMAGE_DIR = "goodreads data/goodreads_book_covers"
+# Covers are stored by content hash in sharded subdirectories (see cover_store.py)
+COVER_STORE_DIR = "goodreads data/cover_store"
+# Covers being downloaded; a transfer cut off mid-way resumes from here with a Range request
+PARTIAL_DIR = "goodreads data/partial_covers"
 DATA_DIR = "goodreads data/goodreads_book_data"
-os.makedirs(IMAGE_DIR, exist_ok=True)
-os.makedirs(DATA_DIR, exist_ok=True)
-
-
-def fetch_page(url: str, headers: dict, delay_min: float = 5, delay_max: float = 10) -> str:
+STATE_DB = os.path.join(DATA_DIR, "crawl_state.sqlite3")
+# Records are streamed here as they are parsed; the .json file is exported from it at the end
+RECORDS_FILE = os.path.join(DATA_DIR, "goodreads_books_data.jsonl")
+RECORDS_FSYNC_EVERY = 20
+# Counters/histograms of the crawl, rewritten every METRICS_INTERVAL seconds while it runs
+METRICS_PROM_FILE = os.path.join(DATA_DIR, "metrics.prom")
+METRICS_JSON_FILE = os.path.join(DATA_DIR, "metrics.json")
+METRICS_INTERVAL = 30
+# --refresh re-scrapes books whose details are older than this (ratings/review counts drift)
+REFRESH_TTL = 7 * 24 * 3600
+
+# Cached list/detail pages make re-runs (e.g. after a parser fix) skip the network
+CACHE_DIR = "goodreads data/http_cache"
+CACHE_TTL = 7 * 24 * 3600 # Revalidate pages older than a week
+CACHE_MAX_BYTES = 2 * 1024 ** 3
+
+# Concurrency / politeness settings for the async detail crawl.
+# The per-host starting rates match the average of the old fixed sleeps (5-15 s per detail
+# page, 3-7 s per image). From there each host's rate adapts to its responses (AIMD, see
+# rate_limiter.py) between the floor and ceiling below; --fixed-rate keeps the start rates.
+# Goodreads' HTML pages never go faster than the old politeness budget: the adaptive limiter
+# only backs off from it and recovers (raise the ceiling with --page-rate-max).
+MAX_IN_FLIGHT = 4
+PAGE_REQUESTS_PER_SEC = 1 / 10
+IMAGE_REQUESTS_PER_SEC = 1 / 5
+PAGE_MIN_REQUESTS_PER_SEC = 1 / 60
+PAGE_MAX_REQUESTS_PER_SEC = PAGE_REQUESTS_PER_SEC
+# Covers come from a CDN, which tolerates a much higher rate than the HTML pages
+IMAGE_MIN_REQUESTS_PER_SEC = 1 / 30
+IMAGE_MAX_REQUESTS_PER_SEC = 5
+# Detail pages are parsed in worker processes so parsing never stalls the I/O loop (0 = parse inline)
+PARSE_WORKERS = 2
+# With --resize-inline covers are decoded and thumbnailed in memory by these threads
+# (Pillow releases the GIL while decoding/resizing), so the event loop keeps downloading
+RESIZE_WORKERS = 2
+# List pages are numbered ?page=N; all pages after the first are fetched concurrently
+PAGE_PARAM_RE = re.compile(r'[?&]page=(\d+)')
+# Seed lists are paginated by this many workers at a time
+LIST_WORKERS = 2
+# Bounded queues between the crawl stages; a full queue makes the stage before it wait
+LIST_QUEUE_SIZE = 10
+DETAIL_QUEUE_SIZE = 200
+RECORD_QUEUE_SIZE = 50
+IMAGE_QUEUE_SIZE = 100
+
+# One pooled keep-alive session for list, detail and image requests, retrying
+# timeouts/429/5xx with exponential backoff + jitter instead of dropping the book
+HTTP_RETRIES = 4
+HTTP_BACKOFF_FACTOR = 2.0
+
+
+@functools.cache
+def default_session() -> requests.Session:
+    """The shared pooled session, built on first use rather than at import."""
+    from .http_session import build_session
+    return build_session(headers, pool_size=MAX_IN_FLIGHT * 2, retries=HTTP_RETRIES,
+                         backoff_factor=HTTP_BACKOFF_FACTOR)
+
+
+@functools.cache
+def default_cache() -> HttpCache:
+    """The on-disk page cache, opened on first use rather than at import."""
+    return HttpCache(CACHE_DIR, ttl=CACHE_TTL, max_bytes=CACHE_MAX_BYTES)
+
+
+def fetch_page(url: str, headers: dict, delay_min: float = 5, delay_max: float = 10) -> str | None:
+    from .crawl_engine import request_page
+    http_cache = default_cache()
+    cached = http_cache.get_fresh(url)
+    if cached is not None:
+        print(f"Cache hit: {url}")
+        return cached
     print(f"Fetching: {url}")
     time.sleep(random.uniform(delay_min, delay_max)) # Critical delay
-    try:
-        response = requests.get(url, headers=headers, timeout=15) # Add timeout
-        response.raise_for_status()
-        return response.text
-    except requests.exceptions.RequestException as e:
-        print(f"Error fetching {url}: {e}")
-        return None
+    return request_page(url, headers, timeout=15, cache=http_cache, session=default_session()) # Add timeout
 
 def extract_book_links_from_list_page(html: str, base_url: str) -> list[str]:
+    from bs4 import BeautifulSoup
     soup = BeautifulSoup(html, 'html.parser')
     book_links = []
 
@@ -54,153 +148,41 @@ def extract_book_links_from_list_page(html: str, base_url: str) -> list[str]:
         if link_tag and link_tag.get('href'):
             relative_url = link_tag['href']
             full_url = urljoin(base_url, relative_url)
-            book_links.append(full_url)
-    return list(set(book_links)) # Return unique links
-
+            book_links.append(strip_tracking(full_url))
+    return list(dict.fromkeys(book_links)) # Return unique links, keeping the list order
 
-initial_html = fetch_page(list_page_url, headers)
 
-if not initial_html:
-    print("Failed to get initial list page. Exiting.")
-    exit()
-def get_next_goodreads_page_url(html: str, current_url: str) -> str:
+def get_next_goodreads_page_url(html: str, current_url: str) -> str | None:
+    from bs4 import BeautifulSoup
     soup = BeautifulSoup(html, 'html.parser')
     next_page_link = soup.find('a', class_='next_page')
     if next_page_link and next_page_link.get('href'):
         next_page_relative_url = next_page_link['href']
         return urljoin(current_url, next_page_relative_url)
     return None
- 
-book_detail_urls = []
-next_page = True
-while next_page:
-    book_detail_urls.extend(extract_book_links_from_list_page(initial_html, list_page_url))
-
-    next_page = get_next_goodreads_page_url(initial_html, list_page_url)
-    if next_page:
-        print(f"Found next page: {next_page}")
-        initial_html = fetch_page(next_page, headers)
-    else:
-        print("No more pages found.")
-        next_page = False
-print(f"Total book detail URLs found: {len(book_detail_urls)}")
-
- # To save data in a structured format
-
-def extract_book_details(book_html: str, book_url: str) -> dict:
-    soup = BeautifulSoup(book_html, 'html.parser')
-    book_data = {
-        'url': book_url,
-        'title': None,
-        'author': None,
-        'image_url': None,
-        'description': None,
-        'genres': [],
-        'pages': None,
-        'publication_year': None,
-        'average_rating': None,
-        'ratings_count': None,
-        'reviews_count': None,
-        'description': None,
-    }
 
-    try:
-        # Title
-        title_tag = soup.find('h1', class_='Text__title1') # New Goodreads UI
-        if not title_tag: # Fallback for older UI or variations
-             title_tag = soup.find('h1', id='bookTitle')
-        if title_tag:
-            book_data['title'] = title_tag.get_text(strip=True)
-
-        # Author
-        author_tag = soup.find('span', class_='ContributorLink__name') # New Goodreads UI
-        if not author_tag: # Fallback
-            author_tag = soup.find('a', class_='authorName')
-        if author_tag:
-            book_data['author'] = author_tag.get_text(strip=True)
-
-        # Main Image URL
-        image_tag = soup.find('img', class_='ResponsiveImage') # New Goodreads UI
-        if not image_tag: # Fallback
-            image_tag = soup.find('img', id='bookCover')
-        if image_tag and image_tag.get('src'):
-            src = image_tag.get('src')
-            if src.startswith('//'):
-                src = 'https:' + src
-            book_data['image_url'] = src
-
-        # Description (often in a div with a "show more" button)
-        # This is where Selenium often becomes necessary for full text if truncated
-        description_div = soup.find('div', id='description')
-        if description_div:
-            # Look for the full description text. It might be in a 'span' that expands.
-            full_description_span = description_div.find('span', style='display:none') # If expanded
-            if full_description_span:
-                book_data['description'] = full_description_span.get_text(strip=True)
-            else: # If description is fully visible
-                book_data['description'] = description_div.get_text(strip=True, separator=' ')
-                # Clean up "more..." or "less..." if present
-                book_data['description'] = book_data['description'].replace('...more', '').replace('...less', '').strip()
-
-
-        # Genres (often found in a div or section)
-        genre_tags = soup.find_all('a', class_='Button--tag-small') # Example for new UI tags
-        if not genre_tags: # Fallback
-             genre_tags = soup.select('div[data-testid="genresList"] a span.Button__labelItem')
-        book_data['genres'] = [genre.get_text(strip=True) for genre in genre_tags]
-
-        # Pages
-        pages_tag = soup.find('p', {'data-testid': 'pagesFormat'}) # New Goodreads UI
-        if pages_tag:
-            pages_text = pages_tag.get_text(strip=True)
-            # Extract numbers from "X pages" or "X pages, Y parts"
-            import re
-            match = re.search(r'(\d+)\s+pages', pages_text)
-            if match:
-                book_data['pages'] = int(match.group(1))
-
-        # Publication Year (often within a publication info paragraph)
-        pub_info_tag = soup.find('p', {'data-testid': 'publicationInfo'}) # New Goodreads UI
-        if pub_info_tag:
-            pub_info_text = pub_info_tag.get_text(strip=True)
-            match = re.search(r'published\s+(\d{4})', pub_info_text)
-            if match:
-                book_data['publication_year'] = int(match.group(1))
-            else: # Sometimes just the year is present
-                 match = re.search(r'\b(\d{4})\b', pub_info_text)
-                 if match:
-                     book_data['publication_year'] = int(match.group(1))
-
-
-        # Ratings and Reviews
-        # These selectors are very prone to change.
-        average_rating_tag = soup.find('div', class_='RatingStatistics__rating')
-        if average_rating_tag:
-            book_data['average_rating'] = float(average_rating_tag.get_text(strip=True))
-
-        ratings_reviews_span = soup.find('span', class_='RatingStatistics__info')
-        if ratings_reviews_span:
-            text = ratings_reviews_span.get_text(strip=True).replace(',', '') # Remove commas for numbers
-            ratings_match = re.search(r'(\d+)\s+ratings', text)
-            if ratings_match:
-                book_data['ratings_count'] = int(ratings_match.group(1))
-
-            reviews_match = re.search(r'(\d+)\s+reviews', text)
-            if reviews_match:
-                book_data['reviews_count'] = int(reviews_match.group(1))
-        
-        # Formatted tag which is the book description
-        desc_tag = soup.find('div', {'data-testid': 'contentContainer'})
-        if desc_tag:
-            book_data['description'] = desc_tag.get_text(strip=True)
-
-        
-
-
-    except Exception as e:
-        print(f"Error parsing details for {book_url}: {e}")
-
-    return book_data
+
+def get_list_page_count(html: str) -> int | None:
+    """Number of pages of a list, from the highest page number in its pagination links (None if there are none)."""
+    from bs4 import BeautifulSoup, SoupStrainer
+    soup = BeautifulSoup(html, 'html.parser', parse_only=SoupStrainer('div', class_='pagination'))
+    numbers = []
+    for tag in soup.find_all(['a', 'em', 'span']):
+        text = tag.get_text(strip=True)
+        if text.isdigit():
+            numbers.append(int(text))
+        match = PAGE_PARAM_RE.search(tag.get('href', ''))
+        if match:
+            numbers.append(int(match.group(1)))
+    return max(numbers) if numbers else None
+
+
+def build_list_page_url(list_url: str, page: int) -> str:
+    """The URL of page `page` of a list (its ?page=N form)."""
+    parts = urlsplit(list_url)
+    query = [(key, value) for key, value in parse_qsl(parts.query) if key != 'page'] + [('page', str(page))]
+    return urlunsplit((parts.scheme, parts.netloc, parts.path, urlencode(query), ''))
+
 
 def download_image(image_url: str, save_path: str) -> None:
     """
@@ -208,53 +190,456 @@ def download_image(image_url: str, save_path: str) -> None:
     Includes crucial delays for ethical scraping on Goodreads.
     """
     print(f"Attempting to download: {image_url}")
-    try:
-        # Goodreads has a more strict scraping policy, so need to include the random delays
-        # This delay is *in addition* to delays before fetching HTML pages.
-        time.sleep(random.uniform(3, 7)) # Wait 3-7 seconds between each image download
-
-        response = requests.get(image_url, stream=True, headers=headers, timeout=10)
-        response.raise_for_status() # Raise an HTTPError for bad responses (4xx or 5xx)
-
-        with open(save_path, 'wb') as out_file:
-            # Use iter_content for efficient downloading of large files
-            for chunk in response.iter_content(chunk_size=8192):
-                out_file.write(chunk)
-        print(f"Successfully downloaded: {os.path.basename(save_path)}")
-
-    except requests.exceptions.RequestException as e:
-        print(f"Error downloading {image_url}: {e}")
-    except Exception as e:
-        print(f"An unexpected error occurred while downloading {image_url}: {e}")
-
-
-# Iterate and scrape details
-
-all_books_data = []
-
-for i, book_url in enumerate(book_detail_urls):
-    print(f"Scraping details for book {i+1}/{len(book_detail_urls)}: {book_url}")
-    book_html = fetch_page(book_url, headers, delay_min=5, delay_max=15) # Longer delay for detail pages
-
-    if book_html:
-        book_details = extract_book_details(book_html, book_url)
-        all_books_data.append(book_details)
+    from .crawl_engine import request_image
+    if os.path.exists(save_path):
+        # Complete files only ever appear by an atomic rename, so existing means done
+        print(f"Already downloaded: {save_path}")
+        return
+    # Goodreads has a more strict scraping policy, so need to include the random delays
+    # This delay is *in addition* to delays before fetching HTML pages.
+    time.sleep(random.uniform(3, 7)) # Wait 3-7 seconds between each image download
+    request_image(image_url, save_path, headers, timeout=10, session=default_session())
+
+
+class GoodreadsCrawler:
+    """
+    The crawl as four concurrent stages connected by bounded queues:
+        list pages -> detail pages (fetch + parse) -> record writer -> cover downloads
+    so covers start landing while pagination is still running, and the total
+    run time approaches that of the slowest stage instead of the sum of all of them.
+    Attributes:
+        state (CrawlState): Durable crawl frontier.
+        records (JsonlWriter): Output for parsed book records.
+        fetcher (AsyncFetcher): Rate-limited concurrent HTTP client.
+        covers (CoverStore): Content-addressed cover storage.
+        parse_pool (ProcessPoolExecutor | None): Worker processes for parsing (None parses inline).
+        seen (SeenIndex): Books already queued from any list, so each is fetched once per crawl.
+        metrics (Metrics): Crawl counters, latencies and queue depths.
+        resize_pool (ThreadPoolExecutor | None): Resize covers in memory as they arrive (None stores originals only).
+        keep_originals (bool): With a resize pool, also keep the full-size cover in the cover store.
+        refresh_ttl (float | None): Refresh mode: re-walk the lists and re-scrape books older than this
+            many seconds or whose rank in their list changed (None for a normal crawl).
+    """
 
+    def __init__(self, state: CrawlState, records: JsonlWriter, fetcher: AsyncFetcher,
+                 covers: CoverStore, parse_pool: ProcessPoolExecutor | None = None,
+                 workers: int = MAX_IN_FLIGHT, seen: SeenIndex | None = None,
+                 metrics: Metrics | None = None, resize_pool: ThreadPoolExecutor | None = None,
+                 keep_originals: bool = True, refresh_ttl: float | None = None):
+        self.refresh_ttl = refresh_ttl
+        self.resize_pool = resize_pool
+        self.keep_originals = keep_originals
+        self.metrics = metrics if metrics is not None else Metrics()
+        self.state = state
+        self.records = records
+        self.fetcher = fetcher
+        self.covers = covers
+        self.parse_pool = parse_pool
+        self.resume_rows = state.pending_books(crawl_state.MAX_RETRIES)
+        self.refreshing: set[str] = set()
+        if refresh_ttl is not None:
+            stale_rows = state.stale_books(refresh_ttl)
+            for row in stale_rows:
+                row['refresh'] = True
+                self.refreshing.add(row['url'])
+            self.resume_rows += stale_rows
+            self.metrics.inc("scraper_books_refreshed_total", len(stale_rows), reason="stale")
+            print(f"{len(stale_rows)} books scraped more than {refresh_ttl / 86400:g} days ago will be refreshed")
+        self.seen = seen if seen is not None else SeenIndex()
+        self.seen.update(state.iter_urls())
+        self.visited_list_pages: set[str] = set()
+        # Image URL -> future of its (content hash, path), while a worker is downloading it
+        self.cover_downloads: dict[str, asyncio.Future] = {}
+        self.pipeline = Pipeline([
+            Stage("list pages", self.discover_books, workers=LIST_WORKERS, queue_size=LIST_QUEUE_SIZE),
+            Stage("book details", self.scrape_details, workers=workers, queue_size=DETAIL_QUEUE_SIZE),
+            Stage("records", self.save_record, workers=1, queue_size=RECORD_QUEUE_SIZE),
+            Stage("covers", self.download_cover, workers=workers, queue_size=IMAGE_QUEUE_SIZE),
+        ])
+
+    def sample_gauges(self) -> None:
+        for stage, depth in self.pipeline.queue_depths().items():
+            self.metrics.set_gauge("scraper_queue_depth", depth, stage=stage)
+        for page_type, limiter in (("page", self.fetcher.page_limiter), ("image", self.fetcher.image_limiter)):
+            if isinstance(limiter, AdaptiveRateLimiter):
+                for host, stats in limiter.summary().items():
+                    self.metrics.set_gauge("scraper_rate_limit", stats["rate"], type=page_type, host=host)
+
+    async def run(self, list_urls: list[str], metrics_interval: float = METRICS_INTERVAL) -> None:
+        print(f"{len(self.resume_rows)} books left over from previous runs ({self.state.status_counts()})")
+        exporter = asyncio.create_task(export_periodically(
+            self.metrics, metrics_interval, METRICS_PROM_FILE, METRICS_JSON_FILE, self.sample_gauges))
+        try:
+            await self.pipeline.run(list_urls)
+        finally:
+            exporter.cancel()
+            # Let an export already running in its thread finish before the final one
+            await asyncio.gather(exporter, return_exceptions=True)
+            self.sample_gauges()
+            self.metrics.write(METRICS_PROM_FILE, METRICS_JSON_FILE)
+
+    async def discover_books(self, list_url: str, emit: Emit) -> None:
+        # Unfinished books from earlier runs go first, ahead of anything pagination finds
+        if self.resume_rows:
+            rows, self.resume_rows = self.resume_rows, []
+            for row in rows:
+                await emit(row)
+
+        list_complete_key = f"list_complete:{list_url}"
+        list_next_key = f"list_next:{list_url}"
+        list_rank_key = f"list_rank:{list_url}"
+        # Ranks move between runs, so a refresh always walks the whole list again
+        refresh = self.refresh_ttl is not None
+        if not refresh:
+            if self.state.get_meta(list_complete_key):
+                print(f"List pages of {list_url} already discovered, resuming from saved crawl state.")
+                return
+            if self.state.get_meta(list_next_key):
+                # A previous run was following next_page links: carry on from the last page it reached
+                await self.follow_next_links(list_url, self.state.get_meta(list_next_key),
+                                             int(self.state.get_meta(list_rank_key) or 0), emit)
+                return
+
+        if list_url in self.visited_list_pages:
+            print(f"List page {list_url} already walked in this run.")
+            return
+        self.visited_list_pages.add(list_url)
+        list_html = await self.fetcher.fetch_page(list_url, page_type="list")
+        if not list_html:
+            print("Stopped paginating after a fetch error; the next run will resume from this page.")
+            return
+        per_page = await self.queue_list_page(list_url, list_url, list_html, 0, emit)
+
+        page_count = get_list_page_count(list_html)
+        if not page_count or page_count <= 1:
+            # No numbered pagination: fall back to following next_page links one page at a time
+            next_page_url = get_next_goodreads_page_url(list_html, list_url)
+            if next_page_url:
+                await self.follow_next_links(list_url, next_page_url, per_page, emit)
+            elif not refresh:
+                self.state.set_meta(list_complete_key, "1")
+            return
+
+        # Every other page URL is known up front, so they are all requested at once and
+        # the rate limiter / in-flight cap decide how fast they go out
+        pages = [(number, build_list_page_url(list_url, number)) for number in range(2, page_count + 1)]
+        pages = [(number, url) for number, url in pages if url not in self.visited_list_pages
+                 and (refresh or not self.state.get_meta(f"list_page_done:{url}"))]
+        self.visited_list_pages.update(url for _, url in pages)
+        print(f"{list_url} has {page_count} pages, fetching {len(pages)} of them concurrently")
+
+        async def fetch_list_page(number: int, page_url: str) -> tuple[int, str, str | None]:
+            return number, page_url, await self.fetcher.fetch_page(page_url, page_type="list")
+
+        tasks = [asyncio.create_task(fetch_list_page(number, url)) for number, url in pages]
+        complete = True
+        try:
+            for next_done in asyncio.as_completed(tasks):
+                number, page_url, page_html = await next_done
+                if not page_html:
+                    complete = False
+                    continue
+                await self.queue_list_page(list_url, page_url, page_html, (number - 1) * per_page, emit)
+                if not refresh:
+                    self.state.set_meta(f"list_page_done:{page_url}", "1")
+        finally:
+            for task in tasks:
+                task.cancel()
+        if refresh:
+            return
+        if complete:
+            self.state.set_meta(list_complete_key, "1")
+        else:
+            print(f"Some pages of {list_url} failed; the next run fetches just those again.")
+
+    async def follow_next_links(self, list_url: str, current_page_url: str, rank: int, emit: Emit) -> None:
+        """Sequential pagination through next_page links, for lists without numbered page links."""
+        refresh = self.refresh_ttl is not None
+        while current_page_url:
+            if current_page_url in self.visited_list_pages:
+                # Overlapping seeds (e.g. page 2 of a list given as its own seed): the rest is walked already
+                print(f"List page {current_page_url} already walked in this run.")
+                return
+            self.visited_list_pages.add(current_page_url)
+            list_html = await self.fetcher.fetch_page(current_page_url, page_type="list")
+            if not list_html:
+                print("Stopped paginating after a fetch error; the next run will resume from this page.")
+                return
+            rank += await self.queue_list_page(list_url, current_page_url, list_html, rank, emit)
+
+            current_page_url = get_next_goodreads_page_url(list_html, list_url)
+            if refresh:
+                continue
+            if current_page_url:
+                print(f"Found next page: {current_page_url}")
+                self.state.set_meta(f"list_next:{list_url}", current_page_url)
+                self.state.set_meta(f"list_rank:{list_url}", str(rank))
+            else:
+                print("No more pages found.")
+                self.state.set_meta(f"list_complete:{list_url}", "1")
+
+    async def queue_list_page(self, list_url: str, page_url: str, list_html: str, rank: int, emit: Emit) -> int:
+        """Record and emit the new books on one list page, whose first book has rank `rank` + 1. Returns the page size."""
+        page_urls = extract_book_links_from_list_page(list_html, list_url)
+        ranks = {url: rank + i for i, url in enumerate(page_urls, start=1)}
+        # Books already reached through another list (or URL variant) are skipped here
+        book_urls = [url for url in page_urls if self.seen.add(url)]
+        added = self.state.add_urls(book_urls, list_url, ranks)
+        print(f"Queued {len(added)} new book URLs from {page_url}")
+        self.metrics.inc("scraper_books_discovered_total", len(added))
+        for row in added:
+            await emit(row)
+        if self.refresh_ttl is not None:
+            await self.refresh_moved_books(list_url, ranks, emit)
+        return len(page_urls)
+
+    async def refresh_moved_books(self, list_url: str, ranks: dict[str, int], emit: Emit) -> None:
+        """Queue books that changed rank in the list (and are not already being refreshed as stale)."""
+        moved = [url for url in self.state.update_list_ranks(list_url, ranks) if url not in self.refreshing]
+        for url in moved:
+            row = self.state.get_book(url)
+            if row['status'] not in (crawl_state.PARSED, crawl_state.IMAGE_DOWNLOADED):
+                continue  # still in the normal crawl
+            self.refreshing.add(url)
+            row['refresh'] = True
+            self.metrics.inc("scraper_books_refreshed_total", reason="moved")
+            await emit(row)
+        if moved:
+            print(f"Refreshing {len(moved)} books that moved in {list_url}")
+
+    async def scrape_details(self, row: dict, emit: Emit) -> None:
+        book_url = row['url']
+        if row['record'] and not row.get('refresh'):
+            # Parsed on a previous run, only the cover is still missing
+            await emit((row, json.loads(row['record']), False))
+            return
+
+        print(f"Scraping details for book {row['position']}: {book_url}")
+        book_html = await self.fetcher.fetch_page(book_url, page_type="detail")
+        if not book_html:
+            print(f"Skipping details for {book_url} due to fetch error.")
+            if row['record']:
+                # Refreshing a complete book: it keeps its previous details and stays stale for the next refresh
+                self.state.mark_refresh_failed(book_url, "fetch error")
+                self.metrics.inc("scraper_refresh_failures_total")
+            else:
+                self.state.mark_failed(book_url, "fetch error")
+            return
+        if not row['record']:
+            self.state.mark_fetched(book_url)
+
+        from .book_parser import timed_extract_book_details
+        if self.parse_pool:
+            book_details, parse_seconds = await asyncio.get_running_loop().run_in_executor(
+                self.parse_pool, timed_extract_book_details, book_html, book_url)
+        else:
+            book_details, parse_seconds = timed_extract_book_details(book_html, book_url)
+        self.metrics.observe("scraper_parse_seconds", parse_seconds)
+        await emit((row, book_details, True))
+
+    async def save_record(self, item: tuple[dict, dict, bool], emit: Emit) -> None:
+        row, book_details, is_new = item
+        if is_new:
+            # Refreshed books are appended too; merge_records folds them into the catalog after the run
+            self.records.write(book_details)
+            self.state.mark_parsed(row['url'], book_details)
+            self.metrics.inc("scraper_books_parsed_total")
+        if (row.get('refresh') and row['status'] == crawl_state.IMAGE_DOWNLOADED
+                and book_details['image_url'] == row['image_url']):
+            # Same cover as last time: keep the stored file, no download
+            self.state.mark_image_downloaded(row['url'], row['image_path'])
+            return
         # Download image if URL found
         if book_details['image_url']:
-            filename_suffix = book_details['image_url'].split('/')[-1].split('?')[0]
-            # Use book title for filename if available, otherwise generic
-            if book_details['title']:
-                sanitized_title = "".join([c for c in book_details['title'] if c.isalnum() or c.isspace()]).strip()
-                filename = os.path.join(IMAGE_DIR, f"{sanitized_title[:50]}_{filename_suffix}")
-            else:
-                filename = os.path.join(IMAGE_DIR, f"book_cover_{i+1}_{filename_suffix}")
-            download_image(book_details['image_url'], filename)
-    else:
-        print(f"Skipping details for {book_url} due to fetch error.")
-
-# Save all collected data
-data_filename = os.path.join(DATA_DIR, "goodreads_books_data.json")
-with open(data_filename, 'w', encoding='utf-8') as f:
-    json.dump(all_books_data, f, ensure_ascii=False, indent=4)
-print(f"All book data saved to {data_filename}")
\ No newline at end of file
+            await emit((row, book_details))
+
+    async def download_cover(self, item: tuple[dict, dict], emit: Emit) -> None:
+        row, book_details = item
+        image_url = book_details['image_url']
+
+        # Same cover already fetched for another list/edition: just point this book at it
+        known_hash = self.covers.hash_for_image_url(image_url)
+        if known_hash:
+            self.covers.link_book(row['url'], known_hash)
+            # Record the file that is actually on disk: the run that stored this cover may have kept
+            # only the thumbnail, or only the original, whatever this run's flags are
+            candidates = [self.covers.path_for_book(row['url']), thumbnail_path(RESIZED_DIR, known_hash)]
+            if self.resize_pool and not self.keep_originals:
+                candidates.reverse()
+            existing = next((path for path in candidates if path and os.path.exists(path)), None)
+            if existing:
+                self.metrics.inc("scraper_covers_total", result="reused")
+                self.state.mark_image_downloaded(row['url'], existing)
+                return
+            # Indexed, but neither file is on disk any more: download it again
+
+        # Another worker is downloading this URL right now (editions sharing a cover): wait for it
+        pending = self.cover_downloads.get(image_url)
+        if pending is not None:
+            stored = await asyncio.shield(pending)
+            if stored is None:
+                self.state.mark_failed(row['url'], "image download error")
+                return
+            content_hash, save_path = stored
+            self.covers.link_book(row['url'], content_hash)
+            self.metrics.inc("scraper_covers_total", result="reused")
+            self.state.mark_image_downloaded(row['url'], save_path)
+            return
+
+        future = asyncio.get_running_loop().create_future()
+        self.cover_downloads[image_url] = future
+        stored = None
+        try:
+            stored = await self.store_cover(row, image_url)
+        finally:
+            del self.cover_downloads[image_url]
+            future.set_result(stored)
+
+    async def store_cover(self, row: dict, image_url: str) -> tuple[str, str] | None:
+        """Download a new cover and store it (resized, with --resize-inline). Returns (content hash, path), or None."""
+        data = await self.fetcher.fetch_image(image_url)
+        if data is None:
+            self.state.mark_failed(row['url'], "image download error")
+            return None
+
+        content_hash = hash_bytes(data)
+        if self.resize_pool:
+            from PIL import Image
+
+            # Fused path: one decode, one write per training size, original only if asked for
+            save_path = thumbnail_path(RESIZED_DIR, content_hash)
+            # Identical bytes under another image URL are already resized; only write the missing
+            # files (covers thumbnailed before the pyramid existed still lack the smaller levels)
+            pyramid = {level: path for level, path in pyramid_paths(content_hash).items() if not os.path.exists(path)}
+            output_path = None if os.path.exists(save_path) else save_path
+            try:
+                if output_path or pyramid:
+                    await asyncio.get_running_loop().run_in_executor(
+                        self.resize_pool, save_pyramid, data, output_path, pyramid)
+            except ThumbnailWriteError as e:
+                print(f"Could not write the thumbnails of {image_url}: {e}")
+                self.state.mark_failed(row['url'], "thumbnail write error")
+                return None
+            except (OSError, ValueError, Image.DecompressionBombError) as e:  # OSError includes UnidentifiedImageError
+                print(f"Could not decode cover {image_url}: {e}")
+                self.state.mark_failed(row['url'], "image decode error")
+                return None
+            stored_path = await asyncio.to_thread(self.covers.put, data, image_url, row['url'],
+                                                  self.keep_originals, content_hash)
+            if self.keep_originals:
+                save_path = stored_path
+        else:
+            save_path = await asyncio.to_thread(self.covers.put, data, image_url, row['url'],
+                                                content_hash=content_hash)
+        print(f"Successfully downloaded: {save_path}")
+        self.metrics.inc("scraper_covers_total", result="downloaded")
+        self.state.mark_image_downloaded(row['url'], save_path)
+        return content_hash, save_path
+
+
+def parse_args(argv: list[str] | None = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Scrape a Goodreads list: book metadata and cover images.")
+    parser.add_argument("--list-url", action="append", dest="list_urls",
+                        help="Goodreads list or shelf to crawl; repeat for several (default: the romantasy list).")
+    parser.add_argument("--lists-file", help="File with one list URL per line, crawled in addition to --list-url.")
+    parser.add_argument("--bloom-capacity", type=int, default=None,
+                        help="Track seen books with a Bloom filter sized for this many books instead of an exact set.")
+    parser.add_argument("--max-in-flight", type=int, default=MAX_IN_FLIGHT,
+                        help="Requests running at the same time (also the number of detail/cover workers).")
+    parser.add_argument("--page-rate", type=float, default=PAGE_REQUESTS_PER_SEC,
+                        help="HTML requests per second, per host (the starting rate unless --fixed-rate).")
+    parser.add_argument("--image-rate", type=float, default=IMAGE_REQUESTS_PER_SEC,
+                        help="Cover requests per second, per host (the starting rate unless --fixed-rate).")
+    parser.add_argument("--page-rate-max", type=float, default=PAGE_MAX_REQUESTS_PER_SEC,
+                        help="Ceiling of the adaptive HTML request rate, per host.")
+    parser.add_argument("--image-rate-max", type=float, default=IMAGE_MAX_REQUESTS_PER_SEC,
+                        help="Ceiling of the adaptive cover request rate, per host.")
+    parser.add_argument("--fixed-rate", action="store_true",
+                        help="Keep --page-rate / --image-rate for the whole run instead of adapting to the server.")
+    parser.add_argument("--metrics-interval", type=float, default=METRICS_INTERVAL,
+                        help=f"Seconds between metrics exports to {METRICS_PROM_FILE} / .json.")
+    parser.add_argument("--resize-inline", action="store_true",
+                        help=f"Resize covers in memory while crawling, writing only the thumbnail (to {RESIZED_DIR}) "
+                             "and the square training sizes.")
+    parser.add_argument("--keep-originals", action="store_true",
+                        help="With --resize-inline, also keep the full-size covers in the cover store.")
+    parser.add_argument("--refresh", action="store_true",
+                        help="Refresh an existing crawl: re-walk the lists, re-scrape stale or moved books "
+                             "and merge the updates into the catalog.")
+    parser.add_argument("--refresh-ttl-days", type=float, default=REFRESH_TTL / 86400,
+                        help="With --refresh, books scraped longer ago than this are re-scraped.")
+    args = parser.parse_args(argv)
+    args.list_urls = args.list_urls or []
+    if args.lists_file:
+        with open(args.lists_file, 'r', encoding='utf-8') as f:
+            args.list_urls += [line.strip() for line in f if line.strip() and not line.startswith('#')]
+    args.list_urls = list(dict.fromkeys(args.list_urls or [list_page_url]))
+    return args
+
+
+def make_limiter(rate: float, min_rate: float, max_rate: float, fixed: bool = False) -> HostRateLimiter:
+    if fixed:
+        return HostRateLimiter(rate)
+    return AdaptiveRateLimiter(rate, min_rate=min(min_rate, rate), max_rate=max(max_rate, rate))
+
+
+def main(argv: list[str] | None = None) -> None:
+    args = parse_args(argv)
+    from .crawl_engine import AsyncFetcher
+
+    os.makedirs(DATA_DIR, exist_ok=True)
+    # Crawl state lives on disk so an interrupted run picks up where it stopped
+    state = CrawlState(STATE_DB)
+    metrics = Metrics()
+    fetcher = AsyncFetcher(
+        headers,
+        max_in_flight=args.max_in_flight,
+        page_limiter=make_limiter(args.page_rate, PAGE_MIN_REQUESTS_PER_SEC, args.page_rate_max, args.fixed_rate),
+        image_limiter=make_limiter(args.image_rate, IMAGE_MIN_REQUESTS_PER_SEC, args.image_rate_max,
+                                   args.fixed_rate),
+        cache=default_cache(),
+        session=default_session(),
+        metrics=metrics,
+        # Refresh runs revalidate cached pages (a 304 costs no download) instead of trusting them for the TTL
+        revalidate=args.refresh,
+        part_dir=PARTIAL_DIR,
+    )
+    covers = CoverStore(COVER_STORE_DIR)
+    parse_pool = ProcessPoolExecutor(PARSE_WORKERS) if PARSE_WORKERS else None
+    resize_pool = ThreadPoolExecutor(RESIZE_WORKERS, thread_name_prefix="resize") if args.resize_inline else None
+    try:
+        with JsonlWriter(RECORDS_FILE, fsync_every=RECORDS_FSYNC_EVERY) as records_writer:
+            crawler = GoodreadsCrawler(state, records_writer, fetcher, covers, parse_pool,
+                                       workers=args.max_in_flight, seen=SeenIndex(args.bloom_capacity),
+                                       metrics=metrics, resize_pool=resize_pool,
+                                       keep_originals=args.keep_originals,
+                                       refresh_ttl=args.refresh_ttl_days * 86400 if args.refresh else None)
+            asyncio.run(crawler.run(args.list_urls, metrics_interval=args.metrics_interval))
+    finally:
+        if parse_pool:
+            parse_pool.shutdown()
+        if resize_pool:
+            resize_pool.shutdown()
+        print(metrics.summary())
+        for page_type, limiter in (("HTML", fetcher.page_limiter), ("Cover", fetcher.image_limiter)):
+            if isinstance(limiter, AdaptiveRateLimiter):
+                for host, stats in limiter.summary().items():
+                    print(f"{page_type} rate for {host} settled at {stats['rate']:.3g} req/s "
+                          f"(mean {stats['mean_rate']:.3g} req/s, {stats['backoffs']} back-offs)")
+        print(f"Crawl state: {state.status_counts()}")
+        state.close()
+        covers.close()
+
+    if args.refresh:
+        merged = merge_records(RECORDS_FILE)
+        print(f"Merged refreshed records into {RECORDS_FILE} ({merged} books)")
+
+    # Save all collected data
+    data_filename = os.path.join(DATA_DIR, "goodreads_books_data.json")
+    saved = export_json(iter_records(RECORDS_FILE), data_filename)
+    print(f"All book data ({saved} books) saved to {RECORDS_FILE} and {data_filename}")
+
+
+# Guarded so `python -m scraper.goodreads_scraper` starts a crawl but imports never do
+if __name__ == "__main__":
+    main()
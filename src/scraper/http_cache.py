@@ -0,0 +1,166 @@
+"""
+On-disk HTTP response cache for the Goodreads scraper.
+
+Bodies are stored under a hash of their URL in sharded subdirectories, and a
+small SQLite index keeps the validators (ETag / Last-Modified), the time the
+entry was stored and the time it was last used. Entries younger than the TTL
+are served straight from disk; older ones are revalidated with a conditional
+GET, and the least recently used entries are evicted once the cache grows past
+its size limit.
+"""
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from dataclasses import dataclass
+
+DEFAULT_TTL = 7 * 24 * 3600  # a week
+DEFAULT_MAX_BYTES = 2 * 1024 ** 3  # 2 GiB
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS entries (
+    key TEXT PRIMARY KEY,
+    url TEXT NOT NULL,
+    etag TEXT,
+    last_modified TEXT,
+    size INTEGER NOT NULL,
+    stored_at REAL NOT NULL,
+    last_access REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_entries_last_access ON entries(last_access);
+"""
+
+
+@dataclass
+class CacheEntry:
+    """
+    A cached response body plus the validators needed to revalidate it.
+    Attributes:
+        body (str): The decoded response body.
+        etag (str | None): The ETag header of the cached response.
+        last_modified (str | None): The Last-Modified header of the cached response.
+        fresh (bool): Whether the entry is still within the TTL.
+    """
+    body: str
+    etag: str | None
+    last_modified: str | None
+    fresh: bool
+
+    def validators(self) -> dict:
+        """Conditional request headers for revalidating this entry."""
+        headers = {}
+        if self.etag:
+            headers["If-None-Match"] = self.etag
+        if self.last_modified:
+            headers["If-Modified-Since"] = self.last_modified
+        return headers
+
+
+class HttpCache:
+    """
+    Size-bounded LRU cache of HTTP response bodies keyed by URL.
+    Safe to share between the worker threads of the fetch engine.
+    Attributes:
+        root (str): Directory holding the bodies and the index database.
+        ttl (float): Seconds an entry is served without revalidation.
+        max_bytes (int): Total body size above which LRU entries are evicted.
+    """
+
+    def __init__(self, root: str, ttl: float = DEFAULT_TTL, max_bytes: int = DEFAULT_MAX_BYTES):
+        self.root = root
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        os.makedirs(root, exist_ok=True)
+        self._lock = threading.Lock()
+        self.conn = sqlite3.connect(os.path.join(root, "index.sqlite3"), check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.executescript(_SCHEMA)
+        self.conn.commit()
+        self._total_bytes = self.conn.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+
+    @staticmethod
+    def _key(url: str) -> str:
+        return hashlib.sha256(url.encode("utf-8")).hexdigest()
+
+    def _body_path(self, key: str) -> str:
+        # Two-character shards keep every directory small
+        return os.path.join(self.root, key[:2], key)
+
+    def lookup(self, url: str) -> CacheEntry | None:
+        """Return the cached entry for `url` (fresh or stale), or None on a miss."""
+        key = self._key(url)
+        with self._lock:
+            row = self.conn.execute(
+                "SELECT etag, last_modified, stored_at FROM entries WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            try:
+                with open(self._body_path(key), "r", encoding="utf-8") as f:
+                    body = f.read()
+            except OSError:
+                # Body went missing behind our back, treat it as a miss
+                self._delete(key)
+                return None
+            now = time.time()
+            with self.conn:
+                self.conn.execute("UPDATE entries SET last_access = ? WHERE key = ?", (now, key))
+        etag, last_modified, stored_at = row
+        return CacheEntry(body, etag, last_modified, fresh=now - stored_at < self.ttl)
+
+    def get_fresh(self, url: str) -> str | None:
+        """Body for `url` if it is cached and within the TTL, otherwise None."""
+        entry = self.lookup(url)
+        return entry.body if entry and entry.fresh else None
+
+    def store(self, url: str, body: str, etag: str | None = None, last_modified: str | None = None) -> None:
+        key = self._key(url)
+        path = self._body_path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        data = body.encode("utf-8")
+        # Write to a temp file first so a crash never leaves a half-written body behind
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+
+        now = time.time()
+        with self._lock:
+            old = self.conn.execute("SELECT size FROM entries WHERE key = ?", (key,)).fetchone()
+            with self.conn:
+                self.conn.execute(
+                    "INSERT OR REPLACE INTO entries (key, url, etag, last_modified, size, stored_at, last_access) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    (key, url, etag, last_modified, len(data), now, now),
+                )
+            self._total_bytes += len(data) - (old[0] if old else 0)
+            self._evict()
+
+    def mark_revalidated(self, url: str) -> None:
+        """The server answered 304 Not Modified: restart the entry's TTL."""
+        now = time.time()
+        with self._lock, self.conn:
+            self.conn.execute(
+                "UPDATE entries SET stored_at = ?, last_access = ? WHERE key = ?", (now, now, self._key(url))
+            )
+
+    def _delete(self, key: str) -> None:
+        row = self.conn.execute("SELECT size FROM entries WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return
+        with self.conn:
+            self.conn.execute("DELETE FROM entries WHERE key = ?", (key,))
+        self._total_bytes -= row[0]
+        try:
+            os.remove(self._body_path(key))
+        except FileNotFoundError:
+            pass
+
+    def _evict(self) -> None:
+        if self._total_bytes <= self.max_bytes:
+            return
+        for key, _ in self.conn.execute("SELECT key, size FROM entries ORDER BY last_access").fetchall():
+            if self._total_bytes <= self.max_bytes:
+                break
+            self._delete(key)
@@ -0,0 +1,51 @@
+"""
+Shared HTTP session for the Goodreads scraper.
+
+One `requests.Session` keeps TCP/TLS connections alive between requests to the
+same host, and urllib3's Retry handles transient failures (timeouts, 429, 5xx)
+with exponential backoff plus jitter, honouring any Retry-After header, so one
+hiccup doesn't silently drop a book.
+"""
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+
+def build_session(headers: dict, pool_size: int = 10, retries: int = 4,
+                  backoff_factor: float = 2.0, backoff_jitter: float = 1.0,
+                  backoff_max: float = 120) -> requests.Session:
+    """
+    Create a pooled session with retry/backoff.
+    Args:
+        headers (dict): Default headers sent with every request (e.g. the User-Agent).
+        pool_size (int): Keep-alive connections kept per host; should be >= the number of in-flight requests.
+        retries (int): Maximum retries per request (connection errors, read errors and retryable statuses).
+        backoff_factor (float): Sleep between retries is backoff_factor * 2 ** (retry - 1) seconds...
+        backoff_jitter (float): ...plus a random 0-backoff_jitter seconds so workers don't retry in lockstep...
+        backoff_max (float): ...capped at backoff_max seconds. A Retry-After header takes precedence.
+    Returns:
+        requests.Session: The configured session.
+    """
+    retry = Retry(
+        total=retries,
+        connect=retries,
+        read=retries,
+        status=retries,
+        status_forcelist=RETRY_STATUSES,
+        allowed_methods=frozenset({"GET", "HEAD"}),
+        backoff_factor=backoff_factor,
+        backoff_jitter=backoff_jitter,
+        backoff_max=backoff_max,
+        respect_retry_after_header=True,
+        # Hand the last response back instead of raising, so raise_for_status() reports the real status
+        raise_on_status=False,
+    )
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+
+    session = requests.Session()
+    session.headers.update(headers)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
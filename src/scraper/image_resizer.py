@@ -1,18 +1,184 @@
-from PIL import Image
+"""
+Incremental, parallel resizing of the stored covers to training thumbnails.
+
+Each cover is decoded once into the 512px thumbnail and the square training
+resolutions (see thumbnails.py). A manifest (SQLite, next to the thumbnails)
+remembers the size and mtime of every source it has resized and the
+resolutions it produced, so unchanged covers are skipped with one stat and
+one lookup. The decode / resize / encode work is spread over a process pool,
+and a cover that fails to decode is moved to a quarantine folder, recorded and
+dropped from the cover store's index, instead of aborting the run. Errors on
+the writing side (disk full, permissions) are not the cover's fault: they stop
+the run without quarantining anything, and the cover is retried next time.
+
+Usage:
+    python -m scraper.image_resizer [--workers 8] [--sizes 256,128,64]
+"""
+import argparse
 import os
+import shutil
+import sqlite3
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from .cover_store import CoverStore
+from .thumbnails import (PYRAMID_SIZES, RESIZED_DIR, THUMBNAIL_SIZE, ThumbnailWriteError, pyramid_paths, save_pyramid,
+                         thumbnail_path)
+
+cover_store_folder = 'goodreads data/cover_store'
+output_folder = RESIZED_DIR
+quarantine_folder = 'goodreads data/quarantine'
+size = THUMBNAIL_SIZE
+MANIFEST_FILE = 'manifest.sqlite3'
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS resized (
+    source TEXT PRIMARY KEY,
+    mtime REAL NOT NULL,
+    size INTEGER NOT NULL,
+    output TEXT NOT NULL,
+    sizes TEXT NOT NULL DEFAULT ''
+);
+CREATE TABLE IF NOT EXISTS quarantined (
+    source TEXT PRIMARY KEY,
+    moved_to TEXT NOT NULL,
+    error TEXT
+);
+"""
+
+
+def is_decode_error(e: Exception) -> bool:
+    """
+    True if `e` means the image itself is bad. Failures are told apart by phase: save_pyramid wraps every
+    error from writing the outputs (including Pillow encoder errors) in ThumbnailWriteError, and an OSError
+    with an errno (EACCES, EIO, ...) from reading the source comes from the file system; anything else was
+    raised while opening or decoding the cover.
+    """
+    if isinstance(e, ThumbnailWriteError):
+        return False
+    return not (isinstance(e, OSError) and e.errno is not None)
+
+
+def resize_one(job: tuple[str, str | None, dict[int, str], tuple[int, int]]) -> tuple[str, str | None, str | None, bool]:
+    """
+    Process-pool worker: resize one cover to its thumbnail and pyramid.
+    Returns:
+        tuple: (source, output, error or None, whether the error is a bad image that should be quarantined).
+    """
+    source, output, pyramid, target_size = job
+    try:
+        save_pyramid(source, output, pyramid, target_size)
+        return source, output, None, False
+    except Exception as e:
+        return source, output, f"{type(e).__name__}: {e}", is_decode_error(e)
+
+
+def quarantine(source: str, error: str, store: CoverStore, content_hash: str, folder: str = quarantine_folder) -> str:
+    """Move a bad cover aside and drop it from the store's index, so nothing lists it and a re-download rewrites it."""
+    os.makedirs(folder, exist_ok=True)
+    moved_to = os.path.join(folder, os.path.basename(source))
+    shutil.move(source, moved_to)
+    store.remove(content_hash)
+    print(f"Quarantined {source} ({error})")
+    return moved_to
+
+
+def main(argv: list[str] | None = None) -> None:
+    parser = argparse.ArgumentParser(description="Resize stored covers to training thumbnails.")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="Resize processes.")
+    parser.add_argument("--sizes", default=",".join(map(str, PYRAMID_SIZES)),
+                        help="Comma-separated square training resolutions to produce besides the thumbnail.")
+    args = parser.parse_args(argv)
+    sizes = tuple(sorted({int(level) for level in args.sizes.split(",") if level.strip()}, reverse=True))
+    sizes_key = ",".join(map(str, sizes))
+
+    os.makedirs(output_folder, exist_ok=True)
+    manifest = sqlite3.connect(os.path.join(output_folder, MANIFEST_FILE))
+    manifest.executescript(_SCHEMA)
+    if "sizes" not in {row[1] for row in manifest.execute("PRAGMA table_info(resized)")}:
+        manifest.execute("ALTER TABLE resized ADD COLUMN sizes TEXT NOT NULL DEFAULT ''")
+    # A cover is unchanged if its source stat and the set of resolutions both match
+    done = {source: (mtime, file_size, done_sizes) for source, mtime, file_size, done_sizes
+            in manifest.execute("SELECT source, mtime, size, sizes FROM resized")}
+    skipped = {source for (source,) in manifest.execute("SELECT source FROM quarantined")}
+
+    # Covers come from the content-addressed store's index, so no directory listings are needed;
+    # the output mirrors the store's shard layout (ab/<hash>.jpg)
+    store = CoverStore(cover_store_folder)
+    jobs, stats, hashes = [], {}, {}
+    unchanged = 0
+    for content_hash, input_path in store.iter_images():
+        if input_path in skipped:
+            store.remove(content_hash)  # quarantined by a run from before quarantine updated the index
+            continue
+        try:
+            stat = os.stat(input_path)
+        except FileNotFoundError:
+            continue
+        stats[input_path] = (stat.st_mtime, stat.st_size)
+        hashes[input_path] = content_hash
+        if done.get(input_path) == (*stats[input_path], sizes_key):
+            unchanged += 1
+            continue
+        output_path = thumbnail_path(output_folder, content_hash)
+        pyramid = pyramid_paths(content_hash, sizes, output_folder)
+        if input_path not in done and all(os.path.exists(path) for path in [output_path, *pyramid.values()]):
+            # Resized before the manifest existed (or by the crawler's --resize-inline): just record it
+            manifest.execute("INSERT OR REPLACE INTO resized VALUES (?, ?, ?, ?, ?)",
+                             (input_path, *stats[input_path], output_path, sizes_key))
+            unchanged += 1
+            continue
+        jobs.append((input_path, output_path, pyramid, size))
+    backfill = 0
+    for content_hash in store.iter_thumbnail_only():
+        # Resized by the crawler without keeping the original: the thumbnail is the only source left,
+        # still larger than every pyramid level, so the levels it lacks are made from it
+        input_path = thumbnail_path(output_folder, content_hash)
+        pyramid = {level: path for level, path in pyramid_paths(content_hash, sizes, output_folder).items()
+                   if not os.path.exists(path)}
+        if pyramid and os.path.exists(input_path):
+            hashes[input_path] = content_hash
+            jobs.append((input_path, None, pyramid, size))
+            backfill += 1
+    manifest.commit()
+
+    print(f"Resizing {len(jobs)} images (thumbnail + {sizes_key or 'no'} px) from {cover_store_folder} to {output_folder} "
+          f"({unchanged} unchanged, {backfill} from crawl thumbnails) with {args.workers} workers...")
+    start = time.perf_counter()
+    resized = failed = 0
+    write_error = None
+    with ProcessPoolExecutor(args.workers) as pool:
+        for source, output, error, bad_image in pool.map(resize_one, jobs, chunksize=16):
+            if error and not bad_image:
+                # Disk full, permissions...: every following cover would fail the same way, and the
+                # original is fine, so stop instead of quarantining good covers
+                write_error = f"{source}: {error}"
+                pool.shutdown(cancel_futures=True)
+                break
+            if error:
+                moved_to = quarantine(source, error, store, hashes[source])
+                manifest.execute("INSERT OR REPLACE INTO quarantined VALUES (?, ?, ?)", (source, moved_to, error))
+                failed += 1
+            else:
+                if source in stats:  # thumbnail backfills are found by their missing files instead
+                    manifest.execute("INSERT OR REPLACE INTO resized VALUES (?, ?, ?, ?, ?)",
+                                     (source, *stats[source], output, sizes_key))
+                resized += 1
+            if (resized + failed) % 500 == 0:
+                manifest.commit()
+    manifest.commit()
+    manifest.close()
+    store.close()
+    if write_error:
+        sys.exit(f"Resizing stopped after {resized} covers on a write error ({write_error}); "
+                 f"fix it and rerun to continue.")
+
+    elapsed = time.perf_counter() - start
+    rate = resized / elapsed if elapsed else 0.0
+    print(f"Resizing complete: {resized} resized, {failed} quarantined in {quarantine_folder}, "
+          f"{elapsed:.1f} s ({rate:.1f} images/sec).")
+
 
-input_folder = 'goodreads data/goodreads_book_covers'
-output_folder = 'goodreads data/goodreads_covers_resized'
-size = (512, 512)
-
-
-print(f"Resizing images from {input_folder} to {output_folder}...")
-for filename in os.listdir(input_folder):
-    if filename.endswith('.jpg') and filename not in os.listdir(output_folder):
-        img = Image.open(os.path.join(input_folder, filename))
-        img.thumbnail(size)
-        if img.mode == 'RGBA':
-            img = img.convert('RGB')
-        img.save(os.path.join(output_folder, filename), format='JPEG')
-        print(f"Resized and saved: {filename}")
-print("Resizing complete.")
\ No newline at end of file
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,200 @@
+"""
+Lightweight metrics for the scraper: counters, gauges and latency histograms.
+
+Every metric is keyed by name plus labels (e.g. the page type), updated from
+both the event loop and the fetch worker threads, and can be exported as a
+Prometheus textfile (for node_exporter's textfile collector) or a JSON
+snapshot, periodically during the crawl and once more at exit.
+"""
+import asyncio
+import bisect
+import json
+import os
+import threading
+import time
+from typing import Callable
+
+# Upper bounds in seconds, wide enough for both cache hits and slow, retried requests
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+
+class Histogram:
+    """Cumulative-bucket histogram in the Prometheus style."""
+
+    def __init__(self, buckets: tuple = DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # last slot is +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def quantile(self, q: float) -> float:
+        """Bucket upper bound containing the q-quantile (an estimate, as with any bucketed histogram)."""
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for bound, count in zip(self.buckets + (float("inf"),), self.counts):
+            seen += count
+            if seen >= rank:
+                return bound
+        return float("inf")
+
+
+# The # HELP text of the scraper's metric families; families not listed here get only a # TYPE line
+HELP = {
+    "scraper_request_seconds": "Time spent on one HTTP request, retries included.",
+    "scraper_requests_total": "HTTP requests by page type and final status code.",
+    "scraper_bytes_downloaded_total": "Response bytes downloaded.",
+    "scraper_retries_total": "Retried HTTP attempts.",
+    "scraper_errors_total": "Requests that failed after all retries.",
+    "scraper_rate_limit_wait_seconds": "Time spent waiting for a rate-limit token.",
+    "scraper_cache_hits_total": "Pages served from the HTTP cache.",
+    "scraper_rate_limit": "Current request rate per host, in requests per second.",
+    "scraper_queue_depth": "Items waiting in each pipeline stage's queue.",
+    "scraper_books_discovered_total": "Books found on list pages.",
+    "scraper_books_refreshed_total": "Books queued again by --refresh.",
+    "scraper_refresh_failures_total": "Refreshed books whose detail page could not be fetched (kept as they were).",
+    "scraper_books_parsed_total": "Book detail pages parsed.",
+    "scraper_parse_seconds": "Time spent parsing one detail page.",
+    "scraper_covers_total": "Covers stored, downloaded or reused.",
+}
+
+
+def _key(name: str, labels: dict) -> tuple:
+    return name, tuple(sorted(labels.items()))
+
+
+def _format_labels(labels: tuple, extra: dict | None = None) -> str:
+    items = list(labels) + list((extra or {}).items())
+    if not items:
+        return ""
+    return "{" + ",".join(f'{k}="{v}"' for k, v in items) + "}"
+
+
+class Metrics:
+    """
+    Thread-safe registry of the scraper's metrics.
+    Attributes:
+        started (float): Wall-clock start time, for rates in the summary.
+    """
+
+    def __init__(self):
+        self.started = time.time()
+        self._lock = threading.Lock()
+        self.counters: dict[tuple, float] = {}
+        self.gauges: dict[tuple, float] = {}
+        self.histograms: dict[tuple, Histogram] = {}
+
+    def inc(self, name: str, value: float = 1, **labels) -> None:
+        key = _key(name, labels)
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def set_gauge(self, name: str, value: float, **labels) -> None:
+        with self._lock:
+            self.gauges[_key(name, labels)] = value
+
+    def observe(self, name: str, value: float, **labels) -> None:
+        key = _key(name, labels)
+        with self._lock:
+            if key not in self.histograms:
+                self.histograms[key] = Histogram()
+            self.histograms[key].observe(value)
+
+    # --- export ---------------------------------------------------------------
+
+    def to_prometheus(self) -> str:
+        lines = []
+        family = None
+
+        def header(name: str, metric_type: str) -> None:
+            # Once per family, ahead of its first sample (the samples are sorted by name)
+            nonlocal family
+            if name != family:
+                family = name
+                if name in HELP:
+                    lines.append(f"# HELP {name} {HELP[name]}")
+                lines.append(f"# TYPE {name} {metric_type}")
+
+        with self._lock:
+            for (name, labels), value in sorted(self.counters.items()):
+                header(name, "counter")
+                lines.append(f"{name}{_format_labels(labels)} {value}")
+            for (name, labels), value in sorted(self.gauges.items()):
+                header(name, "gauge")
+                lines.append(f"{name}{_format_labels(labels)} {value}")
+            for (name, labels), hist in sorted(self.histograms.items(), key=lambda item: item[0]):
+                header(name, "histogram")
+                cumulative = 0
+                for bound, count in zip(hist.buckets + (float("inf"),), hist.counts):
+                    cumulative += count
+                    le = "+Inf" if bound == float("inf") else bound
+                    lines.append(f"{name}_bucket{_format_labels(labels, {'le': le})} {cumulative}")
+                lines.append(f"{name}_sum{_format_labels(labels)} {hist.sum}")
+                lines.append(f"{name}_count{_format_labels(labels)} {hist.count}")
+        return "\n".join(lines) + "\n"
+
+    def snapshot(self) -> dict:
+        def label_str(name, labels):
+            return name + _format_labels(labels)
+
+        with self._lock:
+            return {
+                "uptime_seconds": time.time() - self.started,
+                "counters": {label_str(*key): value for key, value in self.counters.items()},
+                "gauges": {label_str(*key): value for key, value in self.gauges.items()},
+                "histograms": {
+                    label_str(*key): {"count": h.count, "sum": h.sum,
+                                      "p50": h.quantile(0.5), "p95": h.quantile(0.95), "p99": h.quantile(0.99)}
+                    for key, h in self.histograms.items()
+                },
+            }
+
+    def write(self, prometheus_path: str | None = None, json_path: str | None = None) -> None:
+        """
+        Write the current values, via a temp file + rename so readers never see a partial file.
+        The temp file is per thread, so a periodic export still running in a worker thread and the
+        final export never write into the same file.
+        """
+        for path, content in ((prometheus_path, self.to_prometheus),
+                              (json_path, lambda: json.dumps(self.snapshot(), indent=2))):
+            if path:
+                tmp_path = f"{path}.{threading.get_ident()}.tmp"
+                with open(tmp_path, "w", encoding="utf-8") as f:
+                    f.write(content())
+                os.replace(tmp_path, path)
+
+    def summary(self) -> str:
+        snapshot = self.snapshot()
+        elapsed = snapshot["uptime_seconds"]
+        lines = [f"--- Scraper metrics after {elapsed:.1f} s ---"]
+        for name, value in sorted(snapshot["counters"].items()):
+            lines.append(f"{name:<60} {value:>12.0f} ({value / elapsed:.2f}/s)")
+        for name, h in sorted(snapshot["histograms"].items()):
+            mean = h["sum"] / h["count"] if h["count"] else 0
+            lines.append(f"{name:<60} n={h['count']} mean={mean:.3f}s p50<={h['p50']}s p95<={h['p95']}s")
+        return "\n".join(lines)
+
+
+async def export_periodically(metrics: Metrics, interval: float, prometheus_path: str | None = None,
+                              json_path: str | None = None, sample: Callable[[], None] | None = None) -> None:
+    """
+    Background task: refresh sampled gauges (via `sample`) and export every `interval` seconds until cancelled.
+    Cancelling it during an export waits for that write to finish (the thread cannot be stopped), so once the
+    cancelled task has been awaited no older export can replace a later one.
+    """
+    while True:
+        await asyncio.sleep(interval)
+        if sample:
+            sample()
+        export = asyncio.ensure_future(asyncio.to_thread(metrics.write, prometheus_path, json_path))
+        try:
+            await asyncio.shield(export)
+        except asyncio.CancelledError:
+            await export
+            raise
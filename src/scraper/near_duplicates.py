@@ -0,0 +1,215 @@
+"""
+Near-duplicate detection over the resized covers with perceptual hashes.
+
+Editions, reprints and series covers are often near-identical, which wastes
+training compute and nudges the model toward memorizing them. Every thumbnail
+gets a 64-bit DCT perceptual hash (computed for a whole chunk of images at once
+with NumPy, chunks spread over a process pool). A BK-tree then finds, for each
+hash, all hashes within a Hamming radius without comparing every pair, and each
+cluster is grouped around the cover it keeps, so every dropped cover is within
+that radius of its keeper.
+
+Outputs (in `goodreads data/dedup`):
+    clusters.json - every cluster of near-duplicates: the cover kept and the ones dropped
+    keep.txt      - the pruned dataset, one cover per line relative to the covers root
+                    (`ab/<hash>.jpg`), so it applies to the thumbnail tree and to every
+                    pyramid tree alike; both training scripts read it
+
+Usage:
+    python -m scraper.near_duplicates [--radius 6] [--workers 8]
+"""
+import argparse
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from .thumbnails import RESIZED_DIR
+
+DEDUP_DIR = 'goodreads data/dedup'
+CLUSTERS_FILE = 'clusters.json'
+KEEP_FILE = 'keep.txt'
+HASH_RADIUS = 6  # of 64 bits
+CHUNK_SIZE = 256
+
+_DCT_SIZE = 32
+_HASH_SIZE = 8
+
+
+def _dct_matrix(n: int) -> np.ndarray:
+    k = np.arange(n)[:, None]
+    matrix = np.cos(np.pi * (2 * np.arange(n)[None, :] + 1) * k / (2 * n)) * np.sqrt(2 / n)
+    matrix[0] /= np.sqrt(2)
+    return matrix.astype(np.float32)
+
+
+_DCT = _dct_matrix(_DCT_SIZE)
+
+
+def phash_batch(pixels: np.ndarray) -> np.ndarray:
+    """
+    Perceptual hashes of a batch of grayscale images.
+    Args:
+        pixels (np.ndarray): (n, 32, 32) float32 array.
+    Returns:
+        np.ndarray: (n,) uint64 hashes; bit set where a low-frequency DCT coefficient is above the image's median.
+    """
+    coefficients = np.einsum('ij,njk,lk->nil', _DCT, pixels, _DCT)[:, :_HASH_SIZE, :_HASH_SIZE]
+    coefficients = coefficients.reshape(len(pixels), -1)
+    bits = coefficients > np.median(coefficients[:, 1:], axis=1, keepdims=True)  # median without the DC term
+    return np.packbits(bits, axis=1).view('>u8').ravel().astype(np.uint64)
+
+
+def hash_files(paths: list[str]) -> tuple[list[str], np.ndarray]:
+    """Process-pool worker: decode a chunk of covers small and hash them together. Unreadable files are left out."""
+    from PIL import Image
+
+    readable, pixels = [], []
+    for path in paths:
+        try:
+            with Image.open(path) as img:
+                img.draft('L', (_DCT_SIZE * 2, _DCT_SIZE * 2))
+                pixels.append(np.asarray(img.convert('L').resize((_DCT_SIZE, _DCT_SIZE), Image.Resampling.BILINEAR),
+                                         dtype=np.float32))
+            readable.append(path)
+        except (OSError, SyntaxError, ValueError, Image.DecompressionBombError) as e:
+            # Any bad file (unreadable, truncated, corrupt, oversized) is skipped, never fatal to the whole run
+            print(f"Skipping unreadable cover {path}: {e}")
+    if not pixels:
+        return readable, np.empty(0, dtype=np.uint64)
+    return readable, phash_batch(np.stack(pixels))
+
+
+class BKTree:
+    """
+    Burkhard-Keller tree over 64-bit hashes with Hamming distance: a radius query only
+    descends into children whose edge distance is within `radius` of the query's distance
+    to the node (triangle inequality), so it visits a small part of the tree.
+    """
+
+    def __init__(self):
+        self.root = None  # [hash, item ids, {distance: child node}]
+
+    def add(self, value: int, item: int) -> None:
+        if self.root is None:
+            self.root = [value, [item], {}]
+            return
+        node = self.root
+        while True:
+            distance = (node[0] ^ value).bit_count()
+            if distance == 0:
+                node[1].append(item)
+                return
+            child = node[2].get(distance)
+            if child is None:
+                node[2][distance] = [value, [item], {}]
+                return
+            node = child
+
+    def query(self, value: int, radius: int) -> list[int]:
+        """Ids of every item within `radius` bits of `value`."""
+        found, stack = [], [self.root] if self.root else []
+        while stack:
+            node = stack.pop()
+            distance = (node[0] ^ value).bit_count()
+            if distance <= radius:
+                found.extend(node[1])
+            for edge, child in node[2].items():
+                if distance - radius <= edge <= distance + radius:
+                    stack.append(child)
+        return found
+
+
+def find_clusters(hashes: np.ndarray, radius: int, order: list[int] | None = None) -> list[tuple[int, list[int]]]:
+    """
+    Greedy clustering around keepers: walking `order` (the preferred keepers first), every cover not yet
+    assigned becomes a keeper and takes all unassigned covers within `radius` bits of it as duplicates.
+    Every dropped cover is therefore within `radius` of the cover kept in its place; unlike merging all
+    pairwise matches (single linkage), a chain of similar covers, e.g. a series, cannot pull in covers
+    that look nothing like the keeper.
+    Returns:
+        list[tuple[int, list[int]]]: (keeper, duplicates) for every keeper that has duplicates.
+    """
+    tree = BKTree()
+    values = [int(value) for value in hashes]
+    for item, value in enumerate(values):
+        tree.add(value, item)
+
+    assigned = [False] * len(values)
+    clusters = []
+    for keeper in (order if order is not None else range(len(values))):
+        if assigned[keeper]:
+            continue
+        assigned[keeper] = True
+        duplicates = sorted(other for other in tree.query(values[keeper], radius) if not assigned[other])
+        for other in duplicates:
+            assigned[other] = True
+        if duplicates:
+            clusters.append((keeper, duplicates))
+    return clusters
+
+
+def list_covers(covers_dir: str) -> list[str]:
+    """The .jpg covers in the 256 shard directories of `covers_dir`."""
+    paths = []
+    for shard in sorted(os.scandir(covers_dir), key=lambda entry: entry.name):
+        if shard.is_dir():
+            paths.extend(os.path.join(shard.path, entry.name) for entry in sorted(os.scandir(shard.path),
+                                                                               key=lambda entry: entry.name)
+                         if entry.name.endswith('.jpg'))
+    return paths
+
+
+def relative_cover_path(path: str) -> str:
+    """`ab/<hash>.jpg`: the same key in the thumbnail tree and in every pyramid tree."""
+    return os.path.join(os.path.basename(os.path.dirname(path)), os.path.basename(path))
+
+
+def main(argv: list[str] | None = None) -> None:
+    parser = argparse.ArgumentParser(description="Find near-duplicate covers and write a pruned cover list.")
+    parser.add_argument("--covers-dir", default=RESIZED_DIR)
+    parser.add_argument("--output-dir", default=DEDUP_DIR)
+    parser.add_argument("--radius", type=int, default=HASH_RADIUS, help="Max differing hash bits (of 64) for duplicates.")
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    args = parser.parse_args(argv)
+
+    start = time.perf_counter()
+    all_paths = list_covers(args.covers_dir)
+    chunks = [all_paths[i:i + CHUNK_SIZE] for i in range(0, len(all_paths), CHUNK_SIZE)]
+    paths, hash_arrays = [], []
+    with ProcessPoolExecutor(args.workers) as pool:
+        for chunk_paths, chunk_hashes in pool.map(hash_files, chunks):
+            paths.extend(chunk_paths)
+            hash_arrays.append(chunk_hashes)
+    hashes = np.concatenate(hash_arrays) if hash_arrays else np.empty(0, dtype=np.uint64)
+    hashed = time.perf_counter()
+    print(f"Hashed {len(paths)} covers in {hashed - start:.1f} s ({len(paths) / max(hashed - start, 1e-9):.0f} images/sec)")
+
+    # Prefer keeping the covers with the largest thumbnail files (usually the sharpest / most detailed edition)
+    order = sorted(range(len(paths)), key=lambda item: (-os.path.getsize(paths[item]), paths[item]))
+    clusters = find_clusters(hashes, args.radius, order)
+    dropped = set()
+    report = []
+    for keep, duplicates in clusters:
+        dropped.update(duplicates)
+        report.append({
+            "keep": relative_cover_path(paths[keep]),
+            "duplicates": [relative_cover_path(paths[item]) for item in duplicates],
+            "distances": [(int(hashes[keep]) ^ int(hashes[item])).bit_count() for item in duplicates],
+        })
+
+    os.makedirs(args.output_dir, exist_ok=True)
+    with open(os.path.join(args.output_dir, CLUSTERS_FILE), "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    with open(os.path.join(args.output_dir, KEEP_FILE), "w", encoding="utf-8") as f:
+        for item, path in enumerate(paths):
+            if item not in dropped:
+                f.write(relative_cover_path(path) + "\n")
+    print(f"{len(clusters)} duplicate clusters, {len(dropped)} covers dropped, {len(paths) - len(dropped)} kept "
+          f"({time.perf_counter() - hashed:.1f} s search); wrote {args.output_dir}/{CLUSTERS_FILE} and {KEEP_FILE}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,95 @@
+"""
+Minimal asyncio producer/consumer pipeline.
+
+A pipeline is a chain of stages connected by bounded queues. Every stage runs
+its own pool of worker tasks, so all stages work at the same time; a full queue
+blocks the stage feeding it (backpressure), and when a stage has drained its
+input it passes an end-of-stream marker on to each worker of the next stage.
+"""
+import asyncio
+from typing import Awaitable, Callable, Iterable
+
+# End-of-stream marker passed between stages
+_DONE = object()
+
+Emit = Callable[[object], Awaitable[None]]
+Handler = Callable[[object, Emit], Awaitable[None]]
+
+
+class Stage:
+    """
+    One step of the pipeline.
+    Attributes:
+        name (str): Used in log messages.
+        handler (Handler): `async handler(item, emit)`; call `await emit(x)` for every item to pass downstream.
+        workers (int): Number of concurrent worker tasks.
+        queue_size (int): Capacity of this stage's input queue.
+    """
+
+    def __init__(self, name: str, handler: Handler, workers: int = 1, queue_size: int = 100):
+        self.name = name
+        self.handler = handler
+        self.workers = workers
+        self.queue_size = queue_size
+        self.processed = 0
+
+
+class Pipeline:
+    """Runs a list of stages, each feeding the next one."""
+
+    def __init__(self, stages: list[Stage]):
+        self.stages = stages
+        self.queues: list[asyncio.Queue] = []
+
+    def queue_depths(self) -> dict[str, int]:
+        return {stage.name: queue.qsize() for stage, queue in zip(self.stages, self.queues)}
+
+    async def _worker(self, index: int) -> None:
+        stage = self.stages[index]
+        inbox = self.queues[index]
+        outbox = self.queues[index + 1] if index + 1 < len(self.queues) else None
+
+        async def emit(item) -> None:
+            if outbox is None:
+                raise RuntimeError(f"Stage '{stage.name}' is the last stage and cannot emit items")
+            await outbox.put(item)
+
+        while True:
+            item = await inbox.get()
+            if item is _DONE:
+                return
+            try:
+                await stage.handler(item, emit)
+            except Exception as e:
+                # One bad item shouldn't take the whole crawl down
+                print(f"[{stage.name}] Error processing {item!r}: {e}")
+            stage.processed += 1
+
+    async def _run_stage(self, index: int) -> None:
+        stage = self.stages[index]
+        await asyncio.gather(*(self._worker(index) for _ in range(stage.workers)))
+        print(f"[{stage.name}] finished ({stage.processed} items)")
+        # Tell every worker of the next stage that no more input is coming
+        if index + 1 < len(self.stages):
+            for _ in range(self.stages[index + 1].workers):
+                await self.queues[index + 1].put(_DONE)
+
+    async def run(self, items: Iterable) -> None:
+        """Feed `items` into the first stage and run until every stage has drained."""
+        self.queues = [asyncio.Queue(maxsize=stage.queue_size) for stage in self.stages]
+        tasks = [asyncio.create_task(self._run_stage(i)) for i in range(len(self.stages))]
+
+        async def feed() -> None:
+            for item in items:
+                await self.queues[0].put(item)
+            for _ in range(self.stages[0].workers):
+                await self.queues[0].put(_DONE)
+
+        try:
+            await asyncio.gather(feed(), *tasks)
+        except BaseException:
+            # Clean shutdown on Ctrl+C / cancellation: stop every stage instead of leaving tasks dangling
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            raise
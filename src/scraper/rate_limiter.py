@@ -0,0 +1,199 @@
+"""
+Per-host token-bucket rate limiting for the Goodreads scraper.
+
+Each host (www.goodreads.com for HTML, the image CDN for covers) gets its own
+bucket, so overlapping requests to different hosts don't eat into each other's
+politeness budget.
+
+AdaptiveRateLimiter adjusts each host's rate from the responses it gets back
+(AIMD, as in TCP congestion control): the rate creeps up by one step per time
+window while responses are fast and successful, and is cut sharply on 429/5xx,
+connection errors or rising latency, between a configured floor and ceiling.
+
+The adaptive feedback arrives from the fetch worker threads while the event
+loop spends tokens, so bucket state is guarded by a threading lock (held only
+for the few arithmetic operations, never across an await).
+"""
+import asyncio
+import threading
+import time
+from typing import Callable
+from urllib.parse import urlsplit
+
+
+class TokenBucket:
+    """
+    Classic token bucket: tokens refill continuously at `rate` per second up to
+    `capacity`, and every request spends one token.
+    Attributes:
+        rate (float): Tokens added per second (i.e. the sustained requests/sec).
+        capacity (float): Maximum burst size.
+    """
+
+    def __init__(self, rate: float, capacity: float = 1.0):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+        self._state_lock = threading.Lock()  # rate updates come from the fetch worker threads
+
+    def set_rate(self, rate: float) -> None:
+        self.update_rate(lambda _: rate)
+
+    def update_rate(self, update: Callable[[float], float]) -> tuple[float, float]:
+        """Replace the rate with `update(rate)` in one step; returns (old rate, new rate)."""
+        with self._state_lock:
+            # Credit the tokens earned at the old rate before switching
+            self._refill()
+            old_rate = self.rate
+            self.rate = update(old_rate)
+            return old_rate, self.rate
+
+    def _take(self) -> float:
+        """Spend a token if one is available (returns 0), else return the seconds until one will be."""
+        with self._state_lock:
+            self._refill()
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return 0.0
+            return (1 - self._tokens) / self.rate
+
+    def _refill(self) -> None:
+        # Caller holds _state_lock
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    async def acquire(self) -> float:
+        """Wait until a token is available, spend it and return the seconds waited."""
+        waited = 0.0
+        # The lock makes waiters queue up in FIFO order instead of racing for the next token
+        async with self._lock:
+            while True:
+                delay = self._take()
+                if not delay:
+                    return waited
+                await asyncio.sleep(delay)
+                waited += delay
+
+
+class HostRateLimiter:
+    """
+    Hands out one TokenBucket per host, creating them lazily.
+    Attributes:
+        default_rate (float): Requests/sec for hosts without an explicit entry in `host_rates`.
+        host_rates (dict): Optional mapping of hostname -> requests/sec.
+        burst (float): Bucket capacity shared by all hosts.
+    """
+
+    def __init__(self, default_rate: float, host_rates: dict | None = None, burst: float = 1.0):
+        self.default_rate = default_rate
+        self.host_rates = host_rates or {}
+        self.burst = burst
+        self._buckets: dict[str, TokenBucket] = {}
+        self._buckets_lock = threading.Lock()
+
+    def bucket_for(self, url: str) -> TokenBucket:
+        host = urlsplit(url).netloc
+        with self._buckets_lock:
+            if host not in self._buckets:
+                rate = self.host_rates.get(host, self.default_rate)
+                self._buckets[host] = TokenBucket(rate, self.burst)
+            return self._buckets[host]
+
+    async def acquire(self, url: str) -> float:
+        return await self.bucket_for(url).acquire()
+
+
+class AdaptiveRateLimiter(HostRateLimiter):
+    """
+    HostRateLimiter whose per-host rates follow the server's responses (additive increase, multiplicative decrease).
+    While responses are successful (2xx/3xx) and fast, the rate grows by a fixed `increase * min_rate`
+    requests/sec at most once per `increase_interval` seconds (like TCP's one step per round trip), so the
+    climb takes the same time however many requests are in flight; a throttled (429), 5xx, failed or slow
+    response multiplies the rate by `decrease`, at most once per `cooldown` seconds so a burst of errors from
+    requests already in flight counts as one signal. Other 4xx answers (e.g. a missing page) say nothing
+    about load and leave the rate alone.
+    Attributes:
+        min_rate (float): Floor of the per-host rate.
+        max_rate (float): Ceiling of the per-host rate.
+        increase (float): Additive increase per window of healthy responses, in multiples of `min_rate`.
+        increase_interval (float): Minimum seconds between two increases for the same host.
+        decrease (float): Factor applied to the rate on a back-off signal.
+        slow_factor (float): A response slower than this many times the host's baseline latency counts as a back-off signal.
+        cooldown (float): Minimum seconds between two decreases for the same host.
+    """
+
+    def __init__(self, default_rate: float, min_rate: float, max_rate: float, increase: float = 1.0,
+                 increase_interval: float = 10.0, decrease: float = 0.5, slow_factor: float = 3.0,
+                 cooldown: float = 10.0, host_rates: dict | None = None, burst: float = 1.0):
+        super().__init__(min(max(default_rate, min_rate), max_rate), host_rates, burst)
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.increase = increase
+        self.increase_interval = increase_interval
+        self.decrease = decrease
+        self.slow_factor = slow_factor
+        self.cooldown = cooldown
+        # Called from the fetch worker threads, so the per-host bookkeeping has its own lock
+        self._lock = threading.Lock()
+        self._hosts: dict[str, dict] = {}
+
+    def record(self, url: str, status: int | None, elapsed: float, throttled: int = 0) -> None:
+        """
+        Feed back one response.
+        Args:
+            status (int | None): Final HTTP status, or None if the request failed without a response.
+            elapsed (float): Seconds the request took.
+            throttled (int): 429/503 answers seen on the way (e.g. ones urllib3 retried internally).
+        """
+        bucket = self.bucket_for(url)
+        host = urlsplit(url).netloc
+        now = time.monotonic()
+        with self._lock:
+            stats = self._hosts.setdefault(host, {"baseline": None, "last_cut": 0.0, "last_raise": now,
+                                                  "started": now, "rate_seconds": 0.0, "last_change": now,
+                                                  "cuts": 0})
+            if status in (429, 503):
+                throttled += 1
+            healthy = status is not None and 200 <= status < 400
+            baseline = stats["baseline"]
+            slow = baseline is not None and elapsed > self.slow_factor * baseline
+            if healthy and not throttled:
+                # Baseline latency: a slowly-adapting low-water mark of healthy responses
+                stats["baseline"] = elapsed if baseline is None else min(elapsed, 0.95 * baseline + 0.05 * elapsed)
+
+            if not throttled and not slow and status is not None and 400 <= status < 500:
+                return  # client-side error (404, 403...): hold the rate
+            if throttled or not healthy or slow:
+                if now - stats["last_cut"] < self.cooldown:
+                    return
+                stats["last_cut"] = stats["last_raise"] = now
+                stats["cuts"] += 1
+                old_rate, new_rate = bucket.update_rate(lambda rate: max(self.min_rate, rate * self.decrease))
+                reason = ("throttled" if throttled else "request failed" if status is None
+                          else f"slow ({elapsed:.1f}s)" if slow else f"HTTP {status}")
+                print(f"Rate for {host}: {old_rate:.3g} -> {new_rate:.3g} req/s ({reason})")
+            else:
+                if now - stats["last_raise"] < self.increase_interval:
+                    return
+                stats["last_raise"] = now
+                old_rate, new_rate = bucket.update_rate(
+                    lambda rate: min(self.max_rate, rate + self.increase * self.min_rate))
+            # Time-weighted average of the rate, for the summary at the end
+            stats["rate_seconds"] += old_rate * (now - stats["last_change"])
+            stats["last_change"] = now
+
+    def summary(self) -> dict[str, dict]:
+        """Per host: the current rate, the time-averaged rate and the number of back-offs so far."""
+        now = time.monotonic()
+        with self._lock:
+            result = {}
+            for host, stats in self._hosts.items():
+                rate = self._buckets[host].rate
+                elapsed = now - stats["started"]
+                rate_seconds = stats["rate_seconds"] + rate * (now - stats["last_change"])
+                result[host] = {"rate": rate, "mean_rate": rate_seconds / elapsed if elapsed else rate,
+                                "backoffs": stats["cuts"]}
+            return result
@@ -0,0 +1,152 @@
+"""
+Streaming storage for scraped book records.
+
+Records are appended to a JSON Lines file as soon as they are parsed, so memory
+stays flat during a crawl and a crash loses at most the record being written.
+`iter_records` reads them back lazily, one dict at a time, for the later
+dataset-building and training steps. A refresh run appends updated records for
+books already in the file; `merge_records` then folds them back in place.
+"""
+import json
+import os
+import textwrap
+from typing import Iterable, Iterator
+
+
+class JsonlWriter:
+    """
+    Append-only JSON Lines writer.
+    Every record is flushed to the OS immediately; with `fsync_every` > 0 the
+    file is also fsync'd after that many records, trading a little throughput
+    for durability across power loss.
+    Attributes:
+        path (str): The .jsonl file records are appended to.
+        fsync_every (int): Records between fsyncs (0 disables fsync).
+    """
+
+    def __init__(self, path: str, fsync_every: int = 0):
+        self.path = path
+        self.fsync_every = fsync_every
+        self._unsynced = 0
+        self._file = open(path, "a", encoding="utf-8")
+
+    def write(self, record: dict) -> None:
+        self._file.write(json.dumps(record, ensure_ascii=False) + "\n")
+        self._file.flush()
+        if self.fsync_every:
+            self._unsynced += 1
+            if self._unsynced >= self.fsync_every:
+                self.sync()
+
+    def sync(self) -> None:
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._unsynced = 0
+
+    def close(self) -> None:
+        if not self._file.closed:
+            if self.fsync_every:
+                self.sync()
+            self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def iter_records(path: str, dedupe: bool = True) -> Iterator[dict]:
+    """
+    Lazily yield book records from a .jsonl file (or a legacy .json array, which has to be loaded whole).
+    Args:
+        path (str): The records file.
+        dedupe (bool): Yield each URL once, with its latest record, at the position of its first one.
+            Refresh runs append newer records for books already in the file, and a crash between writing
+            a record and updating the crawl state can leave a duplicate line behind; until merge_records
+            compacts the file, this is what keeps readers from seeing stale records.
+    Yields:
+        dict: One book record at a time.
+    """
+    if path.endswith(".json"):
+        with open(path, "r", encoding="utf-8") as f:
+            records = json.load(f)
+        if dedupe:
+            latest = {}
+            for number, record in enumerate(records):
+                url = record.get("url")
+                latest[url if url is not None else f"#{number}"] = record
+            records = latest.values()
+        yield from records
+        return
+
+    if not dedupe:
+        yield from _read_lines(path)
+        return
+    # Two passes over the file, holding only one offset per URL in memory
+    with open(path, "rb") as f:
+        for offset in _latest_offsets(path).values():
+            f.seek(offset)
+            yield json.loads(f.readline())
+
+
+def _read_lines(path: str) -> Iterator[dict]:
+    with open(path, "r", encoding="utf-8") as f:
+        for line_number, line in enumerate(f, start=1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                yield json.loads(line)
+            except json.JSONDecodeError:
+                # A crash mid-write can leave a truncated last line; skip it instead of failing the whole read
+                print(f"Skipping malformed record on line {line_number} of {path}")
+
+
+def _latest_offsets(path: str) -> dict[str, int]:
+    """URL -> byte offset of its latest line, in first-seen order. Malformed lines are left out."""
+    latest = {}  # re-assigning a key keeps its first-seen order
+    with open(path, "rb") as f:
+        offset = 0
+        for line in f:
+            if line.strip():
+                try:
+                    url = json.loads(line).get("url")
+                except json.JSONDecodeError:
+                    print(f"Skipping malformed record at byte {offset} of {path}")
+                else:
+                    latest[url if url is not None else f"#{offset}"] = offset
+            offset += len(line)
+    return latest
+
+
+def merge_records(path: str) -> int:
+    """
+    Rewrite a .jsonl file so each URL appears once: at the position of its first record, with its last record.
+    Only line offsets are held in memory, and the new file replaces the old one atomically.
+    Returns:
+        int: The number of records kept.
+    """
+    latest = _latest_offsets(path)
+    tmp_path = f"{path}.tmp"
+    with open(path, "rb") as src, open(tmp_path, "wb") as dst:
+        for offset in latest.values():
+            src.seek(offset)
+            dst.write(src.readline().rstrip(b"\r\n") + b"\n")
+        dst.flush()
+        os.fsync(dst.fileno())
+    os.replace(tmp_path, path)
+    return len(latest)
+
+
+def export_json(records: Iterable[dict], path: str) -> int:
+    """Write records as the indented JSON array format of goodreads_books_data.json, one record at a time."""
+    count = 0
+    with open(path, "w", encoding="utf-8") as f:
+        f.write("[")
+        for record in records:
+            f.write(",\n" if count else "\n")
+            f.write(textwrap.indent(json.dumps(record, ensure_ascii=False, indent=4), "    "))
+            count += 1
+        f.write("\n]" if count else "]")
+    return count
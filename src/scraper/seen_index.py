@@ -0,0 +1,99 @@
+"""
+Global "already seen" index of book URLs across every crawled list.
+
+Popular books appear on many Goodreads lists, often under different URL
+variants (`/book/show/123-title`, `/book/show/123.Title?from_list=...`), so
+books are keyed by their numeric Goodreads ID. The default index is an exact
+set of those IDs; for very large crawls a Bloom filter keeps memory fixed at
+the cost of a small, configurable false-positive rate (a false positive means
+a book is skipped).
+"""
+import hashlib
+import math
+import re
+from typing import Iterable
+from urllib.parse import urlsplit, urlunsplit
+
+BOOK_ID_RE = re.compile(r'/book/show/(\d+)')
+
+
+def canonical_book_key(url: str) -> str:
+    """The Goodreads book ID in `url`, or the URL without query/fragment if it has none."""
+    match = BOOK_ID_RE.search(url)
+    if match:
+        return match.group(1)
+    parts = urlsplit(url)
+    return urlunsplit((parts.scheme, parts.netloc, parts.path, "", ""))
+
+
+def strip_tracking(url: str) -> str:
+    """Drop the query and fragment (e.g. ?from_list=...), which don't change the book page."""
+    parts = urlsplit(url)
+    return urlunsplit((parts.scheme, parts.netloc, parts.path, "", ""))
+
+
+class BloomFilter:
+    """
+    Fixed-size Bloom filter over strings.
+    Attributes:
+        capacity (int): Number of items it is sized for.
+        error_rate (float): Target false-positive rate at that capacity.
+    """
+
+    def __init__(self, capacity: int, error_rate: float = 1e-4):
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.num_bits = max(8, int(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.num_hashes = max(1, round(self.num_bits / capacity * math.log(2)))
+        self.bits = bytearray((self.num_bits + 7) // 8)
+
+    def _positions(self, key: str):
+        # Double hashing: k positions from two 64-bit halves of a single digest
+        digest = hashlib.blake2b(key.encode("utf-8"), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], "little")
+        h2 = int.from_bytes(digest[8:], "little") | 1
+        for i in range(self.num_hashes):
+            yield (h1 + i * h2) % self.num_bits
+
+    def add(self, key: str) -> bool:
+        """Add `key`; returns True if it was (probably) not present before."""
+        new = False
+        for position in self._positions(key):
+            byte, bit = divmod(position, 8)
+            if not self.bits[byte] & (1 << bit):
+                self.bits[byte] |= 1 << bit
+                new = True
+        return new
+
+    def __contains__(self, key: str) -> bool:
+        return all(self.bits[p // 8] & (1 << (p % 8)) for p in self._positions(key))
+
+
+class SeenIndex:
+    """
+    Set of canonical book keys seen so far in the crawl.
+    Attributes:
+        bloom_capacity (int | None): Use a Bloom filter sized for this many books instead of an exact set.
+    """
+
+    def __init__(self, bloom_capacity: int | None = None, error_rate: float = 1e-4):
+        self._keys = BloomFilter(bloom_capacity, error_rate) if bloom_capacity else set()
+        self.count = 0
+
+    def add(self, url: str) -> bool:
+        """Record the book behind `url`; returns True if it had not been seen yet."""
+        key = canonical_book_key(url)
+        if isinstance(self._keys, BloomFilter):
+            new = self._keys.add(key)
+        else:
+            new = key not in self._keys
+            self._keys.add(key)
+        self.count += new
+        return new
+
+    def __contains__(self, url: str) -> bool:
+        return canonical_book_key(url) in self._keys
+
+    def update(self, urls: Iterable[str]) -> None:
+        for url in urls:
+            self.add(url)
@@ -0,0 +1,88 @@
+"""
+Cover thumbnails for training, shared by the offline resizer and the crawler.
+
+Thumbnails mirror the cover store's shard layout (`ab/<hash>.jpg`, keyed by
+the hash of the original bytes), so a cover resized during the crawl and one
+resized later by image_resizer.py land at the same path and are never redone.
+Pillow is imported on first use, so the crawler's CLI can import the paths here
+without loading it.
+
+Besides the aspect-preserving 512px thumbnail, every cover gets a pyramid of
+square training resolutions (the `Resize((size, size))` the training scripts
+apply), each in its own parallel tree (`goodreads_covers_resized_256/ab/...`),
+all produced from a single decode.
+"""
+import io
+import os
+import threading
+
+RESIZED_DIR = 'goodreads data/goodreads_covers_resized'
+THUMBNAIL_SIZE = (512, 512)
+# Square training resolutions written alongside the thumbnail
+PYRAMID_SIZES = (256, 128, 64)
+
+
+class ThumbnailWriteError(Exception):
+    """
+    Saving a resized cover failed (disk full, permissions, a Pillow encoder error): the source decoded
+    fine, so it must not be treated as a bad image. The original exception is the __cause__.
+    """
+
+
+def thumbnail_path(output_root: str, content_hash: str) -> str:
+    return os.path.join(output_root, content_hash[:2], content_hash + '.jpg')
+
+
+def pyramid_dir(size: int, output_root: str = RESIZED_DIR) -> str:
+    """The tree holding the `size` x `size` versions of the covers in `output_root`."""
+    return f"{output_root}_{size}"
+
+
+def pyramid_paths(content_hash: str, sizes: tuple[int, ...] = PYRAMID_SIZES,
+                  output_root: str = RESIZED_DIR) -> dict[int, str]:
+    return {size: thumbnail_path(pyramid_dir(size, output_root), content_hash) for size in sizes}
+
+
+def _save_jpeg(img, output_path: str) -> None:
+    # Written through a temp file + rename so an interrupted run never leaves a truncated image
+    tmp_path = f"{output_path}.{threading.get_ident()}.tmp"
+    try:
+        os.makedirs(os.path.dirname(output_path), exist_ok=True)
+        img.save(tmp_path, format='JPEG')
+        os.replace(tmp_path, output_path)
+    except Exception as e:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise ThumbnailWriteError(f"{output_path}: {type(e).__name__}: {e}") from e
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def save_pyramid(source: str | bytes, output_path: str | None, pyramid: dict[int, str],
+                 size: tuple[int, int] = THUMBNAIL_SIZE) -> None:
+    """
+    Decode an image (a path, or the downloaded bytes) once and write the thumbnail that fits `size`
+    to `output_path` (if given) plus a square RGB JPEG for every `pyramid` entry (size -> path).
+    JPEGs are decoded at reduced DCT scale (1/2, 1/4 or 1/8), the smallest one still covering `size`,
+    and each level is resized from the thumbnail rather than from the full-size original.
+    Raises PIL.UnidentifiedImageError / OSError (or DecompressionBombError, SyntaxError) for a source that is
+    not a readable image, and ThumbnailWriteError when decoding worked but writing an output failed.
+    """
+    from PIL import Image
+
+    with Image.open(io.BytesIO(source) if isinstance(source, bytes) else source) as img:
+        img.draft('RGB', size)  # no-op for formats other than JPEG
+        img.thumbnail(size)
+        if img.mode != 'RGB':
+            img = img.convert('RGB')
+        if output_path:
+            _save_jpeg(img, output_path)
+        for level, level_path in sorted(pyramid.items(), reverse=True):
+            _save_jpeg(img.resize((level, level), Image.Resampling.BICUBIC), level_path)
+
+
+def save_thumbnail(source: str | bytes, output_path: str, size: tuple[int, int] = THUMBNAIL_SIZE) -> None:
+    """Decode an image (a path, or the downloaded bytes), shrink it to fit `size` and save it as RGB JPEG."""
+    save_pyramid(source, output_path, {}, size)
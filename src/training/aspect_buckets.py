@@ -0,0 +1,202 @@
+"""
+Aspect-ratio bucketing for training on the covers at (close to) their own shape.
+
+Covers are roughly 2:3 portrait. Squashing them to a square distorts them and
+random square crops cut off the title and author. Instead every image is
+assigned to one of a few resolution buckets (width x height, multiples of
+`step`, all with about `resolution`^2 pixels) closest to its aspect ratio,
+resized to cover that bucket and center-cropped by at most a few pixels.
+A batch sampler only draws batches from within one bucket, so every batch
+has a single shape and needs no padding.
+
+The image sizes are read once (file headers only) into an `aspects.jsonl`
+next to the images:
+    python src/training/aspect_buckets.py "data/goodreads data/goodreads_covers_resized"
+"""
+import argparse
+import json
+import math
+import os
+import random
+
+from PIL import Image
+from torch.utils.data import Sampler
+
+ASPECTS_FILE = "aspects.jsonl"
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".webp")
+
+
+def make_buckets(resolution: int, step: int = 64, max_ratio: float = 2.0) -> list[tuple[int, int]]:
+    """
+    (width, height) buckets with at most `resolution`^2 pixels each, sides multiples of `step`.
+    Args:
+        resolution (int): Side of the square bucket; the pixel budget of every bucket.
+        step (int): Side granularity (64 for Stable Diffusion latents, 32 for the unconditional UNet).
+        max_ratio (float): Longest / shortest side allowed.
+    Returns:
+        list[tuple[int, int]]: Buckets sorted from tallest to widest.
+    """
+    area = resolution * resolution
+    buckets = set()
+    for width in range(step, resolution * 4 + 1, step):
+        height = area // width // step * step
+        if height >= step and max(width, height) / min(width, height) <= max_ratio:
+            buckets.add((width, height))
+    return sorted(buckets, key=lambda bucket: bucket[0] / bucket[1])
+
+
+def nearest_bucket(width: int, height: int, buckets: list[tuple[int, int]]) -> int:
+    """Index of the bucket whose aspect ratio is closest (in log space) to width / height."""
+    aspect = math.log(width / height)
+    return min(range(len(buckets)), key=lambda i: abs(math.log(buckets[i][0] / buckets[i][1]) - aspect))
+
+
+def resize_to_bucket(image: Image.Image, bucket: tuple[int, int],
+                     resample: Image.Resampling = Image.Resampling.BICUBIC) -> Image.Image:
+    """Scale `image` to just cover `bucket` (keeping its aspect ratio) and center-crop the overhang."""
+    width, height = bucket
+    scale = max(width / image.width, height / image.height)
+    resized = image.resize((max(width, round(image.width * scale)), max(height, round(image.height * scale))),
+                           resample)
+    left = (resized.width - width) // 2
+    top = (resized.height - height) // 2
+    return resized.crop((left, top, left + width, top + height))
+
+
+def write_aspects(images_dir: str, output_path: str | None = None) -> int:
+    """
+    Record the size of every image under `images_dir` (reading only the file headers).
+    Returns:
+        int: Number of images recorded.
+    """
+    output_path = output_path or os.path.join(images_dir, ASPECTS_FILE)
+    count = 0
+    with open(f"{output_path}.tmp", "w", encoding="utf-8") as f:
+        for root, _, files in os.walk(images_dir):
+            for name in sorted(files):
+                if not name.lower().endswith(IMAGE_EXTENSIONS):
+                    continue
+                path = os.path.join(root, name)
+                try:
+                    with Image.open(path) as img:
+                        width, height = img.size
+                except OSError as e:
+                    print(f"Skipping unreadable image {path}: {e}")
+                    continue
+                row = {"file_name": os.path.relpath(path, images_dir), "width": width, "height": height}
+                f.write(json.dumps(row) + "\n")
+                count += 1
+    os.replace(f"{output_path}.tmp", output_path)
+    return count
+
+
+def read_aspects(path: str) -> dict[str, tuple[int, int]]:
+    """file_name (relative to the images folder) -> (width, height)."""
+    with open(path, "r", encoding="utf-8") as f:
+        return {row["file_name"]: (row["width"], row["height"]) for row in map(json.loads, f) if row}
+
+
+def assign_buckets(image_paths: list[str], images_dir: str, aspects: dict[str, tuple[int, int]],
+                   buckets: list[tuple[int, int]]) -> list[int]:
+    """Bucket index of every image; images missing from `aspects` (added since it was written) are measured here."""
+    images_dir = os.path.abspath(images_dir)
+    bucket_ids = []
+    for path in image_paths:
+        size = aspects.get(os.path.relpath(os.path.abspath(path), images_dir))
+        if size is None:
+            with Image.open(path) as img:
+                size = img.size
+        bucket_ids.append(nearest_bucket(*size, buckets))
+    return bucket_ids
+
+
+class AspectBucketBatchSampler(Sampler):
+    """
+    Batches of dataset indices that all share one bucket.
+
+    Each epoch the indices are shuffled within their bucket, cut into batches, and the batches of
+    all buckets are shuffled together. Every process of a distributed run builds the same sequence
+    from the seed (accelerate then hands each process its share of the batches), and the order
+    changes every epoch.
+    Attributes:
+        bucket_ids (list[int]): Bucket index of every dataset index.
+        batch_size (int): Samples per batch.
+        drop_last (bool): Drop each bucket's incomplete last batch (the shuffle picks different leftovers
+            every epoch); keep it on for distributed runs, where accelerate would fill a short batch with
+            samples from another bucket.
+        seed (int): Base seed, combined with the epoch.
+    """
+
+    def __init__(self, bucket_ids: list[int], batch_size: int, drop_last: bool = True, seed: int = 0):
+        self.bucket_ids = bucket_ids
+        self.batch_size = batch_size
+        self.drop_last = drop_last
+        self.seed = seed
+        self.epoch = 0
+        self.buckets: dict[int, list[int]] = {}
+        for index, bucket in enumerate(bucket_ids):
+            self.buckets.setdefault(bucket, []).append(index)
+
+    def set_epoch(self, epoch: int) -> None:
+        self.epoch = epoch
+
+    def __iter__(self):
+        rng = random.Random(self.seed + self.epoch)
+        self.epoch += 1  # a fresh order next time, even if set_epoch is never called
+        batches = []
+        for indices in self.buckets.values():
+            indices = list(indices)
+            rng.shuffle(indices)
+            for start in range(0, len(indices), self.batch_size):
+                batch = indices[start:start + self.batch_size]
+                if len(batch) == self.batch_size or not self.drop_last:
+                    batches.append(batch)
+        rng.shuffle(batches)
+        yield from batches
+
+    def __len__(self) -> int:
+        if self.drop_last:
+            return sum(len(indices) // self.batch_size for indices in self.buckets.values())
+        return sum(math.ceil(len(indices) / self.batch_size) for indices in self.buckets.values())
+
+    @property
+    def dropped_per_epoch(self) -> int:
+        """Samples left out of every epoch: each bucket's remainder after whole batches, with drop_last."""
+        if not self.drop_last:
+            return 0
+        return sum(len(indices) % self.batch_size for indices in self.buckets.values())
+
+    def describe(self, buckets: list[tuple[int, int]]) -> str:
+        """One line per bucket (its size, how many images it holds, how many each epoch leaves out), then the total."""
+        lines = []
+        for bucket, indices in sorted(self.buckets.items()):
+            line = f"  {buckets[bucket][0]}x{buckets[bucket][1]}: {len(indices)} images"
+            if self.drop_last and len(indices) % self.batch_size:
+                line += f" ({len(indices) % self.batch_size} dropped per epoch)"
+            lines.append(line)
+        if self.dropped_per_epoch:
+            never_seen = sum(len(indices) for indices in self.buckets.values() if len(indices) < self.batch_size)
+            lines.append(f"  {self.dropped_per_epoch} of {len(self.bucket_ids)} images dropped per epoch "
+                         f"(incomplete batches; {never_seen} in buckets smaller than a batch are never used)")
+        return "\n".join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Record image sizes for aspect-ratio bucketing.")
+    parser.add_argument("images_dir", type=str)
+    parser.add_argument("--output", type=str, default=None, help=f"Defaults to <images_dir>/{ASPECTS_FILE}.")
+    parser.add_argument("--resolution", type=int, default=None, help="Also print the bucket histogram at this resolution.")
+    parser.add_argument("--step", type=int, default=64)
+    args = parser.parse_args()
+
+    count = write_aspects(args.images_dir, args.output)
+    print(f"Recorded the size of {count} images")
+    if args.resolution:
+        buckets = make_buckets(args.resolution, args.step)
+        aspects = read_aspects(args.output or os.path.join(args.images_dir, ASPECTS_FILE))
+        sampler = AspectBucketBatchSampler([nearest_bucket(*size, buckets) for size in aspects.values()], 1)
+        print(f"Buckets at {args.resolution}px:\n{sampler.describe(buckets)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -15,6 +15,7 @@
 # limitations under the License.
 
 import argparse
+import functools
 import logging
 import math
 import os
@@ -34,7 +35,7 @@ from accelerate import Accelerator
 from accelerate.logging import get_logger
 from accelerate.state import AcceleratorState
 from accelerate.utils import ProjectConfiguration, set_seed
-from datasets import load_dataset
+from datasets import load_dataset, load_from_disk
 from huggingface_hub import create_repo, upload_folder
 from packaging import version
 from torchvision import transforms
@@ -51,6 +52,11 @@ from diffusers.utils.hub_utils import load_or_create_model_card, populate_model_
 from diffusers.utils.import_utils import is_xformers_available
 from diffusers.utils.torch_utils import is_compiled_module
 
+from aspect_buckets import (ASPECTS_FILE, AspectBucketBatchSampler, assign_buckets, make_buckets, nearest_bucket,
+                            read_aspects, resize_to_bucket)
+from keep_list import KeepList, cover_key
+from tar_shards import TarShardDataset
+
 
 if is_wandb_available():
     import wandb
@@ -197,6 +203,32 @@ def log_validation(vae, text_encoder, tokenizer, unet, args, accelerator, weight
     return images
 
 
+def tokenize_captions(examples, tokenizer, caption_column, is_train=True):
+    captions = []
+    for caption in examples[caption_column]:
+        if isinstance(caption, str):
+            captions.append(caption)
+        elif isinstance(caption, (list, np.ndarray)):
+            # take a random caption if there are multiple
+            captions.append(random.choice(caption) if is_train else caption[0])
+        else:
+            raise ValueError(
+                f"Caption column `{caption_column}` should contain either strings or lists of strings."
+            )
+    inputs = tokenizer(
+        captions, max_length=tokenizer.model_max_length, padding="max_length", truncation=True, return_tensors="pt"
+    )
+    return inputs.input_ids
+
+
+def preprocess_shard_sample(image, metadata, image_transforms, tokenizer, caption_column):
+    # Module level (bound with functools.partial) so dataloader workers started with `spawn` can unpickle it
+    return {
+        "pixel_values": image_transforms(image),
+        "input_ids": tokenize_captions({caption_column: [metadata[caption_column]]}, tokenizer, caption_column)[0],
+    }
+
+
 def parse_args():
     parser = argparse.ArgumentParser(description="Simple example of a training script.")
     parser.add_argument(
@@ -248,9 +280,45 @@ def parse_args():
             " must exist to provide the captions for the images. Ignored if `dataset_name` is specified."
         ),
     )
+    parser.add_argument(
+        "--train_dataset_dir",
+        type=str,
+        default=None,
+        help=(
+            "A captioned dataset saved with `save_to_disk` (e.g. by `python -m scraper.caption_dataset`). It is"
+            " memory-mapped by `load_from_disk`, so startup does not scan an image folder or parse a metadata.jsonl."
+            " Replaces `--dataset_name`/`--train_data_dir`."
+        ),
+    )
+    parser.add_argument(
+        "--train_shards",
+        type=str,
+        default=None,
+        help=(
+            "A folder of tar shards written by `tar_shards.py` (with its `shards.json`). The shards are streamed"
+            " with sequential reads and split across processes and dataloader workers, instead of loading an"
+            " imagefolder. Replaces `--dataset_name`/`--train_data_dir`."
+        ),
+    )
+    parser.add_argument(
+        "--shuffle_buffer",
+        type=int,
+        default=1000,
+        help="Number of samples each `--train_shards` reader shuffles within.",
+    )
     parser.add_argument(
         "--image_column", type=str, default="image", help="The column of the dataset containing an image."
     )
+    parser.add_argument(
+        "--keep_list",
+        type=str,
+        default=None,
+        help=(
+            "A text file listing the images to train on, one per line as `<shard>/<file>` (the `keep.txt` written by"
+            " `scraper.near_duplicates`). The near-duplicate covers it dropped are left out; images added after it"
+            " was written are kept, with a warning."
+        ),
+    )
     parser.add_argument(
         "--caption_column",
         type=str,
@@ -295,6 +363,22 @@ def parse_args():
             " resolution"
         ),
     )
+    parser.add_argument(
+        "--aspect_buckets",
+        default=False,
+        action="store_true",
+        help=(
+            "Train on aspect-ratio buckets of about `--resolution`^2 pixels instead of square crops, so covers keep"
+            " their shape (and their title and author). Needs the `aspects.jsonl` written by `aspect_buckets.py` in"
+            " `--train_data_dir`. Every batch comes from one bucket."
+        ),
+    )
+    parser.add_argument(
+        "--bucket_step",
+        type=int,
+        default=64,
+        help="Side granularity of the aspect-ratio buckets, in pixels.",
+    )
     parser.add_argument(
         "--center_crop",
         default=False,
@@ -515,8 +599,24 @@ def parse_args():
         args.local_rank = env_local_rank
 
     # Sanity checks
-    if args.dataset_name is None and args.train_data_dir is None:
-        raise ValueError("Need either a dataset name or a training folder.")
+    if (
+        args.dataset_name is None
+        and args.train_data_dir is None
+        and args.train_dataset_dir is None
+        and args.train_shards is None
+    ):
+        raise ValueError("Need either a dataset name, a training folder, a saved dataset or training shards.")
+    if args.train_dataset_dir is not None and args.keep_list is not None:
+        raise ValueError("Apply the keep list when building the `--train_dataset_dir` dataset (its `--keep-list`).")
+    if args.train_shards is not None and args.max_train_samples is not None:
+        raise ValueError("`--max_train_samples` is not supported with `--train_shards`; pack fewer samples instead.")
+    if args.aspect_buckets and args.train_dataset_dir is None and (
+        args.train_data_dir is None or args.dataset_name is not None or args.train_shards
+    ):
+        raise ValueError(
+            "`--aspect_buckets` needs a `--train_dataset_dir` or a local `--train_data_dir` (not a hub dataset or"
+            " `--train_shards`)."
+        )
 
     # default to using the same revision for the non-ema model if not specified
     if args.non_ema_revision is None:
@@ -734,7 +834,13 @@ def main():
 
     # In distributed training, the load_dataset function guarantees that only one local process can concurrently
     # download the dataset.
-    if args.dataset_name is not None:
+    if args.train_shards is not None:
+        # Streamed from the tar shards by TarShardDataset below
+        dataset = None
+    elif args.train_dataset_dir is not None:
+        # Prebuilt Arrow dataset, opened in constant time
+        dataset = load_from_disk(args.train_dataset_dir)
+    elif args.dataset_name is not None:
         # Downloading and loading a dataset from the hub.
         dataset = load_dataset(
             args.dataset_name,
@@ -754,9 +860,26 @@ def main():
         # See more about loading custom images at
         # https://huggingface.co/docs/datasets/v2.4.0/en/image_load#imagefolder
 
+    if args.keep_list is not None and dataset is not None:
+        # Prune near-duplicate covers. Filtering on the undecoded paths keeps metadata.jsonl (the captions)
+        # applying to the loaded dataset as usual and avoids decoding every image just to drop some.
+        # Covers added after the dedup run are kept, with a warning, rather than silently left out
+        keep = KeepList(args.keep_list)
+        image_feature = dataset["train"].features[args.image_column]
+        kept = (
+            dataset["train"]
+            .cast_column(args.image_column, datasets.Image(decode=False))
+            .filter(lambda image: cover_key(image["path"]) in keep, input_columns=args.image_column)
+        )
+        warning = keep.report(cover_key(image["path"]) for image in kept[args.image_column])
+        if warning:
+            logger.warning(warning)
+        dataset["train"] = kept.cast_column(args.image_column, image_feature)
+
     # Preprocessing the datasets.
     # We need to tokenize inputs and targets.
-    column_names = dataset["train"].column_names
+    # Shard samples carry their metadata.jsonl row, so the caption column means the same for them.
+    column_names = dataset["train"].column_names if dataset is not None else [args.image_column, args.caption_column]
 
     # 6. Get the column names for input/target.
     dataset_columns = DATASET_NAME_MAPPING.get(args.dataset_name, None)
@@ -777,25 +900,6 @@ def main():
                 f"--caption_column' value '{args.caption_column}' needs to be one of: {', '.join(column_names)}"
             )
 
-    # Preprocessing the datasets.
-    # We need to tokenize input captions and transform the images.
-    def tokenize_captions(examples, is_train=True):
-        captions = []
-        for caption in examples[caption_column]:
-            if isinstance(caption, str):
-                captions.append(caption)
-            elif isinstance(caption, (list, np.ndarray)):
-                # take a random caption if there are multiple
-                captions.append(random.choice(caption) if is_train else caption[0])
-            else:
-                raise ValueError(
-                    f"Caption column `{caption_column}` should contain either strings or lists of strings."
-                )
-        inputs = tokenizer(
-            captions, max_length=tokenizer.model_max_length, padding="max_length", truncation=True, return_tensors="pt"
-        )
-        return inputs.input_ids
-
     # Get the specified interpolation method from the args
     interpolation = getattr(transforms.InterpolationMode, args.image_interpolation_mode.upper(), None)
 
@@ -808,7 +912,18 @@ def main():
         [
             transforms.Resize(args.resolution, interpolation=interpolation),  # Use dynamic interpolation method
             transforms.CenterCrop(args.resolution) if args.center_crop else transforms.RandomCrop(args.resolution),
-            transforms.RandomHorizontalFlip() if args.random_flip else transforms.Lambda(lambda x: x),
+            # No lambda for the no-flip case: the transforms are pickled into `spawn` dataloader workers
+            *([transforms.RandomHorizontalFlip()] if args.random_flip else []),
+            transforms.ToTensor(),
+            transforms.Normalize([0.5], [0.5]),
+        ]
+    )
+
+    # With aspect buckets each image is first resized (and trimmed) to its own bucket, which replaces the square
+    # resize + crop
+    bucket_transforms = transforms.Compose(
+        [
+            *([transforms.RandomHorizontalFlip()] if args.random_flip else []),
             transforms.ToTensor(),
             transforms.Normalize([0.5], [0.5]),
         ]
@@ -816,15 +931,59 @@ def main():
 
     def preprocess_train(examples):
         images = [image.convert("RGB") for image in examples[image_column]]
-        examples["pixel_values"] = [train_transforms(image) for image in images]
-        examples["input_ids"] = tokenize_captions(examples)
+        if args.aspect_buckets:
+            examples["pixel_values"] = [
+                bucket_transforms(resize_to_bucket(image, buckets[bucket]))
+                for image, bucket in zip(images, examples["bucket"])
+            ]
+        else:
+            examples["pixel_values"] = [train_transforms(image) for image in images]
+        examples["input_ids"] = tokenize_captions(examples, tokenizer, caption_column)
         return examples
 
-    with accelerator.main_process_first():
-        if args.max_train_samples is not None:
-            dataset["train"] = dataset["train"].shuffle(seed=args.seed).select(range(args.max_train_samples))
-        # Set the training transforms
-        train_dataset = dataset["train"].with_transform(preprocess_train)
+    if args.train_shards is not None:
+        # Each process streams its own subset of the shards, picked by its process index (and split again
+        # across its dataloader workers), so no two ranks train on the same samples
+        train_dataset = TarShardDataset(
+            args.train_shards,
+            functools.partial(
+                preprocess_shard_sample,
+                image_transforms=train_transforms,
+                tokenizer=tokenizer,
+                caption_column=caption_column,
+            ),
+            args.train_batch_size,
+            rank=accelerator.process_index,
+            world_size=accelerator.num_processes,
+            num_workers=args.dataloader_num_workers,
+            shuffle_buffer=args.shuffle_buffer,
+            seed=args.seed or 0,
+        )
+    else:
+        with accelerator.main_process_first():
+            if args.max_train_samples is not None:
+                dataset["train"] = dataset["train"].shuffle(seed=args.seed).select(range(args.max_train_samples))
+            if args.aspect_buckets:
+                # Bucket of every image, stored as a column so preprocess_train knows each image's target size
+                buckets = make_buckets(args.resolution, args.bucket_step)
+                if {"width", "height"} <= set(column_names):
+                    # Saved datasets carry each image's size
+                    bucket_ids = [
+                        nearest_bucket(width, height, buckets)
+                        for width, height in zip(dataset["train"]["width"], dataset["train"]["height"])
+                    ]
+                else:
+                    image_paths = [
+                        image["path"]
+                        for image in dataset["train"].cast_column(image_column, datasets.Image(decode=False))[
+                            image_column
+                        ]
+                    ]
+                    aspects = read_aspects(os.path.join(args.train_data_dir, ASPECTS_FILE))
+                    bucket_ids = assign_buckets(image_paths, args.train_data_dir, aspects, buckets)
+                dataset["train"] = dataset["train"].add_column("bucket", bucket_ids)
+            # Set the training transforms
+            train_dataset = dataset["train"].with_transform(preprocess_train)
 
     def collate_fn(examples):
         pixel_values = torch.stack([example["pixel_values"] for example in examples])
@@ -833,19 +992,35 @@ def main():
         return {"pixel_values": pixel_values, "input_ids": input_ids}
 
     # DataLoaders creation:
-    train_dataloader = torch.utils.data.DataLoader(
-        train_dataset,
-        shuffle=True,
-        collate_fn=collate_fn,
-        batch_size=args.train_batch_size,
-        num_workers=args.dataloader_num_workers,
-    )
+    if args.aspect_buckets:
+        # Every batch is drawn from a single bucket, so its images share one shape
+        bucket_sampler = AspectBucketBatchSampler(
+            dataset["train"]["bucket"], args.train_batch_size, seed=args.seed or 0
+        )
+        logger.info(f"Aspect buckets at {args.resolution}px:\n{bucket_sampler.describe(buckets)}")
+        train_dataloader = torch.utils.data.DataLoader(
+            train_dataset,
+            batch_sampler=bucket_sampler,
+            collate_fn=collate_fn,
+            num_workers=args.dataloader_num_workers,
+        )
+    else:
+        train_dataloader = torch.utils.data.DataLoader(
+            train_dataset,
+            shuffle=args.train_shards is None,  # the shard stream shuffles itself
+            collate_fn=collate_fn,
+            batch_size=args.train_batch_size,
+            num_workers=args.dataloader_num_workers,
+        )
 
     # Scheduler and math around the number of training steps.
     # Check the PR https://github.com/huggingface/diffusers/pull/8312 for detailed explanation.
     num_warmup_steps_for_scheduler = args.lr_warmup_steps * accelerator.num_processes
     if args.max_train_steps is None:
-        len_train_dataloader_after_sharding = math.ceil(len(train_dataloader) / accelerator.num_processes)
+        if args.train_shards is not None:
+            len_train_dataloader_after_sharding = len(train_dataloader)  # already this process's share
+        else:
+            len_train_dataloader_after_sharding = math.ceil(len(train_dataloader) / accelerator.num_processes)
         num_update_steps_per_epoch = math.ceil(len_train_dataloader_after_sharding / args.gradient_accumulation_steps)
         num_training_steps_for_scheduler = (
             args.num_train_epochs * num_update_steps_per_epoch * accelerator.num_processes
@@ -861,9 +1036,15 @@ def main():
     )
 
     # Prepare everything with our `accelerator`.
-    unet, optimizer, train_dataloader, lr_scheduler = accelerator.prepare(
-        unet, optimizer, train_dataloader, lr_scheduler
-    )
+    if args.train_shards is not None:
+        # The shard dataloader is not prepared: accelerate would either read every batch on the main process
+        # and dispatch it, or have each process read the whole stream. The dataset already splits the shards
+        # by `accelerator.process_index`, and its batches are moved to the device in the training loop instead.
+        unet, optimizer, lr_scheduler = accelerator.prepare(unet, optimizer, lr_scheduler)
+    else:
+        unet, optimizer, train_dataloader, lr_scheduler = accelerator.prepare(
+            unet, optimizer, train_dataloader, lr_scheduler
+        )
 
     if args.use_ema:
         if args.offload_ema:
@@ -962,7 +1143,13 @@ def main():
 
     for epoch in range(first_epoch, args.num_train_epochs):
         train_loss = 0.0
+        if args.train_shards is not None:
+            train_dataset.set_epoch(epoch)
+        if args.aspect_buckets:
+            bucket_sampler.set_epoch(epoch)
         for step, batch in enumerate(train_dataloader):
+            if args.train_shards is not None:
+                batch = {k: v.to(accelerator.device, non_blocking=True) for k, v in batch.items()}
             with accelerator.accumulate(unet):
                 # Convert images to latent space
                 latents = vae.encode(batch["pixel_values"].to(weight_dtype)).latent_dist.sample()
@@ -0,0 +1,51 @@
+"""
+The near-duplicate keep list (`keep.txt` from scraper.near_duplicates), as the training scripts apply it.
+
+keep.txt only knows the covers that existed when near_duplicates last ran. A cover added
+since then is neither in keep.txt nor among the duplicates in the clusters.json next to it,
+so it is trained on (and counted, so the run can say the dedup is stale) instead of being
+dropped as if it were a duplicate.
+"""
+import json
+import os
+
+CLUSTERS_FILE = "clusters.json"
+
+
+def cover_key(path: str) -> str:
+    """`<shard>/<file>`, how keep.txt names the cover at `path` in any of the resized trees."""
+    return os.path.join(os.path.basename(os.path.dirname(path)), os.path.basename(path))
+
+
+class KeepList:
+    """
+    `file_name in keep_list` is True for listed covers and for covers newer than the list.
+    Attributes:
+        keep (set[str]): The listed covers (`<shard>/<file>`).
+        dropped (set[str] | None): The duplicates near_duplicates dropped; None without a clusters.json,
+            in which case only listed covers are kept.
+    """
+
+    def __init__(self, path: str):
+        with open(path, "r", encoding="utf-8") as f:
+            self.keep = {line.strip() for line in f if line.strip()}
+        clusters_path = os.path.join(os.path.dirname(path), CLUSTERS_FILE)
+        self.dropped = None
+        if os.path.exists(clusters_path):
+            with open(clusters_path, "r", encoding="utf-8") as f:
+                self.dropped = {name for cluster in json.load(f) for name in cluster["duplicates"]}
+
+    def __contains__(self, file_name: str) -> bool:
+        return file_name in self.keep or self.is_new(file_name)
+
+    def is_new(self, file_name: str) -> bool:
+        """True for a cover the near-duplicate run did not see (neither kept nor dropped)."""
+        return self.dropped is not None and file_name not in self.keep and file_name not in self.dropped
+
+    def report(self, file_names) -> str | None:
+        """A warning if some of the (kept) `file_names` were not deduplicated yet, else None."""
+        new = sum(1 for file_name in file_names if self.is_new(file_name))
+        if not new:
+            return None
+        return (f"{new} covers were added after the last near-duplicate run and are used unpruned; "
+                f"rerun scraper.near_duplicates to deduplicate them")
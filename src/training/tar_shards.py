@@ -0,0 +1,243 @@
+"""
+Sharded tar archives of the training covers, and a streaming dataset over them.
+
+Loading an imagefolder globs the whole tree at startup and then does one small
+random read per sample. Packing the covers and their captions into a few
+hundred-MB tar shards (WebDataset layout: `<key>.jpg` + `<key>.json` per sample)
+turns that into large sequential reads. `TarShardDataset` streams the shards,
+shuffles within a buffer, and splits the shards across accelerate ranks and
+dataloader workers so every process reads its own files.
+
+Usage (packing):
+    python src/training/tar_shards.py "data/goodreads data/goodreads_covers_resized" "data/goodreads data/shards"
+        [--samples_per_shard 2000] [--resolution 512] [--keep_list "data/goodreads data/dedup/keep.txt"]
+"""
+import argparse
+import io
+import itertools
+import json
+import os
+import random
+import tarfile
+import time
+
+from PIL import Image
+from torch.utils.data import IterableDataset, get_worker_info
+
+from keep_list import KeepList
+
+INDEX_FILE = "shards.json"
+SHARD_NAME = "shard-{:06d}.tar"
+SAMPLES_PER_SHARD = 2000
+SHUFFLE_BUFFER = 1000
+
+
+def read_metadata(data_dir: str) -> list[dict]:
+    """The rows of the imagefolder's metadata.jsonl (`file_name` plus the caption fields)."""
+    with open(os.path.join(data_dir, "metadata.jsonl"), "r", encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def encode_image(path: str, resolution: int | None) -> bytes:
+    """The file's bytes as-is, or re-encoded with the shorter side at `resolution` so training decodes less."""
+    if resolution is None:
+        with open(path, "rb") as f:
+            return f.read()
+    with Image.open(path) as img:
+        img.draft("RGB", (resolution, resolution))
+        img = img.convert("RGB")
+        scale = resolution / min(img.size)
+        if scale < 1:
+            img = img.resize((round(img.width * scale), round(img.height * scale)), Image.Resampling.LANCZOS)
+        buffer = io.BytesIO()
+        img.save(buffer, format="JPEG", quality=95)
+        return buffer.getvalue()
+
+
+def _add_member(tar: tarfile.TarFile, name: str, data: bytes) -> None:
+    info = tarfile.TarInfo(name)
+    info.size = len(data)
+    info.mtime = int(time.time())
+    tar.addfile(info, io.BytesIO(data))
+
+
+def pack_shards(data_dir: str, output_dir: str, samples_per_shard: int = SAMPLES_PER_SHARD,
+                resolution: int | None = None, keep: KeepList | set[str] | None = None, seed: int = 0) -> dict:
+    """
+    Pack the captioned images of an imagefolder into tar shards.
+    Args:
+        data_dir (str): Folder with the images and a metadata.jsonl of captions.
+        output_dir (str): Where the shards and shards.json are written.
+        samples_per_shard (int): Images per shard.
+        resolution (int | None): Re-encode images with this shorter side; None stores the files unchanged.
+        keep (KeepList | set[str] | None): Only pack the `file_name`s in it (e.g. the near-duplicate keep list).
+        seed (int): Samples are shuffled once before packing, so every shard is a random mix.
+    Returns:
+        dict: The shard index written to shards.json.
+    """
+    rows = read_metadata(data_dir)
+    if keep is not None:
+        rows = [row for row in rows if row["file_name"] in keep]
+    random.Random(seed).shuffle(rows)
+    os.makedirs(output_dir, exist_ok=True)
+
+    shards = []
+    skipped = 0
+    for shard_number, start in enumerate(range(0, len(rows), samples_per_shard)):
+        name = SHARD_NAME.format(shard_number)
+        tmp_path = os.path.join(output_dir, f"{name}.tmp")
+        samples = 0
+        with tarfile.open(tmp_path, "w") as tar:
+            for index, row in enumerate(rows[start:start + samples_per_shard], start=start):
+                try:
+                    image = encode_image(os.path.join(data_dir, row["file_name"]), resolution)
+                except OSError as e:
+                    print(f"Skipping {row['file_name']}: {e}")
+                    skipped += 1
+                    continue
+                # WebDataset keys end at the first dot, so they are plain sample numbers
+                key = f"{index:09d}"
+                _add_member(tar, f"{key}.jpg", image)
+                _add_member(tar, f"{key}.json", json.dumps(row, ensure_ascii=False).encode("utf-8"))
+                samples += 1
+        os.replace(tmp_path, os.path.join(output_dir, name))
+        shards.append({"path": name, "samples": samples, "bytes": os.path.getsize(os.path.join(output_dir, name))})
+        print(f"Wrote {name}: {samples} samples, {shards[-1]['bytes'] / 1e6:.1f} MB")
+
+    index = {"total": sum(shard["samples"] for shard in shards), "resolution": resolution, "shards": shards}
+    with open(os.path.join(output_dir, INDEX_FILE), "w", encoding="utf-8") as f:
+        json.dump(index, f, indent=2)
+    print(f"Packed {index['total']} samples into {len(shards)} shards in {output_dir} ({skipped} skipped)")
+    return index
+
+
+def iter_tar_samples(path: str):
+    """Stream (image bytes, metadata) pairs from one shard, in order, with a single sequential read."""
+    sample, current_key = {}, None
+    with tarfile.open(path, mode="r|") as tar:
+        for member in tar:
+            if not member.isfile():
+                continue
+            key, _, extension = member.name.partition(".")
+            if key != current_key:
+                if "jpg" in sample and "json" in sample:
+                    yield sample["jpg"], json.loads(sample["json"])
+                sample, current_key = {}, key
+            sample[extension] = tar.extractfile(member).read()
+    if "jpg" in sample and "json" in sample:
+        yield sample["jpg"], json.loads(sample["json"])
+
+
+class TarShardDataset(IterableDataset):
+    """
+    Streams samples from tar shards written by `pack_shards`.
+
+    With at least as many shards as readers (ranks x dataloader workers), each reader gets its own
+    shards; otherwise every reader streams all shards and keeps every n-th sample. Every reader yields
+    the same number of samples per epoch (a multiple of `batch_size`, wrapping around its shards if
+    they are short), so all ranks take the same number of steps and no batch is partial.
+    Attributes:
+        shard_dir (str): Folder with the shards and shards.json.
+        transform (callable): Maps (PIL image, metadata dict) to a training example.
+        batch_size (int): Per-device batch size.
+        rank (int): This process's index among `world_size` training processes.
+        world_size (int): Number of training processes.
+        num_workers (int): The DataLoader's num_workers (each worker is a separate reader).
+        shuffle_buffer (int): Samples held in the shuffle buffer; 0 streams in shard order.
+        seed (int): Base seed for shard order and buffer shuffling (combined with the epoch).
+    """
+
+    def __init__(self, shard_dir: str, transform, batch_size: int, rank: int = 0, world_size: int = 1,
+                 num_workers: int = 0, shuffle_buffer: int = SHUFFLE_BUFFER, seed: int = 0):
+        with open(os.path.join(shard_dir, INDEX_FILE), "r", encoding="utf-8") as f:
+            index = json.load(f)
+        self.shards = [(os.path.join(shard_dir, shard["path"]), shard["samples"]) for shard in index["shards"]]
+        self.total = index["total"]
+        if not self.total:
+            raise ValueError(f"No samples in the shards in {shard_dir}.")
+        self.transform = transform
+        self.batch_size = batch_size
+        self.rank = rank
+        self.world_size = world_size
+        self.num_workers = max(num_workers, 1)  # num_workers=0 reads in the main process
+        self.shuffle_buffer = shuffle_buffer
+        self.seed = seed
+        self.epoch = 0
+
+    def set_epoch(self, epoch: int) -> None:
+        """Reshuffle the shard order and buffer for a new epoch (call before iterating the dataloader)."""
+        self.epoch = epoch
+
+    def _quota(self) -> int:
+        # Samples per reader per epoch: an equal share of the data, rounded down to whole batches
+        return max(self.total // (self.world_size * self.num_workers) // self.batch_size, 1) * self.batch_size
+
+    def __len__(self) -> int:
+        """Samples this rank yields per epoch."""
+        return self._quota() * self.num_workers
+
+    def _reader_samples(self, reader: int, readers: int):
+        """Endless stream of this reader's samples, reshuffling the shard order on every pass."""
+        rng = random.Random(self.seed + self.epoch)
+        while True:
+            shards = list(self.shards)
+            rng.shuffle(shards)  # same order in every reader, so shard assignment stays disjoint
+            if len(shards) >= readers:
+                for path, _ in shards[reader::readers]:
+                    yield from iter_tar_samples(path)
+            else:
+                seen = 0
+                for path, _ in shards:
+                    for sample in iter_tar_samples(path):
+                        if seen % readers == reader:
+                            yield sample
+                        seen += 1
+
+    def __iter__(self):
+        worker = get_worker_info()
+        worker_id = worker.id if worker else 0
+        readers = self.world_size * self.num_workers
+        reader = self.rank * self.num_workers + worker_id
+        rng = random.Random((self.seed + self.epoch) * 1_000_003 + reader)
+
+        buffer = []
+        for sample in itertools.islice(self._reader_samples(reader, readers), self._quota()):
+            if len(buffer) < self.shuffle_buffer:
+                buffer.append(sample)
+                continue
+            if buffer:
+                # Emit a random buffered sample and keep the new one in its place
+                position = rng.randrange(len(buffer))
+                sample, buffer[position] = buffer[position], sample
+            yield self._decode(*sample)
+        rng.shuffle(buffer)
+        for sample in buffer:
+            yield self._decode(*sample)
+
+    def _decode(self, image_bytes: bytes, metadata: dict):
+        image = Image.open(io.BytesIO(image_bytes)).convert("RGB")
+        return self.transform(image, metadata)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Pack an imagefolder with metadata.jsonl into tar shards.")
+    parser.add_argument("data_dir", type=str)
+    parser.add_argument("output_dir", type=str)
+    parser.add_argument("--samples_per_shard", type=int, default=SAMPLES_PER_SHARD)
+    parser.add_argument("--resolution", type=int, default=None,
+                        help="Re-encode images with this shorter side (e.g. the training resolution).")
+    parser.add_argument("--keep_list", type=str, default=None,
+                        help="Only pack the images listed in this file (the keep.txt from scraper.near_duplicates).")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    keep = KeepList(args.keep_list) if args.keep_list is not None else None
+    if keep is not None:
+        warning = keep.report(row["file_name"] for row in read_metadata(args.data_dir))
+        if warning:
+            print(warning)
+    pack_shards(args.data_dir, args.output_dir, args.samples_per_shard, args.resolution, keep, args.seed)
+
+
+if __name__ == "__main__":
+    main()
@@ -33,6 +33,10 @@ class TrainingConfig:
         log_interval (int): Number of steps between logging training metrics.
         optimizer (str): Optimizer to use (e.g., "adamw").
         weight_decay (float): Weight decay (L2 penalty) for the optimizer.
+        aspect_bucketing (bool): Train on aspect-ratio buckets instead of squashing covers to squares
+            (needs the aspects.jsonl written by aspect_buckets.py). Off by default: bucketed training
+            resizes the 512px thumbnails every epoch instead of reading the pre-sized square covers.
+        bucket_step (int): Side granularity of the buckets, in pixels.
     """
     image_size: int = 256  # the generated image resolution
     train_batch_size: int = 4  # lowered for OOM safety; adjust as needed
@@ -67,5 +71,9 @@ class TrainingConfig:
     optimizer: str = "adamw"
     weight_decay: float = 0.01
 
+    # Aspect-ratio bucketing
+    aspect_bucketing: bool = False
+    bucket_step: int = 32  # the UNet downsamples 5 times
+
     # Current Model Directory
     current_model_dir: str = "epoch-49-step-15300-2025-08-28"
@@ -17,6 +17,7 @@ from accelerate import Accelerator
 from accelerate import notebook_launcher
 
 # Hugging Face libraries
+from datasets import Image as DatasetImage
 from datasets import load_dataset
 from diffusers.models.unets.unet_2d import UNet2DModel
 from diffusers.schedulers.scheduling_ddpm import DDPMScheduler
@@ -27,6 +28,9 @@ from huggingface_hub import create_repo, upload_folder
 
 # Import local training configuration
 import training_config
+from keep_list import KeepList
+from aspect_buckets import (ASPECTS_FILE, IMAGE_EXTENSIONS, AspectBucketBatchSampler, assign_buckets, make_buckets,
+                            read_aspects, resize_to_bucket)
 
 # Load the training configuration
 config = training_config.TrainingConfig()
@@ -39,17 +43,56 @@ model_dir.mkdir(exist_ok=True)
 date_str = datetime.datetime.now().strftime("%Y-%m-%d")
 
 # Load the local dataset
-# Images have been preprocessed and resized to 512x512 pixels(which will change to 128x128 later)
-# Also ensured that the images are in RGB format
-dataset = load_dataset(
-    "imagefolder",
-    data_dir="data/goodreads data/goodreads_covers_resized"
-)
+# image_resizer.py writes each cover at every training resolution (goodreads_covers_resized_<size>),
+# already square and in RGB, so those images are read at config.image_size and the Resize
+# below is a no-op. A cover missing from that tree (not resized yet, or a size added later)
+# falls back to its 512px thumbnail, resized every epoch, so no cover is dropped.
+# drop_labels: the covers sit in hash-sharded subfolders, which are not classes
+# If near_duplicates.py has pruned the covers, the duplicates it dropped are left out
+# (keep.txt lists <shard>/<file>, the same in every resized tree).
+# With aspect bucketing (opt-in, config.aspect_bucketing) the covers keep their shape, so they come from
+# the aspect-preserving thumbnails instead.
+covers_dir = "data/goodreads data/goodreads_covers_resized"
+presized_dir = f"{covers_dir}_{config.image_size}"
+aspects_path = os.path.join(covers_dir, ASPECTS_FILE)
+use_buckets = config.aspect_bucketing and os.path.exists(aspects_path)
+if config.aspect_bucketing and not use_buckets:
+    print(f"No {aspects_path} (run aspect_buckets.py), training on square covers")
+keep_list = "data/goodreads data/dedup/keep.txt"
+file_names = [os.path.relpath(os.path.join(root, name), covers_dir)
+              for root, _, files in os.walk(covers_dir) for name in sorted(files)
+              if name.lower().endswith(IMAGE_EXTENSIONS)]
+if os.path.exists(keep_list):
+    # Covers added after the dedup run are kept, with a warning, rather than silently left out
+    keep = KeepList(keep_list)
+    file_names = [file_name for file_name in file_names if file_name in keep]
+    warning = keep.report(file_names)
+    if warning:
+        print(warning)
+image_dirs = [covers_dir] if use_buckets else [presized_dir, covers_dir]
+train_files, missing = [], 0
+for file_name in file_names:
+    path = next((path for path in (os.path.join(image_dir, file_name) for image_dir in image_dirs)
+                 if os.path.exists(path)), None)
+    if path is None:
+        missing += 1
+    else:
+        train_files.append(path)
+if missing:
+    print(f"Skipping {missing} covers with no resized image")
+dataset = load_dataset("imagefolder", data_files={"train": train_files}, drop_labels=True)
+if use_buckets:
+    # Bucket of every image, stored as a column so the transform knows each image's target size
+    buckets = make_buckets(config.image_size, config.bucket_step)
+    image_paths = [image["path"] for image in dataset["train"].cast_column("image", DatasetImage(decode=False))["image"]]
+    bucket_ids = assign_buckets(image_paths, covers_dir, read_aspects(aspects_path), buckets)
+    dataset["train"] = dataset["train"].add_column("bucket", bucket_ids)
 # Further processing the dataset
 # Convert images to tensors and normalize them
 preprocess = transforms.Compose(
     [
-        transforms.Resize((config.image_size, config.image_size)),
+        # Bucketed images are already at their bucket size
+        transforms.Lambda(lambda x: x) if use_buckets else transforms.Resize((config.image_size, config.image_size)),
         transforms.RandomHorizontalFlip(),
         transforms.ToTensor(),
         transforms.Normalize([0.5], [0.5]),
@@ -58,21 +101,29 @@ preprocess = transforms.Compose(
 
 def transform(examples):
     """
-    Applies preprocessing transforms to a batch of images: resize, random horizontal flip, convert to tensor, and normalize.
+    Applies preprocessing transforms to a batch of images: resize (to the image's aspect bucket, or a square), random horizontal flip, convert to tensor, and normalize.
     Args:
         examples (dict): A dictionary with an 'image' key containing a list of PIL Images.
     Returns:
         dict: A dictionary with a single key 'images' containing a list of processed tensors.
     """
-    images = [preprocess(image.convert("RGB")) for image in examples["image"]]
-    return {"images": images}
+    images = [image.convert("RGB") for image in examples["image"]]
+    if use_buckets:
+        images = [resize_to_bucket(image, buckets[bucket]) for image, bucket in zip(images, examples["bucket"])]
+    return {"images": [preprocess(image) for image in images]}
 
 dataset.set_transform(transform)
-dataloader = torch.utils.data.DataLoader(
-    dataset["train"],
-    batch_size=config.train_batch_size,
-    shuffle=True
-)
+if use_buckets:
+    # Every batch is drawn from a single bucket, so its images share one shape
+    bucket_sampler = AspectBucketBatchSampler(bucket_ids, config.train_batch_size, seed=config.seed)
+    print(f"Aspect buckets at {config.image_size}px:\n{bucket_sampler.describe(buckets)}")
+    dataloader = torch.utils.data.DataLoader(dataset["train"], batch_sampler=bucket_sampler)
+else:
+    dataloader = torch.utils.data.DataLoader(
+        dataset["train"],
+        batch_size=config.train_batch_size,
+        shuffle=True
+    )
 
 current_model_dir = Path(config.current_model_dir)
 resume_dir = model_dir / current_model_dir
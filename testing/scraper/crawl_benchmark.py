@@ -0,0 +1,99 @@
+"""
+End-to-end throughput benchmark of goodreads_scraper against the replay server.
+
+Starts replay_server.py on the given fixtures, runs the full scraper in a fresh
+temporary working directory with its list URL pointed at the server, and
+reports books/sec, bytes/sec and the peak RSS of the scraper processes.
+Works fully offline, so it can run in CI or on air-gapped machines.
+
+Usage:
+    python testing/scraper/crawl_benchmark.py fixtures/ [--latency-ms 100] [--error-rate 0.02] [--max-in-flight 8]
+"""
+import argparse
+import os
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+from replay_server import start_server
+
+SRC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "src")
+RECORDS_FILE = os.path.join("goodreads data", "goodreads_book_data", "goodreads_books_data.jsonl")
+
+
+def count_lines(path: str) -> int:
+    if not os.path.exists(path):
+        return 0
+    with open(path, "rb") as f:
+        return sum(1 for line in f if line.strip())
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("fixtures_dir")
+    parser.add_argument("--seed", help="List URL to crawl (defaults to the first recorded seed).")
+    parser.add_argument("--latency-ms", type=float, default=50.0)
+    parser.add_argument("--jitter-ms", type=float, default=50.0)
+    parser.add_argument("--throttle-rate", type=float, default=0.0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--max-in-flight", type=int, default=8)
+    parser.add_argument("--rate", type=float, default=1000.0, help="Starting and maximum requests/sec per host given to the scraper.")
+    parser.add_argument("--scraper-arg", action="append", default=[], help="Extra argument passed to the scraper.")
+    parser.add_argument("--keep", action="store_true", help="Keep the scraper's working directory.")
+    args = parser.parse_args()
+
+    server = start_server(os.path.abspath(args.fixtures_dir), latency=args.latency_ms / 1000,
+                          jitter=args.jitter_ms / 1000, throttle_rate=args.throttle_rate,
+                          error_rate=args.error_rate, seed=0)
+    seeds = server.manifest.get("seeds", [])
+    seed = args.seed or (seeds[0] if seeds else None)
+    if not seed:
+        sys.exit("No seed list URL recorded in the fixtures; pass --seed.")
+
+    workdir = tempfile.mkdtemp(prefix="crawl_benchmark_")
+    command = [
+        sys.executable, "-m", "scraper.goodreads_scraper",
+        "--list-url", server.local_url(seed),
+        "--max-in-flight", str(args.max_in_flight),
+        "--page-rate", str(args.rate),
+        "--image-rate", str(args.rate),
+        "--page-rate-max", str(args.rate),
+        "--image-rate-max", str(args.rate),
+        *args.scraper_arg,
+    ]
+    print(f"Replaying {len(server.responses)} responses from {server.base_url}, crawling {seed}")
+
+    # Run from the source tree, so the benchmark works without installing the package
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, [os.path.abspath(SRC_DIR),
+                                                                     os.environ.get("PYTHONPATH")])))
+    start = time.perf_counter()
+    with open(os.path.join(workdir, "scraper.log"), "w") as log:
+        result = subprocess.run(command, cwd=workdir, env=env, stdout=log, stderr=subprocess.STDOUT)
+    elapsed = time.perf_counter() - start
+    server.shutdown()
+
+    books = count_lines(os.path.join(workdir, RECORDS_FILE))
+    # ru_maxrss of waited-for children: the largest scraper process (KiB on Linux)
+    peak_rss_mib = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024
+    stats = dict(server.stats)
+    sent = stats.pop("bytes", 0)
+
+    print(f"Scraper exit code: {result.returncode}")
+    print(f"Wall time:         {elapsed:.2f} s")
+    print(f"Books scraped:     {books} ({books / elapsed:.2f} books/sec)")
+    print(f"Bytes served:      {sent / 1e6:.2f} MB ({sent / 1e6 / elapsed:.2f} MB/sec)")
+    print(f"Peak RSS:          {peak_rss_mib:.1f} MiB")
+    print(f"Responses:         {stats}")
+
+    if args.keep:
+        print(f"Scraper output kept in {workdir}")
+    else:
+        shutil.rmtree(workdir, ignore_errors=True)
+    sys.exit(result.returncode)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,83 @@
+"""
+Micro-benchmark of extract_book_details over saved detail pages.
+
+Compares the reference soup path (full html.parser tree) with the fast soup
+path (lxml + only the needed subtrees) and checks both produce identical dicts.
+Also times the default path, which reads the page's embedded JSON first and
+only builds a soup for the fields it is missing.
+By default it reads the pages stored in the scraper's HTTP cache.
+
+Usage:
+    python testing/scraper/parser_benchmark.py ["goodreads data/http_cache"] [--repeat 3] [--workers 4]
+"""
+import argparse
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "..", "src"))
+from scraper.book_parser import FAST_PARSER, extract_book_details  # noqa: E402
+
+
+def load_pages(pages_dir: str, limit: int | None) -> list[tuple[str, str]]:
+    """Read every saved page under `pages_dir` (recursively) as (name, html) pairs."""
+    pages = []
+    for root, _, files in os.walk(pages_dir):
+        for name in sorted(files):
+            if name.startswith("index.sqlite3") or name.endswith(".tmp"):
+                continue
+            with open(os.path.join(root, name), "r", encoding="utf-8", errors="replace") as f:
+                pages.append((name, f.read()))
+            if limit and len(pages) >= limit:
+                return pages
+    return pages
+
+
+def _parse_fast(page: tuple[str, str]) -> dict:
+    return extract_book_details(page[1], page[0], fast=True, structured=False)
+
+
+def bench(label: str, pages: list[tuple[str, str]], fast: bool, repeat: int, structured: bool = False) -> list[dict]:
+    results = []
+    start = time.perf_counter()
+    for _ in range(repeat):
+        results = [extract_book_details(html, name, fast=fast, structured=structured) for name, html in pages]
+    elapsed = time.perf_counter() - start
+    print(f"{label:<28} {len(pages) * repeat / elapsed:10.1f} pages/sec")
+    return results
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("pages_dir", nargs="?", default="goodreads data/http_cache")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--limit", type=int, default=None)
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    args = parser.parse_args()
+
+    pages = load_pages(args.pages_dir, args.limit)
+    if not pages:
+        sys.exit(f"No saved pages found in {args.pages_dir}")
+    print(f"Benchmarking {len(pages)} pages x {args.repeat} (fast backend: {FAST_PARSER})")
+
+    reference = bench("html.parser, full tree", pages, fast=False, repeat=args.repeat)
+    fast = bench(f"{FAST_PARSER}, strained tree", pages, fast=True, repeat=args.repeat)
+    bench("embedded JSON + fallback", pages, fast=True, repeat=args.repeat, structured=True)
+
+    start = time.perf_counter()
+    with ProcessPoolExecutor(args.workers) as pool:
+        for _ in range(args.repeat):
+            pooled = list(pool.map(_parse_fast, pages, chunksize=16))
+    elapsed = time.perf_counter() - start
+    print(f"{'fast path, ' + str(args.workers) + ' processes':<28} {len(pages) * args.repeat / elapsed:10.1f} pages/sec")
+
+    mismatches = [name for (name, _), a, b, c in zip(pages, reference, fast, pooled) if not a == b == c]
+    for name in mismatches[:10]:
+        print(f"Mismatch: {name}")
+    assert not mismatches, f"{len(mismatches)} pages parsed differently by the fast path"
+    print("Fast and reference paths produced identical records.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,141 @@
+"""
+Record list pages, detail pages and covers as fixtures for replay_server.py.
+
+By default everything is exported from what a previous scraper run already
+stored locally (the HTTP page cache and the cover store), so recording does
+not touch the network. Extra URLs can be fetched live with --url. Covers the
+crawler stored without their original (--resize-inline without
+--keep-originals) are recorded from their 512px thumbnail instead.
+
+Usage:
+    python testing/scraper/replay_recorder.py fixtures/ [--data-root "goodreads data"] [--url URL ...]
+"""
+import argparse
+import json
+import os
+import sqlite3
+import sys
+
+import requests
+
+from replay_server import MANIFEST, body_filename
+
+CONTENT_TYPES = {".jpg": "image/jpeg", ".jpeg": "image/jpeg", ".png": "image/png",
+                 ".gif": "image/gif", ".webp": "image/webp"}
+# Where the crawler's --resize-inline writes thumbnails, relative to the data root (scraper.thumbnails.RESIZED_DIR)
+RESIZED_DIR = "goodreads_covers_resized"
+USER_AGENT = "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36"
+
+
+class FixtureWriter:
+    def __init__(self, fixtures_dir: str):
+        self.fixtures_dir = fixtures_dir
+        os.makedirs(os.path.join(fixtures_dir, "bodies"), exist_ok=True)
+        manifest_path = os.path.join(fixtures_dir, MANIFEST)
+        if os.path.exists(manifest_path):
+            with open(manifest_path, "r", encoding="utf-8") as f:
+                self.manifest = json.load(f)
+        else:
+            self.manifest = {"seeds": [], "responses": {}}
+
+    def add(self, url: str, data: bytes, content_type: str) -> None:
+        relative_path = os.path.join("bodies", body_filename(url))
+        with open(os.path.join(self.fixtures_dir, relative_path), "wb") as f:
+            f.write(data)
+        self.manifest["responses"][url] = {"file": relative_path, "content_type": content_type}
+
+    def add_seed(self, url: str) -> None:
+        if url not in self.manifest["seeds"]:
+            self.manifest["seeds"].append(url)
+
+    def save(self) -> None:
+        with open(os.path.join(self.fixtures_dir, MANIFEST), "w", encoding="utf-8") as f:
+            json.dump(self.manifest, f, indent=2)
+
+
+def record_page_cache(writer: FixtureWriter, cache_dir: str) -> int:
+    index = os.path.join(cache_dir, "index.sqlite3")
+    if not os.path.exists(index):
+        return 0
+    conn = sqlite3.connect(index)
+    count = 0
+    for key, url in conn.execute("SELECT key, url FROM entries"):
+        body_path = os.path.join(cache_dir, key[:2], key)
+        if not os.path.exists(body_path):
+            continue
+        with open(body_path, "rb") as f:
+            writer.add(url, f.read(), "text/html; charset=utf-8")
+        # First pages of lists are the natural crawl seeds
+        if "/list/show/" in url and "page=" not in url:
+            writer.add_seed(url)
+        count += 1
+    conn.close()
+    return count
+
+
+def record_cover_store(writer: FixtureWriter, store_dir: str, resized_dir: str) -> tuple[int, int, int]:
+    """Record every indexed cover. Returns (covers recorded, of which from thumbnails, covers with no file left)."""
+    index = os.path.join(store_dir, "index.sqlite3")
+    if not os.path.exists(index):
+        return 0, 0, 0
+    conn = sqlite3.connect(index)
+    columns = {row[1] for row in conn.execute("PRAGMA table_info(images)")}
+    original = "original" if "original" in columns else "1"  # stores from before originals became optional
+    count = thumbnails = missing = 0
+    for image_url, content_hash, ext, has_original in conn.execute(
+            f"SELECT image_url, hash, ext, {original} FROM image_urls JOIN images USING (hash)"):
+        path = os.path.join(store_dir, content_hash[:2], content_hash + ext)
+        content_type = CONTENT_TYPES.get(ext, "application/octet-stream")
+        if not has_original or not os.path.exists(path):
+            # Only the thumbnail was kept: it replays as a smaller JPEG cover
+            path = os.path.join(resized_dir, content_hash[:2], content_hash + ".jpg")
+            content_type = CONTENT_TYPES[".jpg"]
+            if not os.path.exists(path):
+                missing += 1
+                continue
+            thumbnails += 1
+        with open(path, "rb") as f:
+            writer.add(image_url, f.read(), content_type)
+        count += 1
+    conn.close()
+    return count, thumbnails, missing
+
+
+def record_live(writer: FixtureWriter, urls: list[str]) -> None:
+    session = requests.Session()
+    session.headers["User-Agent"] = USER_AGENT
+    for url in urls:
+        print(f"Recording: {url}")
+        response = session.get(url, timeout=15)
+        response.raise_for_status()
+        writer.add(url, response.content, response.headers.get("Content-Type", "text/html; charset=utf-8"))
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("fixtures_dir")
+    parser.add_argument("--data-root", default="goodreads data", help="Data directory of a previous scraper run.")
+    parser.add_argument("--url", action="append", default=[], help="Extra URL to fetch live and record.")
+    parser.add_argument("--seed", action="append", default=[], help="Mark a recorded list URL as a crawl seed.")
+    args = parser.parse_args()
+
+    writer = FixtureWriter(args.fixtures_dir)
+    pages = record_page_cache(writer, os.path.join(args.data_root, "http_cache"))
+    covers, thumbnails, missing = record_cover_store(writer, os.path.join(args.data_root, "cover_store"),
+                                                     os.path.join(args.data_root, RESIZED_DIR))
+    record_live(writer, args.url)
+    for seed in args.seed:
+        writer.add_seed(seed)
+    writer.save()
+
+    print(f"Recorded {pages} cached pages, {covers} covers ({thumbnails} from thumbnails) and {len(args.url)} "
+          f"live URLs to {args.fixtures_dir}")
+    if missing:
+        print(f"Warning: {missing} indexed covers have neither an original nor a thumbnail on disk and were not "
+              f"recorded; the replayed crawl will get 404s for them.")
+    if not writer.manifest["seeds"]:
+        sys.exit("Warning: no list seed recorded; pass --seed with the list URL to crawl.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,177 @@
+"""
+Local stand-in for goodreads.com that replays recorded responses.
+
+Fixtures are recorded with replay_recorder.py. Requests are mapped back to the
+original URL as `/<host>/<path>` (or just `/<path>` for the main HTML host, so
+relative links keep working), and absolute links to recorded hosts inside HTML
+bodies are rewritten to point at this server. Latency and 429/5xx errors can be
+injected to exercise the scraper's rate limiting and retry handling.
+
+Usage:
+    python testing/scraper/replay_server.py fixtures/ --port 8000 --latency-ms 200 --error-rate 0.05
+"""
+import argparse
+import hashlib
+import json
+import os
+import random
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit
+
+MANIFEST = "manifest.json"
+
+
+def body_filename(url: str) -> str:
+    return hashlib.sha256(url.encode("utf-8")).hexdigest()
+
+
+def load_manifest(fixtures_dir: str) -> dict:
+    with open(os.path.join(fixtures_dir, MANIFEST), "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+class ReplayServer(ThreadingHTTPServer):
+    """
+    HTTP server replaying a fixtures directory.
+    Attributes:
+        latency (float): Base seconds added to every response.
+        jitter (float): Extra random 0-jitter seconds per response.
+        throttle_rate (float): Fraction of requests answered with 429 + Retry-After.
+        error_rate (float): Fraction of requests answered with 503.
+        stats (Counter): Requests per status code plus 'bytes' sent.
+    """
+    daemon_threads = True
+
+    def __init__(self, fixtures_dir: str, port: int = 0, latency: float = 0.0, jitter: float = 0.0,
+                 throttle_rate: float = 0.0, error_rate: float = 0.0, seed: int | None = None):
+        super().__init__(("127.0.0.1", port), ReplayHandler)
+        self.fixtures_dir = fixtures_dir
+        self.manifest = load_manifest(fixtures_dir)
+        self.responses = self.manifest["responses"]
+        self.latency = latency
+        self.jitter = jitter
+        self.throttle_rate = throttle_rate
+        self.error_rate = error_rate
+        self.random = random.Random(seed)
+        self.stats = Counter()
+        self._stats_lock = threading.Lock()
+        self._rewritten: dict[str, bytes] = {}
+
+        # host -> scheme of everything recorded; the host with the most HTML pages is the default
+        self.hosts = {}
+        html_hosts = Counter()
+        for url, meta in self.responses.items():
+            parts = urlsplit(url)
+            self.hosts[parts.netloc] = parts.scheme
+            if meta["content_type"].startswith("text/html"):
+                html_hosts[parts.netloc] += 1
+        self.default_host = html_hosts.most_common(1)[0][0] if html_hosts else next(iter(self.hosts), "")
+
+    @property
+    def base_url(self) -> str:
+        return f"http://127.0.0.1:{self.server_address[1]}"
+
+    def local_url(self, url: str) -> str:
+        """The address on this server that replays the recorded `url`."""
+        parts = urlsplit(url)
+        query = f"?{parts.query}" if parts.query else ""
+        return f"{self.base_url}/{parts.netloc}{parts.path}{query}"
+
+    def original_url(self, request_path: str) -> str:
+        first, _, rest = request_path.lstrip("/").partition("/")
+        host = first.split("?")[0]
+        if host in self.hosts:
+            path = "/" + rest
+        else:
+            host, path = self.default_host, request_path
+        return f"{self.hosts.get(host, 'https')}://{host}{path}"
+
+    def body(self, url: str) -> bytes:
+        meta = self.responses[url]
+        if url in self._rewritten:
+            return self._rewritten[url]
+        with open(os.path.join(self.fixtures_dir, meta["file"]), "rb") as f:
+            data = f.read()
+        if meta["content_type"].startswith("text/html"):
+            text = data.decode("utf-8", errors="replace")
+            for host, scheme in self.hosts.items():
+                text = text.replace(f"{scheme}://{host}", f"{self.base_url}/{host}")
+                text = text.replace(f'"//{host}', f'"{self.base_url}/{host}')
+            data = text.encode("utf-8")
+            self._rewritten[url] = data
+        return data
+
+    def count(self, key, amount: int = 1) -> None:
+        with self._stats_lock:
+            self.stats[key] += amount
+
+
+class ReplayHandler(BaseHTTPRequestHandler):
+    server: ReplayServer
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send(self, status: int, body: bytes = b"", content_type: str = "text/plain", headers: dict | None = None):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        if self.command != "HEAD":
+            self.wfile.write(body)
+        self.server.count(status)
+        self.server.count("bytes", len(body))
+
+    def do_GET(self):
+        server = self.server
+        time.sleep(server.latency + server.random.uniform(0, server.jitter))
+
+        roll = server.random.random()
+        if roll < server.throttle_rate:
+            return self._send(429, headers={"Retry-After": "1"})
+        if roll < server.throttle_rate + server.error_rate:
+            return self._send(503)
+
+        url = server.original_url(self.path)
+        if url not in server.responses:
+            return self._send(404)
+        self._send(200, server.body(url), server.responses[url]["content_type"])
+
+    do_HEAD = do_GET
+
+
+def start_server(fixtures_dir: str, **options) -> ReplayServer:
+    """Start a ReplayServer on a free port in a background thread."""
+    server = ReplayServer(fixtures_dir, **options)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("fixtures_dir")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--latency-ms", type=float, default=0.0)
+    parser.add_argument("--jitter-ms", type=float, default=0.0)
+    parser.add_argument("--throttle-rate", type=float, default=0.0, help="Fraction of requests answered with 429.")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of requests answered with 503.")
+    args = parser.parse_args()
+
+    server = ReplayServer(args.fixtures_dir, port=args.port, latency=args.latency_ms / 1000,
+                          jitter=args.jitter_ms / 1000, throttle_rate=args.throttle_rate, error_rate=args.error_rate)
+    print(f"Replaying {len(server.responses)} responses on {server.base_url}")
+    for seed in server.manifest.get("seeds", []):
+        print(f"Seed list: {server.local_url(seed)}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print(f"Stats: {dict(server.stats)}")
+
+
+if __name__ == "__main__":
+    main()